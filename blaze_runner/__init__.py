@@ -5,6 +5,8 @@
 __author__ = """J. Michael Burgess"""
 __email__ = 'jburgess@mpe.mpg.de'
 
+import importlib
+from typing import TYPE_CHECKING
 
 from .utils.configuration import blaze_runner_config, show_configuration
 from .utils.logging import (
@@ -13,11 +15,59 @@ from .utils.logging import (
     silence_warnings,
 )
 
-from .model import Leptonic, LogParabola
-from .observation import DataSet
-from .analysis import Analysis
+if TYPE_CHECKING:
+    from .model import Leptonic, LogParabola
+    from .observation import DataSet
+    from .analysis import Analysis
 
 
 from . import _version
 
 __version__ = _version.get_versions()['version']
+
+
+# the model, observation and analysis modules pull in threeML,
+# astromodels, netspec, gdpyc and mpi4py. They are only imported
+# when one of their members is first requested so that importing
+# the package stays cheap on every MPI rank
+
+_lazy_members = {
+    "Leptonic": "model",
+    "LogParabola": "model",
+    "DataSet": "observation",
+    "Analysis": "analysis",
+}
+
+
+def __getattr__(name: str):
+    if name not in _lazy_members:
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}"
+        )
+
+    module = importlib.import_module(f".{_lazy_members[name]}", __name__)
+
+    member = getattr(module, name)
+
+    # cache it so that __getattr__ is not hit again
+
+    globals()[name] = member
+
+    return member
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_members))
+
+
+__all__ = [
+    "blaze_runner_config",
+    "show_configuration",
+    "update_logging_level",
+    "activate_warnings",
+    "silence_warnings",
+    "Leptonic",
+    "LogParabola",
+    "DataSet",
+    "Analysis",
+]
@@ -0,0 +1,161 @@
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+import astropy.units as u
+import numpy as np
+from astromodels import Function1D
+
+from .utils.logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+# number of energy grids for which tables are kept, the least
+# recently used is dropped. Each plugin evaluates the model on its own
+# grid, the photometric filters alone bring more than a dozen, so this
+# is per function and as many as the fused evaluation keeps
+
+_max_tables = 64
+
+
+class TabulatedTransmission:
+    def __init__(
+        self, function: Function1D, column: str, reference: float
+    ) -> None:
+        """
+        a replacement for the evaluate of an absorption component
+        whose transmission is exp(-column * tau(E)), with tau depending
+        on the energy, the other parameters and the properties of the
+        function but not on the column.
+
+        tau is obtained once per energy grid from the original evaluate
+        at a reference column and every further call is a single
+        exp(-column * tau)
+
+        :param function: the absorption component
+        :type function: Function1D
+        :param column: the name of the column parameter
+        :type column: str
+        :param reference: the column used to compute tau. It should be
+        small enough that the transmission does not underflow
+        :type reference: float
+        :returns:
+
+        """
+        self._function: Function1D = function
+
+        self._column_index: int = list(function.parameters.keys()).index(
+            column
+        )
+
+        self._reference: float = reference
+
+        self._tables: Dict[Tuple, np.ndarray] = OrderedDict()
+
+    def _original(self, x: np.ndarray, *args) -> np.ndarray:
+        return type(self._function).evaluate(self._function, x, *args)
+
+    def _key(self, x: np.ndarray, args: Tuple) -> Tuple:
+        others = args[: self._column_index] + args[self._column_index + 1 :]
+
+        properties = self._function.properties
+
+        if properties is None:
+            properties = {}
+
+        return (
+            x.tobytes(),
+            tuple(float(v) for v in others),
+            tuple((k, str(v.value)) for k, v in properties.items()),
+        )
+
+    def _tabulate(self, x: np.ndarray, args: Tuple) -> np.ndarray:
+        args = list(args)
+
+        args[self._column_index] = self._reference
+
+        transmission = self._original(x, *args)
+
+        with np.errstate(divide="ignore"):
+            tau = -np.log(transmission) / self._reference
+
+        if not np.all(np.isfinite(tau)):
+            msg = (
+                f"the transmission of {self._function.name} underflows at "
+                f"the reference column {self._reference}"
+            )
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+        return tau
+
+    def tau(self, x: np.ndarray, *args) -> np.ndarray:
+        """
+        the optical depth per unit column on the energy grid x
+
+        :param x: the energies
+        :type x: np.ndarray
+        :returns:
+
+        """
+        key = self._key(x, args)
+
+        tau = self._tables.get(key)
+
+        if tau is not None:
+            self._tables.move_to_end(key)
+
+            return tau
+
+        tau = self._tabulate(x, args)
+
+        self._tables[key] = tau
+
+        if len(self._tables) > _max_tables:
+            self._tables.popitem(last=False)
+
+        return tau
+
+    def __call__(self, x: Any, *args) -> Any:
+        if isinstance(x, u.Quantity):
+            # the slow call with units is left to the original
+
+            return self._original(x, *args)
+
+        return np.exp(-args[self._column_index] * self.tau(x, *args))
+
+    def clear(self) -> None:
+        self._tables.clear()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the tables are rebuilt on first use
+
+        state = self.__dict__.copy()
+
+        state["_tables"] = OrderedDict()
+
+        return state
+
+
+def tabulate_transmission(
+    function: Function1D, column: str, reference: float
+) -> Function1D:
+    """
+    switch an absorption component to tabulated evaluation.
+    astromodels looks evaluate up on the instance so this works for
+    the component alone and inside composite functions
+
+    :param function: the absorption component
+    :type function: Function1D
+    :param column: the name of the column parameter
+    :type column: str
+    :param reference: the column used to compute the tables
+    :type reference: float
+    :returns:
+
+    """
+    function.evaluate = TabulatedTransmission(function, column, reference)
+
+    return function
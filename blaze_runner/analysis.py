@@ -1,17 +1,24 @@
+import time
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Union
+
 import numpy as np
 import yaml
 from astromodels import Log_normal
 from mpi4py import MPI
-from threeML import BayesianAnalysis, FermipyLike
+from rich.console import Console
+import threeML.bayesian.ultranest_sampler
+from threeML import BayesianAnalysis
+from threeML.bayesian.multinest_sampler import MultiNestSampler
 
+from .checkpoint import checkpoint_sampler, resume_sampler
 from .model import Leptonic, LogParabola, Model
-from .observation import DataSet
+from .observation import DataSet, LATObservation
+from .utils.configuration import blaze_runner_config
 from .utils.logging import setup_logger
-
-comm = MPI.COMM_WORLD
-rank = comm.Get_rank()
-size = comm.Get_size()
-
+from .utils.profiling import Profiler
 
 log = setup_logger(__name__)
 
@@ -19,8 +26,67 @@ log = setup_logger(__name__)
 _available_models = {"leptonic": Leptonic, "logparabola": LogParabola}
 
 
+class _UltraNestOn:
+    def __init__(self, module: Any, comm: MPI.Comm) -> None:
+        # the ultranest module as seen by the threeML sampler, whose
+        # samplers run on comm instead of COMM_WORLD
+
+        self._module = module
+
+        self.ReactiveNestedSampler = partial(
+            module.ReactiveNestedSampler, comm=comm
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._module, name)
+
+
+@contextmanager
+def _sampler_world(analysis_comm: MPI.Comm) -> Iterator[None]:
+    # the threeML UltraNest sampler takes its ranks from module globals
+    # set from COMM_WORLD at import and lets UltraNest default to
+    # COMM_WORLD. Only the globals of that module are pointed at the
+    # ranks of the analysis while it samples, any other code which
+    # uses COMM_WORLD is not redirected
+
+    sampler_module = threeML.bayesian.ultranest_sampler
+
+    names = ("comm", "rank", "using_mpi", "ultranest")
+
+    saved = {
+        k: getattr(sampler_module, k)
+        for k in names
+        if hasattr(sampler_module, k)
+    }
+
+    sampler_module.comm = analysis_comm
+    sampler_module.rank = analysis_comm.Get_rank()
+    sampler_module.using_mpi = analysis_comm.Get_size() > 1
+
+    if "ultranest" in saved:
+        sampler_module.ultranest = _UltraNestOn(
+            saved["ultranest"], analysis_comm
+        )
+
+    try:
+        yield
+
+    finally:
+        for k in names:
+            if k in saved:
+                setattr(sampler_module, k, saved[k])
+
+            elif hasattr(sampler_module, k):
+                delattr(sampler_module, k)
+
+
 class Analysis:
-    def __init__(self, model: Model, data_set: DataSet) -> None:
+    def __init__(
+        self,
+        model: Model,
+        data_set: DataSet,
+        comm: Optional[MPI.Comm] = None,
+    ) -> None:
         """
         creates an analysis from a data set and a model
 
@@ -28,32 +94,47 @@ class Analysis:
         :type model: Model
         :param data_set:
         :type data_set: DataSet
+        :param comm: the ranks running the analysis, by default
+        COMM_WORLD
+        :type comm: Optional[MPI.Comm]
         :returns:
 
         """
+        self._comm: MPI.Comm = comm if comm is not None else MPI.COMM_WORLD
 
-        randNum = np.zeros(1)
+        timings: Dict[str, float] = {}
 
-        if rank == 0:
-            self._ba = BayesianAnalysis(model.model, data_set.data_list)
+        t0 = time.perf_counter()
 
-            if size > 1:
-                comm.Isend(randNum, dest=1, tag=11)
-                log.info(f"rank {rank} SENDING")
+        # the only work that has to be ordered between the ranks:
+        # the LAT products are made once and shared between them
 
-        else:
-            log.info(f"rank {rank} WAITNG")
-            req = comm.Irecv(randNum, source=rank - 1, tag=11)
-            req.Wait()
+        data_set.setup(model.model, self._comm)
+
+        timings["setup"] = time.perf_counter() - t0
+
+        # everything else is independent on every rank
+
+        t0 = time.perf_counter()
+
+        self._ba = BayesianAnalysis(model.model, data_set.data_list)
+
+        timings["bayesian_analysis"] = time.perf_counter() - t0
+
+        # once the model is set, the plugins hold all their read-only
+        # arrays and one copy per node is kept
 
-            self._ba = BayesianAnalysis(model.model, data_set.data_list)
-            log.info(f"rank {rank} FINISHED")
+        if blaze_runner_config.performance.share_memory:
+            t0 = time.perf_counter()
 
-            if rank < size - 1:
-                comm.Isend(randNum, dest=rank + 1, tag=11)
+            data_set.share(self._comm)
+
+            timings["share"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
 
         for obs in data_set.observations:
-            if not isinstance(obs.plugin, FermipyLike):
+            if not isinstance(obs, LATObservation):
                 obs.plugin.assign_to_source(model.source_name)
 
             else:
@@ -64,12 +145,221 @@ class Analysis:
                     f"{obs.plugin.name}_isodiff_Normalization"
                 ].prior = Log_normal(mu=0, sigma=0.05)
 
+        timings["priors"] = time.perf_counter() - t0
+
+        # one likelihood evaluation tabulates the absorption on every
+        # grid and lets the model learn the grids of the plugins
+
+        t0 = time.perf_counter()
+
+        for plugin in data_set.data_list.values():
+            plugin.get_log_like()
+
+        if blaze_runner_config.performance.union_energy_grid:
+            model.use_union_grid()
+
+        timings["warm_up"] = time.perf_counter() - t0
+
+        self._startup_timings: Dict[str, float] = timings
+
+        self._report_startup()
+
+        # the warm up is not part of the profile
+
+        self._profiler: Optional[Profiler] = None
+
+        if blaze_runner_config.performance.profile_likelihood:
+            self._profiler = Profiler()
+
+            for plugin in data_set.data_list.values():
+                self._profiler.wrap(plugin, "get_log_like", plugin.name)
+
+            shape = model.model.sources[model.source_name].spectrum.main.shape
+
+            self._profiler.wrap(shape, "evaluate", "model")
+
+    def _report_startup(self) -> None:
+        timings = self._startup_timings
+
+        rank = self._comm.Get_rank()
+        size = self._comm.Get_size()
+
+        log.info(
+            f"rank {rank} started in {sum(timings.values()):.2f} s ("
+            + ", ".join(f"{k}: {v:.2f} s" for k, v in timings.items())
+            + ")"
+        )
+
+        all_timings = self._comm.gather(timings, root=0)
+
+        if rank == 0 and size > 1:
+            for k in timings:
+                values = np.array([t[k] for t in all_timings])
+
+                log.info(
+                    f"startup {k} over {size} ranks: "
+                    f"min {values.min():.2f} s, "
+                    f"median {np.median(values):.2f} s, "
+                    f"max {values.max():.2f} s"
+                )
+
+    @property
+    def startup_timings(self) -> Dict[str, float]:
+        """
+        the time in seconds spent by this rank in each stage of the
+        construction of the analysis
+
+        """
+        return self._startup_timings
+
+    @property
+    def comm(self) -> MPI.Comm:
+        return self._comm
+
     @property
     def ba(self) -> BayesianAnalysis:
         return self._ba
 
+    @property
+    def profiler(self) -> Optional[Profiler]:
+        """
+        the call counts and latencies of the log likelihood of every
+        plugin and of the model evaluation on this rank, None unless
+        performance.profile_likelihood is set. The model evaluations
+        are part of the plugin calls
+
+        """
+        return self._profiler
+
+    def sample(
+        self,
+        quiet: bool = False,
+        checkpoint: Optional[Union[str, Path]] = None,
+        checkpoint_every: int = 100,
+    ) -> None:
+        """
+        sample the posterior with the sampler set on the
+        BayesianAnalysis. Must be called on all ranks. If profiling,
+        the calls of all ranks are summarized at the end.
+
+        With a checkpoint directory, the emcee, multinest and ultranest
+        samplers save their state as they go and an interrupted run
+        can be continued with resume. If performance.stream_posterior
+        is set, emcee also streams its samples to the checkpoint
+        directory rather than keeping them in memory while it samples;
+        without a checkpoint directory or with another sampler a
+        warning is logged and nothing is streamed. At the end rank 0
+        reads the whole chain back into the results, unless
+        performance.load_streamed_posterior is off, in which case
+        there are no results and the samples are left in the stream
+        file of the sampler
+
+        :param quiet: whether to keep the sampler quiet
+        :type quiet: bool
+        :param checkpoint: the directory to write checkpoints to
+        :type checkpoint: Optional[Union[str, Path]]
+        :param checkpoint_every: the iterations between checkpoints
+        :type checkpoint_every: int
+        :returns:
+
+        """
+        if (
+            blaze_runner_config.performance.stream_posterior
+            and checkpoint is None
+            and self._comm.Get_rank() == 0
+        ):
+            log.warning(
+                "performance.stream_posterior is set but the samples are "
+                "kept in memory, they are streamed to the checkpoint "
+                "directory and there is none"
+            )
+
+        if checkpoint is not None:
+            checkpoint_sampler(
+                self._ba,
+                checkpoint,
+                every=checkpoint_every,
+                comm=self._comm,
+                stream=blaze_runner_config.performance.stream_posterior,
+                load_stream=(
+                    blaze_runner_config.performance.load_streamed_posterior
+                ),
+            )
+
+        self._sample(quiet)
+
+    def resume(
+        self, checkpoint: Union[str, Path], quiet: bool = False
+    ) -> None:
+        """
+        continue sampling from the last checkpoint written by sample,
+        with the sampler and setup it was started with. The analysis
+        must have the same free parameters. Must be called on all ranks
+
+        :param checkpoint: the checkpoint directory
+        :type checkpoint: Union[str, Path]
+        :param quiet: whether to keep the sampler quiet
+        :type quiet: bool
+        :returns:
+
+        """
+        resume_sampler(self._ba, checkpoint, comm=self._comm)
+
+        self._sample(quiet)
+
+    def _sample(self, quiet: bool) -> None:
+        if self._comm.Get_size() == MPI.COMM_WORLD.Get_size():
+            self._ba.sample(quiet=quiet)
+
+        elif isinstance(self._ba.sampler, MultiNestSampler):
+            msg = "MultiNest samples over all of COMM_WORLD and cannot run on a part of it, use ultranest or emcee"
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+        else:
+            with _sampler_world(self._comm):
+                self._ba.sample(quiet=quiet)
+
+        if self._profiler is not None:
+            self._report_profile()
+
+    def _report_profile(self) -> None:
+        summaries = self._profiler.gather(self._comm)
+
+        rank = self._comm.Get_rank()
+        size = self._comm.Get_size()
+
+        log.debug(
+            f"rank {rank} likelihood profile: {self._profiler.statistics}"
+        )
+
+        if rank != 0:
+            return
+
+        table = Profiler.table(
+            summaries, title=f"likelihood calls over {size} ranks"
+        )
+
+        Console().print(table)
+
     @classmethod
-    def from_file(cls, file_name: str) -> "Analysis":
+    def from_file(
+        cls, file_name: str, comm: Optional[MPI.Comm] = None
+    ) -> "Analysis":
+        """
+        build an analysis from a YAML file with its data and model and
+        optionally the sampler (name and setup)
+
+        :param file_name: the configuration
+        :type file_name: str
+        :param comm: the ranks running the analysis, by default
+        COMM_WORLD
+        :type comm: Optional[MPI.Comm]
+        :returns:
+
+        """
         with open(file_name, "r") as f:
             data = yaml.load(f, Loader=yaml.SafeLoader)
 
@@ -79,4 +369,13 @@ class Analysis:
 
         model = _available_models[model_type](**data["model"])
 
-        return cls(model, data_set)
+        analysis = cls(model, data_set, comm=comm)
+
+        if "sampler" in data:
+            sampler = data["sampler"]
+
+            analysis.ba.set_sampler(sampler["name"])
+
+            analysis.ba.sampler.setup(**sampler.get("setup", {}))
+
+        return analysis
@@ -0,0 +1,378 @@
+import argparse
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import yaml
+from mpi4py import MPI
+from rich.console import Console
+from rich.table import Table
+
+from .analysis import Analysis
+from .checkpoint import has_checkpoint
+from .scheduling import (
+    CostModel,
+    WorkQueue,
+    append_cost,
+    job_sizes,
+    journal_file,
+    longest_first,
+    plan_pools,
+    split_pools,
+)
+from .shared_memory import free_windows
+from .utils.logging import setup_logger
+
+comm = MPI.COMM_WORLD
+rank = comm.Get_rank()
+size = comm.Get_size()
+
+log = setup_logger(__name__)
+
+
+_results_name = "results.fits"
+
+_checkpoint_name = "checkpoint"
+
+_costs_name = "costs.json"
+
+
+def _run_job(
+    config_file: Path,
+    job_dir: Path,
+    job_comm: MPI.Comm,
+    checkpoint_every: int,
+    quiet: bool,
+) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+
+    results_file = job_dir / _results_name
+
+    # a batch started again after it was stopped skips the finished
+    # jobs and resumes the interrupted ones
+
+    if results_file.exists():
+        log.info(f"{config_file} is done, skipping it")
+
+        return dict(status="done before", time=0.0)
+
+    analysis = Analysis.from_file(str(config_file), comm=job_comm)
+
+    checkpoint = job_dir / _checkpoint_name
+
+    if has_checkpoint(checkpoint):
+        analysis.resume(checkpoint, quiet=quiet)
+
+    else:
+        analysis.sample(
+            quiet=quiet,
+            checkpoint=checkpoint,
+            checkpoint_every=checkpoint_every,
+        )
+
+    if job_comm.Get_rank() == 0:
+        if analysis.ba.results is None:
+            msg = f"{config_file} has no results to write, the batch needs performance.load_streamed_posterior"
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+        analysis.ba.results.write_to(str(results_file), overwrite=True)
+
+    return dict(status="done", time=time.perf_counter() - t0)
+
+
+def _run_or_fail(
+    config_file: Path,
+    job_dir: Path,
+    job_comm: MPI.Comm,
+    checkpoint_every: int,
+    quiet: bool,
+) -> Dict[str, Any]:
+    # a job which fails on all ranks of its group, e.g. with a missing
+    # file or a bad configuration, is recorded and the group goes on
+    # with the next one. A failure on some of the ranks while the others
+    # wait for them in the sampler cannot be recovered from
+
+    t0 = time.perf_counter()
+
+    try:
+        record = _run_job(
+            config_file, job_dir, job_comm, checkpoint_every, quiet
+        )
+
+        error = None
+
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+
+        log.error(
+            f"{config_file} failed on rank {job_comm.Get_rank()} of its "
+            f"group: {error}"
+        )
+
+    # the ranks of the group agree on the outcome
+
+    errors = [e for e in job_comm.allgather(error) if e is not None]
+
+    # the next job of the group shares its own arrays
+
+    free_windows()
+
+    if errors:
+        return dict(
+            status="failed",
+            time=time.perf_counter() - t0,
+            message=errors[0],
+        )
+
+    return record
+
+
+def _run_jobs(
+    queue: WorkQueue,
+    pool: int,
+    group: MPI.Comm,
+    config_files: List[Path],
+    configs: List[Dict[str, Any]],
+    output_dir: Path,
+    journal: Path,
+    checkpoint_every: int,
+    quiet: bool,
+) -> Dict[int, Dict[str, Any]]:
+    records: Dict[int, Dict[str, Any]] = {}
+
+    while True:
+        # the leader draws the next job for its group
+
+        job = queue.next(pool) if group.Get_rank() == 0 else None
+
+        job = group.bcast(job, root=0)
+
+        if job is None:
+            return records
+
+        name = config_files[job].stem
+
+        record = _run_or_fail(
+            config_files[job],
+            output_dir / name,
+            group,
+            checkpoint_every,
+            quiet,
+        )
+
+        if group.Get_rank() == 0:
+            records[job] = dict(record, ranks=group.Get_size())
+
+            if record["status"] == "done":
+                append_cost(journal, name, configs[job], record["time"])
+
+
+def run_batch(
+    config_files: Sequence[Union[str, Path]],
+    output_dir: Union[str, Path],
+    ranks_per_job: Optional[int] = None,
+    checkpoint_every: int = 100,
+    quiet: bool = True,
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    run the analyses of many configurations inside one allocation.
+    Rank 0 hands out the jobs and runs none itself, unless it is the
+    only rank. Every job runs on as many ranks as the ranks entry of
+    its configuration requests, or else ranks_per_job, or else its
+    share of the ranks by estimated run time. The other ranks are split
+    into a pool of groups for every size of job, and whenever a group
+    is free it takes the next job of its pool, ordered by estimated
+    run time, longest first, so that the short jobs fill the gaps at
+    the end.
+
+    The run times are estimated from the data types and model of the
+    configurations and the times measured in earlier batches with the
+    same output directory. Every job is recorded as it finishes, also
+    if the batch is stopped later. A job which fails is reported with
+    its error and the group takes the next one.
+
+    Every job samples with checkpoints and writes its results to
+    output_dir/<name of the configuration>, so a batch which is started
+    again continues where it was stopped. The configurations are those
+    of Analysis.from_file, with their sampler. MultiNest needs all of
+    COMM_WORLD and cannot be used. Must be called on all ranks
+
+    :param config_files: the configuration of every job
+    :type config_files: Sequence[Union[str, Path]]
+    :param output_dir: where the results and checkpoints are written
+    :type output_dir: Union[str, Path]
+    :param ranks_per_job: the number of ranks running each job
+    without a ranks entry
+    :type ranks_per_job: Optional[int]
+    :param checkpoint_every: the iterations between checkpoints
+    :type checkpoint_every: int
+    :param quiet: whether to keep the samplers quiet
+    :type quiet: bool
+    :returns: the name, ranks, status, estimated and measured time of
+    every job, with the error of those which failed, on rank 0, None on
+    the others
+
+    """
+    config_files = [Path(f) for f in config_files]
+
+    names = [f.stem for f in config_files]
+
+    n_jobs = len(config_files)
+
+    if len(set(names)) != n_jobs:
+        msg = "the configurations must have different names, their results are written by name"
+
+        log.error(msg)
+
+        raise RuntimeError(msg)
+
+    output_dir = Path(output_dir)
+
+    costs_file = output_dir / _costs_name
+
+    configs: Optional[List[Dict[str, Any]]] = None
+
+    estimates: Optional[List[float]] = None
+
+    if rank == 0:
+        cost_model = CostModel.load(costs_file)
+
+        configs = []
+
+        for f in config_files:
+            with f.open() as stream:
+                configs.append(yaml.load(stream, Loader=yaml.SafeLoader))
+
+            (output_dir / f.stem).mkdir(parents=True, exist_ok=True)
+
+        estimates = [cost_model.estimate(*job) for job in zip(names, configs)]
+
+    configs, estimates = comm.bcast((configs, estimates), root=0)
+
+    # with more than one rank, rank 0 only hands out the jobs
+
+    dispatcher = size > 1 and rank == 0
+
+    n_workers = size - 1 if size > 1 else 1
+
+    sizes = job_sizes(
+        [c.get("ranks") for c in configs], estimates, n_workers, ranks_per_job
+    )
+
+    pools, job_pools = plan_pools(sizes, estimates, n_workers)
+
+    order = longest_first(estimates)
+
+    queue = WorkQueue(
+        comm,
+        [[j for j in order if job_pools[j] == p] for p in range(len(pools))],
+    )
+
+    group, pool = split_pools(comm, pools)
+
+    log.info(
+        f"running {n_jobs} jobs on "
+        + ", ".join(f"{n} groups of {r} ranks" for r, n in pools)
+        + f", estimated {sum(estimates):.0f} s in total"
+    )
+
+    records: Dict[int, Dict[str, Any]] = {}
+
+    if dispatcher:
+        queue.serve(sum(n for _, n in pools))
+
+    else:
+        journal = journal_file(costs_file, rank)
+
+        records = _run_jobs(
+            queue,
+            pool,
+            group,
+            config_files,
+            configs,
+            output_dir,
+            journal,
+            checkpoint_every,
+            quiet,
+        )
+
+    all_records = comm.gather(records, root=0)
+
+    if rank != 0:
+        return None
+
+    # the journals of all ranks are merged into the measurements
+
+    CostModel.load(costs_file).save(costs_file)
+
+    merged = {k: v for r in all_records for k, v in r.items()}
+
+    summary = [
+        dict(name=names[i], estimate=estimates[i], **merged[i])
+        for i in order
+    ]
+
+    table = Table(title=f"{n_jobs} jobs on {size} ranks")
+
+    table.add_column("job")
+    table.add_column("ranks", justify="right")
+    table.add_column("status")
+    table.add_column("estimate [s]", justify="right")
+    table.add_column("time [s]", justify="right")
+
+    for s in summary:
+        table.add_row(
+            s["name"],
+            f"{s['ranks']:d}",
+            s["status"],
+            f"{s['estimate']:.0f}",
+            f"{s['time']:.1f}",
+        )
+
+    Console().print(table)
+
+    for s in summary:
+        if s["status"] == "failed":
+            log.error(f"{s['name']} failed: {s['message']}")
+
+    return summary
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="run the analyses of many configurations in one MPI job"
+    )
+
+    parser.add_argument("configs", nargs="+", help="the YAML configurations")
+    parser.add_argument(
+        "-o", "--output", default="batch", help="the output directory"
+    )
+    parser.add_argument(
+        "--ranks-per-job",
+        type=int,
+        default=None,
+        help="the ranks running each job without a ranks entry, by "
+        "default a share by the estimated run time",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=100,
+        help="the sampler iterations between checkpoints",
+    )
+
+    args = parser.parse_args(argv)
+
+    run_batch(
+        args.configs,
+        args.output,
+        ranks_per_job=args.ranks_per_job,
+        checkpoint_every=args.checkpoint_every,
+    )
+
+
+if __name__ == "__main__":
+    main()
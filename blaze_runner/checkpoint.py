@@ -0,0 +1,671 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+import emcee
+import numpy as np
+from astromodels import use_astromodels_memoization
+from mpi4py import MPI
+from threeML import BayesianAnalysis
+from threeML.bayesian.emcee_sampler import EmceeSampler
+from threeML.bayesian.multinest_sampler import MultiNestSampler
+from threeML.bayesian.sampler_base import SamplerBase
+from threeML.bayesian.ultranest_sampler import UltraNestSampler
+from threeML.config.config import threeML_config
+
+from .io.checkpoint import read_checkpoint, write_checkpoint
+from .io.stream import PosteriorStream, iter_stream
+from .utils.logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+_manifest_name = "manifest.json"
+
+_emcee_state_name = "emcee.h5"
+
+_stream_name = "posterior.h5"
+
+
+class CheckpointedEmceeSampler(EmceeSampler):
+    def setup(
+        self,
+        n_iterations: int,
+        n_burn_in: Optional[int] = None,
+        n_walkers: int = 20,
+        seed: Optional[int] = None,
+        checkpoint_file: Optional[Union[str, Path]] = None,
+        checkpoint_every: int = 100,
+        resume: bool = False,
+        comm: Optional[MPI.Comm] = None,
+        stream_file: Optional[Union[str, Path]] = None,
+        load_stream: bool = True,
+        **kwargs,
+    ):
+        """
+        the emcee sampler of threeML, run in blocks of checkpoint_every
+        iterations after each of which rank 0 of comm writes the
+        walkers, the chain so far and the state of the random number
+        generator to checkpoint_file. A resumed run continues exactly
+        where the checkpoint was written.
+
+        With a stream_file, the samples are appended to it after every
+        block instead of being kept, so that the memory does not grow
+        with the chain while sampling. The checkpoints then only hold
+        the last block. At the end rank 0, which alone has the results,
+        reads the whole chain back to build them, so its memory grows
+        with the chain after all. Without load_stream the results are
+        not built and the chain is left in the stream_file, to be read
+        with iter_stream or read_stream
+
+        :param n_iterations: the number of iterations after the burn in
+        :type n_iterations: int
+        :param n_burn_in: the number of iterations of the burn in
+        :type n_burn_in: Optional[int]
+        :param n_walkers: the number of walkers
+        :type n_walkers: int
+        :param seed: the seed of a new run
+        :type seed: Optional[int]
+        :param checkpoint_file: the checkpoint file
+        :type checkpoint_file: Optional[Union[str, Path]]
+        :param checkpoint_every: the iterations between checkpoints
+        :type checkpoint_every: int
+        :param resume: continue from the checkpoint if there is one
+        :type resume: bool
+        :param comm: the ranks of the analysis, by default COMM_WORLD
+        :type comm: Optional[MPI.Comm]
+        :param stream_file: the file to stream the samples to
+        :type stream_file: Optional[Union[str, Path]]
+        :param load_stream: whether to read the streamed samples back
+        into the results at the end
+        :type load_stream: bool
+        :returns:
+
+        """
+        super().setup(
+            n_iterations,
+            n_burn_in=n_burn_in,
+            n_walkers=n_walkers,
+            seed=seed,
+            **kwargs,
+        )
+
+        self._checkpoint_file: Optional[Path] = (
+            Path(checkpoint_file) if checkpoint_file is not None else None
+        )
+
+        self._checkpoint_every: int = int(checkpoint_every)
+
+        self._resume: bool = resume
+
+        self._comm: MPI.Comm = comm if comm is not None else MPI.COMM_WORLD
+
+        self._stream_file: Optional[Path] = (
+            Path(stream_file) if stream_file is not None else None
+        )
+
+        self._load_stream: bool = load_stream
+
+    @property
+    def stream_file(self) -> Optional[Path]:
+        """
+        the file the samples are streamed to, if any
+
+        """
+        return self._stream_file
+
+    def _log_priors(self, samples: np.ndarray) -> np.ndarray:
+        # the log prior of every row of samples at once, -inf outside
+        # of the priors
+
+        log_prior = np.zeros(len(samples))
+
+        with np.errstate(divide="ignore"):
+            for i, parameter in enumerate(self._free_parameters.values()):
+                log_prior += np.log(parameter.prior(samples[:, i]))
+
+        return log_prior
+
+    def _write_checkpoint(
+        self, phase: str, sampler: emcee.EnsembleSampler, offset: int
+    ) -> None:
+        if self._comm.Get_rank() != 0 or self._checkpoint_file is None:
+            return
+
+        backend = sampler.backend
+
+        bit_generator, key, position, has_gauss, cached = sampler.random_state
+
+        metadata = dict(
+            phase=phase,
+            iteration=backend.iteration,
+            offset=offset,
+            parameters=list(self._free_parameters),
+            bit_generator=bit_generator,
+            random_state=[int(position), int(has_gauss), float(cached)],
+        )
+
+        arrays = dict(
+            chain=backend.get_chain(),
+            log_prob=backend.get_log_prob(),
+            accepted=backend.accepted,
+            random_key=key,
+        )
+
+        write_checkpoint(self._checkpoint_file, metadata, arrays)
+
+    def _restore(
+        self, n_dim: int
+    ) -> Tuple[str, int, emcee.backends.Backend]:
+        metadata, arrays = read_checkpoint(self._checkpoint_file)
+
+        if metadata["parameters"] != list(self._free_parameters):
+            msg = f"{self._checkpoint_file} was written for the parameters {metadata['parameters']}"
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+        backend = emcee.backends.Backend()
+
+        backend.reset(self._n_walkers, n_dim)
+
+        backend.grow(metadata["iteration"], None)
+
+        backend.chain[:] = arrays["chain"]
+        backend.log_prob[:] = arrays["log_prob"]
+        backend.accepted[:] = arrays["accepted"]
+
+        backend.iteration = metadata["iteration"]
+
+        backend.random_state = (
+            metadata["bit_generator"],
+            arrays["random_key"],
+            *metadata["random_state"],
+        )
+
+        return metadata["phase"], metadata.get("offset", 0), backend
+
+    def sample(self, quiet: bool = False):
+        if not self._is_setup:
+            log.info("You forgot to setup the sampler!")
+            return
+
+        loud = not quiet
+
+        self._update_free_parameters()
+
+        n_dim = len(list(self._free_parameters.keys()))
+
+        posterior = self.get_posterior_proxy()
+
+        resume = (
+            self._resume
+            and self._checkpoint_file is not None
+            and self._checkpoint_file.exists()
+        )
+
+        if resume:
+            phase, offset, backend = self._restore(n_dim)
+
+            log.info(
+                f"resuming the {phase.replace('_', ' ')} at iteration "
+                f"{offset + backend.iteration} from {self._checkpoint_file}"
+            )
+
+            sampler = emcee.EnsembleSampler(
+                self._n_walkers, n_dim, posterior, backend=backend
+            )
+
+            # the sampler continues from the last walkers of the backend
+
+            state = None
+
+        else:
+            phase = "burn_in"
+
+            # the iterations of the phase dropped from the backend
+
+            offset = 0
+
+            sampler = emcee.EnsembleSampler(self._n_walkers, n_dim, posterior)
+
+            if self._seed is not None:
+                sampler._random.seed(self._seed)
+
+            state = emcee.State(self._get_starting_points(self._n_walkers))
+
+        streaming = self._stream_file is not None
+
+        stream: Optional[PosteriorStream] = None
+
+        if streaming and self._comm.Get_rank() == 0:
+            # the samples streamed after the checkpoint are dropped
+
+            n_rows = None
+
+            if resume and phase == "sampling":
+                n_rows = (offset + sampler.iteration) * self._n_walkers
+
+            stream = PosteriorStream(
+                self._stream_file,
+                list(self._free_parameters),
+                chunk_size=self._n_walkers * self._checkpoint_every,
+                n_rows=n_rows,
+            )
+
+        n_steps = dict(burn_in=self._n_burn_in, sampling=self._n_iterations)
+
+        progress = bool(threeML_config.interface.progress_bars) and loud
+
+        try:
+            with use_astromodels_memoization(False):
+                while True:
+                    remaining = n_steps[phase] - offset - sampler.iteration
+
+                    while remaining > 0:
+                        if streaming and sampler.iteration > 0:
+                            # the last block is in the stream, only its
+                            # walkers are needed
+
+                            state = sampler.get_last_sample()
+
+                            offset += sampler.iteration
+
+                            sampler.reset()
+
+                        n = min(remaining, self._checkpoint_every)
+
+                        state = sampler.run_mcmc(state, n, progress=progress)
+
+                        remaining -= n
+
+                        if stream is not None and phase == "sampling":
+                            self._stream(stream, sampler)
+
+                        self._write_checkpoint(phase, sampler, offset)
+
+                    if phase == "sampling":
+                        break
+
+                    # as in EmceeSampler, the burn in is discarded
+
+                    state = sampler.get_last_sample()
+
+                    sampler.reset()
+
+                    offset = 0
+
+                    phase = "sampling"
+
+        finally:
+            if stream is not None:
+                stream.close()
+
+        # with streaming, of the last block only
+
+        acc = np.mean(sampler.acceptance_fraction)
+
+        log.info(f"Mean acceptance fraction: {acc}")
+
+        self._sampler = sampler
+
+        if streaming:
+            self._comm.Barrier()
+
+            # as with the other samplers of threeML, only rank 0 reads
+            # the chain and has the results
+
+            if self._comm.Get_rank() != 0:
+                return None
+
+            if not self._load_stream:
+                log.info(
+                    f"the samples are left in {self._stream_file}, read "
+                    "them with iter_stream or read_stream"
+                )
+
+                return None
+
+            samples = []
+
+            log_like = []
+
+            log_prior = []
+
+            for arrays in iter_stream(
+                self._stream_file,
+                chunk_size=self._n_walkers * self._checkpoint_every,
+            ):
+                samples.append(arrays["samples"])
+
+                log_like.append(arrays["log_like"])
+
+                log_prior.append(self._log_priors(samples[-1]))
+
+            self._raw_samples = np.concatenate(samples)
+
+            self._log_like_values = np.concatenate(log_like)
+
+            self._log_probability_values = self._log_like_values + (
+                np.concatenate(log_prior)
+            )
+
+        else:
+            self._raw_samples = sampler.get_chain(flat=True)
+
+            log_prior = self._log_priors(self._raw_samples)
+
+            self._log_probability_values = sampler.get_log_prob(flat=True)
+
+            self._log_like_values = self._log_probability_values - log_prior
+
+        self._marginal_likelihood = None
+
+        self._build_samples_dictionary()
+
+        self._build_results()
+
+        if loud:
+            self._results.display()
+
+        return self.samples
+
+    def _stream(
+        self, stream: PosteriorStream, sampler: emcee.EnsembleSampler
+    ) -> None:
+        samples = sampler.get_chain(flat=True)
+
+        log_prior = self._log_priors(samples)
+
+        log_like = sampler.get_log_prob(flat=True) - log_prior
+
+        stream.append(samples, log_like)
+
+        # the checkpoint written next must not be ahead of the stream
+
+        stream.flush()
+
+
+def _sampler_name(sampler: Optional[SamplerBase]) -> str:
+    for name, cls in (
+        ("emcee", EmceeSampler),
+        ("multinest", MultiNestSampler),
+        ("ultranest", UltraNestSampler),
+    ):
+        if isinstance(sampler, cls):
+            return name
+
+    msg = f"cannot checkpoint the sampler {type(sampler).__name__}, use emcee, multinest or ultranest"
+
+    log.error(msg)
+
+    raise RuntimeError(msg)
+
+
+def _setup_of(name: str, sampler: SamplerBase) -> Dict[str, Any]:
+    # the arguments of setup which rebuild the sampler, those set by
+    # the checkpointing are left out. A resumed run must sample as the
+    # original did, a setting which cannot be written is refused
+
+    if name == "emcee":
+        return dict(
+            n_iterations=sampler._n_iterations,
+            n_burn_in=sampler._n_burn_in,
+            n_walkers=sampler._n_walkers,
+            seed=sampler._seed,
+        )
+
+    if name == "multinest":
+        excluded = (
+            "outputfiles_basename",
+            "chain_name",
+            "resume",
+            "verbose",
+            "n_iter_before_update",
+        )
+
+        setup = dict(sampler._kwargs, auto_clean=sampler._auto_clean)
+
+    else:
+        excluded = ("log_dir", "resume")
+
+        setup = dict(
+            sampler._kwargs,
+            wrapped_params=sampler._wrapped_params,
+            use_mlfriends=sampler._use_mlfriends,
+        )
+
+    out = {}
+
+    for k, v in setup.items():
+        if k in excluded:
+            continue
+
+        try:
+            json.dumps(v)
+
+        except TypeError:
+            msg = f"the {name} setting {k} = {v!r} cannot be checkpointed, a resumed run could not restore it"
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+        out[k] = v
+
+    return out
+
+
+def _install(
+    bayesian_analysis: BayesianAnalysis,
+    directory: Path,
+    name: str,
+    setup: Dict[str, Any],
+    every: int,
+    resume: bool,
+    comm: Optional[MPI.Comm],
+    stream: bool,
+    load_stream: bool,
+) -> None:
+    likelihood_model = bayesian_analysis._likelihood_model
+
+    data_list = bayesian_analysis._data_list
+
+    if name == "emcee":
+        sampler = CheckpointedEmceeSampler(likelihood_model, data_list)
+
+        sampler.setup(
+            **setup,
+            checkpoint_file=directory / _emcee_state_name,
+            checkpoint_every=every,
+            resume=resume,
+            comm=comm,
+            stream_file=directory / _stream_name if stream else None,
+            load_stream=load_stream,
+        )
+
+    elif name == "multinest":
+        # MultiNest writes its live points every n_iter_before_update
+        # iterations and reads them back if resumed
+
+        sampler = MultiNestSampler(likelihood_model, data_list)
+
+        sampler.setup(
+            **setup,
+            chain_name=str(directory / "multinest" / "fit-"),
+            resume=resume,
+            n_iter_before_update=every,
+        )
+
+    else:
+        # UltraNest stores its points as it goes
+
+        sampler = UltraNestSampler(likelihood_model, data_list)
+
+        sampler.setup(
+            **setup,
+            chain_name=str(directory / "ultranest"),
+            resume="resume" if resume else "overwrite",
+        )
+
+    bayesian_analysis._sampler = sampler
+
+
+def checkpoint_sampler(
+    bayesian_analysis: BayesianAnalysis,
+    directory: Union[str, Path],
+    every: int = 100,
+    comm: Optional[MPI.Comm] = None,
+    stream: bool = False,
+    load_stream: bool = True,
+) -> None:
+    """
+    start the sampler set on a BayesianAnalysis afresh, writing
+    checkpoints to a directory from which resume_sampler continues.
+    Rank 0 writes a manifest of the sampler and its setup next to
+    them. Collective over the ranks of the analysis.
+
+    With stream, emcee appends its samples to posterior.h5 in the
+    directory as it goes instead of keeping them in memory, and reads
+    them back into the results at the end unless load_stream is off.
+    The nested samplers write their points to the directory anyway
+
+    :param bayesian_analysis: the analysis
+    :type bayesian_analysis: BayesianAnalysis
+    :param directory: the checkpoint directory
+    :type directory: Union[str, Path]
+    :param every: the iterations between checkpoints
+    :type every: int
+    :param comm: the ranks of the analysis, by default COMM_WORLD
+    :type comm: Optional[MPI.Comm]
+    :param stream: whether to stream the emcee samples to a file
+    :type stream: bool
+    :param load_stream: whether to read the streamed samples back
+    :type load_stream: bool
+    :returns:
+
+    """
+    if comm is None:
+        comm = MPI.COMM_WORLD
+
+    directory = Path(directory)
+
+    sampler = bayesian_analysis.sampler
+
+    name = _sampler_name(sampler)
+
+    setup = _setup_of(name, sampler)
+
+    if stream and name != "emcee" and comm.Get_rank() == 0:
+        log.warning(
+            f"only emcee streams its samples, those of {name} are written "
+            f"to {directory} by the sampler itself"
+        )
+
+    if comm.Get_rank() == 0:
+        directory.mkdir(parents=True, exist_ok=True)
+
+        manifest = dict(
+            sampler=name,
+            setup=setup,
+            every=every,
+            stream=stream,
+            load_stream=load_stream,
+            parameters=list(
+                bayesian_analysis._likelihood_model.free_parameters
+            ),
+        )
+
+        tmp_file = directory / f"{_manifest_name}.{os.getpid()}.tmp"
+
+        with tmp_file.open("w") as f:
+            json.dump(manifest, f, indent=2)
+
+        os.replace(tmp_file, directory / _manifest_name)
+
+    comm.Barrier()
+
+    _install(
+        bayesian_analysis,
+        directory,
+        name,
+        setup,
+        every,
+        False,
+        comm,
+        stream,
+        load_stream,
+    )
+
+    log.info(f"checkpointing the {name} sampler to {directory}")
+
+
+def has_checkpoint(directory: Union[str, Path]) -> bool:
+    """
+    whether a sampler was started with checkpoints in a directory
+
+    :param directory: the checkpoint directory
+    :type directory: Union[str, Path]
+    :returns:
+
+    """
+    return (Path(directory) / _manifest_name).exists()
+
+
+def resume_sampler(
+    bayesian_analysis: BayesianAnalysis,
+    directory: Union[str, Path],
+    comm: Optional[MPI.Comm] = None,
+) -> None:
+    """
+    set up the sampler of a BayesianAnalysis as written to the
+    manifest of a checkpoint directory, continuing from its last
+    checkpoint
+
+    :param bayesian_analysis: the analysis
+    :type bayesian_analysis: BayesianAnalysis
+    :param directory: the checkpoint directory
+    :type directory: Union[str, Path]
+    :param comm: the ranks of the analysis, by default COMM_WORLD
+    :type comm: Optional[MPI.Comm]
+    :returns:
+
+    """
+    directory = Path(directory)
+
+    manifest_file = directory / _manifest_name
+
+    if not manifest_file.exists():
+        msg = f"{directory} has no checkpoint manifest"
+
+        log.error(msg)
+
+        raise RuntimeError(msg)
+
+    with manifest_file.open() as f:
+        manifest = json.load(f)
+
+    parameters = list(bayesian_analysis._likelihood_model.free_parameters)
+
+    if manifest["parameters"] != parameters:
+        msg = f"the checkpoint in {directory} was written for the parameters {manifest['parameters']}, not {parameters}"
+
+        log.error(msg)
+
+        raise RuntimeError(msg)
+
+    _install(
+        bayesian_analysis,
+        directory,
+        manifest["sampler"],
+        manifest["setup"],
+        manifest["every"],
+        True,
+        comm,
+        manifest.get("stream", False),
+        manifest.get("load_stream", True),
+    )
+
+    log.info(f"resuming the {manifest['sampler']} sampler from {directory}")
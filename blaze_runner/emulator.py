@@ -0,0 +1,129 @@
+from typing import Any
+
+import numpy as np
+from scipy.interpolate import PchipInterpolator
+
+from .utils.logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+def batch_pchip(
+    nodes: np.ndarray, values: np.ndarray, points: np.ndarray
+) -> np.ndarray:
+    """
+    evaluate N monotone cubic (PCHIP) interpolants which share their
+    nodes at N different sets of points. values has shape (N, n_nodes)
+    and points (N, n_points). Outside the nodes the end polynomials
+    are extrapolated, as PchipInterpolator does
+
+    :param nodes: the common, increasing nodes
+    :type nodes: np.ndarray
+    :param values: the values of each interpolant at the nodes
+    :type values: np.ndarray
+    :param points: where to evaluate each interpolant
+    :type points: np.ndarray
+    :returns:
+
+    """
+    coefficients = PchipInterpolator(nodes, values, axis=1).c
+
+    idx = np.clip(
+        np.searchsorted(nodes, points, side="right") - 1, 0, len(nodes) - 2
+    )
+
+    rows = np.arange(values.shape[0])[:, np.newaxis]
+
+    dx = points - nodes[idx]
+
+    out = coefficients[0][idx, rows]
+
+    for c in coefficients[1:]:
+        out = out * dx + c[idx, rows]
+
+    return out
+
+
+def evaluate_emulator_batch(
+    emulator: Any, energies: np.ndarray, parameters: np.ndarray
+) -> np.ndarray:
+    """
+    evaluate a netspec EmulatorModel for many parameter vectors with
+    a single forward pass of the network. parameters has shape
+    (N, n_params) with the columns in the order of the emulator
+    parameters (K, scale, redshift, then the network inputs). The
+    result has shape (N, n_energies) and equals N calls of evaluate
+
+    :param emulator: the netspec EmulatorModel
+    :param energies: the energies in keV
+    :type energies: np.ndarray
+    :param parameters: the parameter vectors
+    :type parameters: np.ndarray
+    :returns:
+
+    """
+    parameters = np.atleast_2d(np.asarray(parameters, dtype=float))
+
+    n_rows = parameters.shape[0]
+
+    if parameters.shape[1] != len(emulator.parameters):
+        msg = (
+            f"expected {len(emulator.parameters)} parameters per row, "
+            f"got {parameters.shape[1]}"
+        )
+
+        log.error(msg)
+
+        raise RuntimeError(msg)
+
+    K = parameters[:, 0]
+    scale = parameters[:, 1]
+    redshift = parameters[:, 2]
+
+    inputs = parameters[:, 3:].astype(np.float32)
+
+    storage = emulator._model_storage
+
+    evaluate = (
+        storage.evaluate_raw if emulator._as_raw_model else storage.evaluate
+    )
+
+    if storage._is_convolutional:
+        # convolutional nets take one input at a time
+
+        net_output = np.stack([evaluate(row) for row in inputs])
+
+    else:
+        net_output = evaluate(inputs)
+
+    net_output = np.asarray(net_output, dtype=float).reshape(n_rows, -1)
+
+    if not emulator._as_raw_model:
+        bad = (net_output <= 0) | (~np.isfinite(net_output))
+
+        net_output[bad] = 1e-99
+
+    redshift_scaling = np.array(
+        [emulator._redshift_scaling(z) for z in redshift]
+    )
+
+    # PCHIP is invariant under affine maps of the abscissa, so the
+    # per row nodes (energies * scale) are mapped onto the common
+    # network energies by moving the evaluation points instead
+
+    target = np.outer(redshift_scaling / scale, energies)
+
+    nodes = np.asarray(emulator._energies, dtype=float)
+
+    if emulator._log_interp:
+        flux = batch_pchip(np.log(nodes), net_output, np.log(target))
+
+    else:
+        flux = batch_pchip(nodes, net_output, target)
+
+    factor = K
+
+    if emulator._divide_by_scale:
+        factor = K / scale
+
+    return flux * factor[:, np.newaxis]
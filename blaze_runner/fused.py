@@ -0,0 +1,407 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import astropy.units as u
+import numpy as np
+from astromodels import Function1D
+from astromodels.functions.function import (
+    CompositeFunction,
+    _cf_evaluate_func_func,
+)
+
+from .absorption import TabulatedTransmission
+from .utils.logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+# number of energy grids for which the factors are kept
+
+_max_grids = 64
+
+
+class _Grid:
+    def __init__(self, n_absorbers: int, energies: np.ndarray) -> None:
+        """
+        the state of the fused evaluation on one energy grid
+
+        """
+        n_energies = len(energies)
+
+        self.energies: np.ndarray = energies.copy()
+
+        # where the energies are in the union grid, if they are part
+        # of it
+
+        self.union_index: Optional[np.ndarray] = None
+        # optical depth per unit column of every absorber
+
+        self.taus: np.ndarray = np.empty((n_absorbers, n_energies))
+
+        # the parameters (other than the columns) and properties
+        # of the absorbers the taus were computed for
+
+        self.tau_key: Optional[Tuple] = None
+
+        # the last output of each factor and the parameters and
+        # properties it was computed for
+
+        self.absorption: np.ndarray = np.empty(n_energies)
+
+        self.absorption_key: Optional[Tuple] = None
+
+        self.spectrum: Optional[np.ndarray] = None
+
+        self.spectrum_key: Optional[Tuple] = None
+
+
+class FusedAbsorbedSpectrum:
+    def __init__(
+        self, absorbers: List[Function1D], spectrum: Function1D
+    ) -> None:
+        """
+        a flat evaluation of absorber_1 * ... * absorber_n * spectrum
+        which replaces the walk through the composite expression
+        tree. The absorbers must be tabulated, so that the absorption
+        is exp(-sum_i column_i * tau_i(E)) which is evaluated as one
+        matrix product and exp into an array kept per energy grid.
+
+        The absorption and the spectrum remember their last output per
+        grid and are only recomputed when their own parameters change,
+        e.g. a proposal that only moves the spectrum reuses the
+        absorption.
+
+        Every call returns a new array, the cached factors are never
+        handed out
+
+        :param absorbers: the tabulated absorption components
+        :type absorbers: List[Function1D]
+        :param spectrum: the intrinsic spectrum
+        :type spectrum: Function1D
+        :returns:
+
+        """
+        for absorber in absorbers:
+            if not isinstance(absorber.evaluate, TabulatedTransmission):
+                msg = f"{absorber.name} is not tabulated and cannot be fused"
+
+                log.error(msg)
+
+                raise RuntimeError(msg)
+
+        self._absorbers: List[Function1D] = absorbers
+        self._spectrum: Function1D = spectrum
+
+        # composite spectra (e.g. a sum of log parabolas) evaluate
+        # through their own tree
+
+        self._spectrum_is_composite: bool = isinstance(
+            spectrum, CompositeFunction
+        )
+
+        # the flat parameter vector is the absorber parameters followed
+        # by the spectrum parameters, as in the composite
+
+        self._parameters: List[Any] = [
+            p for f in absorbers for p in f.parameters.values()
+        ] + list(spectrum.parameters.values())
+
+        self._absorber_slices: List[slice] = []
+
+        self._columns: List[int] = []
+
+        start = 0
+
+        for absorber in absorbers:
+            stop = start + len(absorber.parameters)
+
+            self._absorber_slices.append(slice(start, stop))
+
+            self._columns.append(start + absorber.evaluate._column_index)
+
+            start = stop
+
+        self._n_absorber_parameters: int = start
+
+        self._others: np.ndarray = np.setdiff1d(
+            np.arange(start), self._columns
+        )
+
+        self._grids: Dict[bytes, _Grid] = OrderedDict()
+
+        # the union of the energy grids, on which the spectrum is
+        # evaluated once for all of them
+
+        self._union: Optional[np.ndarray] = None
+
+        self._union_spectrum: Optional[np.ndarray] = None
+
+        self._union_key: Optional[Tuple] = None
+
+        self._hits: Dict[str, int] = dict(absorption=0, spectrum=0)
+        self._misses: Dict[str, int] = dict(absorption=0, spectrum=0)
+
+    @property
+    def n_parameters(self) -> int:
+        return len(self._parameters)
+
+    def parameter_vector(self) -> np.ndarray:
+        """
+        the current values of the parameters, including linked ones
+
+        :returns:
+
+        """
+        return np.fromiter(
+            (p.value for p in self._parameters),
+            dtype=float,
+            count=len(self._parameters),
+        )
+
+    def _grid(self, x: np.ndarray) -> _Grid:
+        key = x.tobytes()
+
+        grid = self._grids.get(key)
+
+        if grid is None:
+            grid = _Grid(len(self._absorbers), x)
+
+            self._grids[key] = grid
+
+            if len(self._grids) > _max_grids:
+                self._grids.popitem(last=False)
+
+        return grid
+
+    def _properties(self, functions: List[Function1D]) -> Tuple:
+        return tuple(
+            str(v.value)
+            for f in functions
+            for v in (f.properties or {}).values()
+        )
+
+    def _update_taus(
+        self, x: np.ndarray, grid: _Grid, parameters: np.ndarray
+    ) -> None:
+        tau_key = tuple(parameters[self._others]) + self._properties(
+            self._absorbers
+        )
+
+        if tau_key == grid.tau_key:
+            return
+
+        for i, (absorber, s) in enumerate(
+            zip(self._absorbers, self._absorber_slices)
+        ):
+            grid.taus[i] = absorber.evaluate.tau(x, *parameters[s])
+
+        grid.tau_key = tau_key
+
+    def _absorption(
+        self, x: np.ndarray, grid: _Grid, parameters: np.ndarray
+    ) -> np.ndarray:
+        key = tuple(
+            parameters[: self._n_absorber_parameters]
+        ) + self._properties(self._absorbers)
+
+        if key == grid.absorption_key:
+            self._hits["absorption"] += 1
+
+            return grid.absorption
+
+        self._misses["absorption"] += 1
+
+        self._update_taus(x, grid, parameters)
+
+        out = grid.absorption
+
+        np.dot(parameters[self._columns], grid.taus, out=out)
+
+        np.negative(out, out=out)
+
+        np.exp(out, out=out)
+
+        grid.absorption_key = key
+
+        return out
+
+    def _evaluate_spectrum(
+        self, x: np.ndarray, grid: _Grid, parameters: np.ndarray
+    ) -> np.ndarray:
+        key = tuple(
+            parameters[self._n_absorber_parameters :]
+        ) + self._properties([self._spectrum])
+
+        if key == grid.spectrum_key:
+            self._hits["spectrum"] += 1
+
+            return grid.spectrum
+
+        if grid.union_index is None:
+            self._misses["spectrum"] += 1
+
+            grid.spectrum = self._spectrum_on(x, parameters)
+
+        else:
+            grid.spectrum = self._spectrum_on_union(key, parameters)[
+                grid.union_index
+            ]
+
+        grid.spectrum_key = key
+
+        return grid.spectrum
+
+    def _spectrum_on(
+        self, x: np.ndarray, parameters: np.ndarray
+    ) -> np.ndarray:
+        if self._spectrum_is_composite:
+            return self._spectrum(x)
+
+        return self._spectrum.evaluate(
+            x, *parameters[self._n_absorber_parameters :]
+        )
+
+    def _spectrum_on_union(
+        self, key: Tuple, parameters: np.ndarray
+    ) -> np.ndarray:
+        if key == self._union_key:
+            self._hits["spectrum"] += 1
+
+            return self._union_spectrum
+
+        self._misses["spectrum"] += 1
+
+        self._union_spectrum = self._spectrum_on(self._union, parameters)
+
+        self._union_key = key
+
+        return self._union_spectrum
+
+    def use_union_grid(self) -> int:
+        """
+        from now on, evaluate the spectrum once per parameter point on
+        the union of the energy grids it has been evaluated on so far
+        and give each grid its part of it. Energies shared between
+        grids (e.g. observations with the same response) are evaluated
+        once. Grids seen later are evaluated on their own
+
+        :returns: the number of energies in the union
+
+        """
+        if not self._grids:
+            msg = "the spectrum has not been evaluated on any grid yet"
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+        grids = list(self._grids.values())
+
+        self._union = np.unique(np.concatenate([g.energies for g in grids]))
+
+        for grid in grids:
+            grid.union_index = np.searchsorted(self._union, grid.energies)
+
+            grid.spectrum_key = None
+
+        self._union_key = None
+
+        log.debug(
+            f"evaluating the spectrum on {len(self._union)} energies for "
+            f"{len(grids)} grids of {sum(len(g.energies) for g in grids)}"
+        )
+
+        return len(self._union)
+
+    def kernel(self, x: np.ndarray, parameters: np.ndarray) -> np.ndarray:
+        """
+        evaluate the absorbed spectrum on the energies x for the
+        flat parameter vector
+
+        :param x: the energies
+        :type x: np.ndarray
+        :param parameters: the parameter vector
+        :type parameters: np.ndarray
+        :returns:
+
+        """
+        grid = self._grid(x)
+
+        # a new array, callers may keep the result
+
+        return self._absorption(x, grid, parameters) * self._evaluate_spectrum(
+            x, grid, parameters
+        )
+
+    def cache_info(self) -> Dict[str, Dict[str, int]]:
+        """
+        how often the output of each factor was reused (hits) or
+        recomputed (misses)
+
+        :returns:
+
+        """
+        return {
+            k: dict(hits=self._hits[k], misses=self._misses[k])
+            for k in self._hits
+        }
+
+    def reset_cache_info(self) -> None:
+        for k in self._hits:
+            self._hits[k] = 0
+            self._misses[k] = 0
+
+    def __call__(self, np_operator, f1, f2, x: Any) -> Any:
+        # called by the composite in place of its expression tree
+
+        if isinstance(x, u.Quantity):
+            return _cf_evaluate_func_func(np_operator, f1, f2, x)
+
+        return self.kernel(x, self.parameter_vector())
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+
+        state["_grids"] = OrderedDict()
+
+        state["_union"] = None
+        state["_union_spectrum"] = None
+        state["_union_key"] = None
+
+        state["_hits"] = dict.fromkeys(self._hits, 0)
+        state["_misses"] = dict.fromkeys(self._misses, 0)
+
+        return state
+
+
+def fuse_absorbed_spectrum(
+    shape: CompositeFunction,
+    absorbers: List[Function1D],
+    spectrum: Function1D,
+) -> CompositeFunction:
+    """
+    switch the composite shape absorber_1 * ... * spectrum to the
+    fused evaluation. The composite stays an ordinary astromodels
+    function, only its evaluate is replaced
+
+    :param shape: the composite built from the absorbers and spectrum
+    :type shape: CompositeFunction
+    :param absorbers: the tabulated absorbers in the composite
+    :type absorbers: List[Function1D]
+    :param spectrum: the spectrum in the composite
+    :type spectrum: Function1D
+    :returns:
+
+    """
+    fused = FusedAbsorbedSpectrum(absorbers, spectrum)
+
+    if fused.n_parameters != len(shape.parameters):
+        msg = "the composite is not the product of the absorbers and spectrum"
+
+        log.error(msg)
+
+        raise RuntimeError(msg)
+
+    shape.evaluate = fused
+
+    return shape
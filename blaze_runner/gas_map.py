@@ -0,0 +1,347 @@
+import os
+import shutil
+import tempfile
+import warnings
+from functools import lru_cache
+from pathlib import Path
+from typing import Union
+
+import astropy.coordinates as coords
+import astropy.units as u
+import numpy as np
+import yaml
+from astropy.io import fits
+from astropy.utils.exceptions import AstropyWarning
+from astropy.wcs import WCS
+from astropy_healpix import HEALPix
+from gdpyc import GasMap
+
+from .utils.logging import setup_logger
+from .utils.package_data import get_path_of_cache_dir
+
+log = setup_logger(__name__)
+
+
+_index_version = 1
+
+# HEALPix resolution of the index. The HEASoft images have
+# 0.675 deg pixels, nside 64 cells are ~0.9 deg across
+
+_default_nside = 64
+
+# GasMap.nhf only considers a 3 x 3 deg box of image pixels around the
+# position (the ftools nh default). It is reproduced so that the index
+# gives identical results
+
+_box_size = 3.0
+
+
+def _angular_distance(vectors: np.ndarray, center: np.ndarray) -> np.ndarray:
+    """
+    angular distance in degrees between unit vectors, using the chord
+    length which stays accurate for small separations
+
+    """
+    chord = np.linalg.norm(vectors - center, axis=1)
+
+    return np.rad2deg(2.0 * np.arcsin(np.clip(0.5 * chord, 0.0, 1.0)))
+
+
+def _concatenate_ranges(starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """
+    vectorized np.concatenate([np.arange(a, b) for a, b in zip(starts, stops)])
+
+    """
+    lengths = stops - starts
+
+    keep = lengths > 0
+
+    starts = starts[keep]
+    lengths = lengths[keep]
+
+    if len(lengths) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+
+    return np.arange(lengths.sum()) + offsets
+
+
+class NHIndex:
+    def __init__(self, directory: Union[str, Path]) -> None:
+        """
+        a memory mapped, HEALPix indexed copy of the HEASoft NH images
+        shipped with gdpyc. It answers the same radius averaged query
+        as GasMap.nhf without re-reading the survey for every call and
+        can be shared read-only between processes
+
+        :param directory: the directory holding a built index
+        :type directory: Union[str, Path]
+        :returns:
+
+        """
+        self._directory: Path = Path(directory)
+
+        with (self._directory / "index.yml").open("r") as f:
+            meta = yaml.load(f, Loader=yaml.SafeLoader)
+
+        if meta["version"] != _index_version:
+            msg = f"NH index in {self._directory} is outdated, rebuild it"
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+        self._nhmap: str = meta["nhmap"]
+        self._nside: int = meta["nside"]
+
+        # the pixels are stored sorted by HEALPix cell so that
+        # the pixels of cell i are vectors[offsets[i]:offsets[i+1]]
+
+        self._vectors: np.ndarray = np.load(
+            self._directory / "vectors.npy", mmap_mode="r"
+        )
+        self._nh: np.ndarray = np.load(
+            self._directory / "nh.npy", mmap_mode="r"
+        )
+        self._offsets: np.ndarray = np.load(
+            self._directory / "offsets.npy", mmap_mode="r"
+        )
+        self._pixels: np.ndarray = np.load(
+            self._directory / "pixels.npy", mmap_mode="r"
+        )
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", AstropyWarning)
+
+            self._wcs: WCS = WCS(
+                fits.Header.fromtextfile(str(self._directory / "header.txt"))
+            )
+
+        self._half_box: float = (
+            _box_size / self._wcs.wcs.cdelt[1] - 1
+        ) / 2.0
+
+        self._healpix = HEALPix(
+            nside=self._nside, order="nested", frame=coords.Galactic()
+        )
+
+        self._margin: u.Quantity = self._healpix.pixel_resolution
+
+    @property
+    def nhmap(self) -> str:
+        return self._nhmap
+
+    @property
+    def nside(self) -> int:
+        return self._nside
+
+    @classmethod
+    def build(
+        cls,
+        directory: Union[str, Path],
+        nhmap: str = "DL",
+        nside: int = _default_nside,
+    ) -> "NHIndex":
+        """
+        build the index from the gdpyc HEASoft image of an HI survey.
+        The index is written to a temporary directory first and moved
+        into place so that concurrent builders do not see partial files
+
+        :param directory: where to write the index
+        :type directory: Union[str, Path]
+        :param nhmap: the HI survey (LAB or DL)
+        :type nhmap: str
+        :param nside: HEALPix nside of the index
+        :type nside: int
+        :returns:
+
+        """
+        if nhmap not in ["LAB", "DL"]:
+            msg = "Only LAB and DL maps are available"
+
+            log.error(msg)
+
+            raise ValueError(msg)
+
+        directory = Path(directory)
+
+        log.info(f"building the {nhmap} NH index in {directory}")
+
+        image_file = (
+            Path(str(GasMap._data_path))
+            / f"{GasMap._map_type}_{nhmap}_heasoft.fits"
+        )
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", AstropyWarning)
+
+            with fits.open(image_file) as f:
+                image = np.array(f[0].data, dtype=float)
+                wcs = WCS(f[0].header)
+
+        # as in GasMap.nhf, only pixels with values are used
+
+        y, x = np.nonzero(image > 0)
+
+        sky = wcs.pixel_to_world(x, y).galactic
+
+        vectors = np.ascontiguousarray(sky.cartesian.xyz.value.T)
+
+        healpix = HEALPix(nside=nside, order="nested", frame=coords.Galactic())
+
+        cells = healpix.skycoord_to_healpix(sky)
+
+        order = np.argsort(cells, kind="stable")
+
+        offsets = np.searchsorted(cells[order], np.arange(healpix.npix + 1))
+
+        directory.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_dir = Path(tempfile.mkdtemp(dir=directory.parent))
+
+        np.save(tmp_dir / "vectors.npy", vectors[order])
+        np.save(tmp_dir / "nh.npy", image[y, x][order])
+        np.save(tmp_dir / "offsets.npy", offsets)
+        np.save(tmp_dir / "pixels.npy", np.stack([x, y], axis=1)[order])
+
+        wcs.to_header().totextfile(str(tmp_dir / "header.txt"))
+
+        with (tmp_dir / "index.yml").open("w") as f:
+            yaml.dump(
+                dict(version=_index_version, nhmap=nhmap, nside=nside), f
+            )
+
+        try:
+            os.replace(tmp_dir, directory)
+
+        except OSError:
+            # someone else finished first
+
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        return cls(directory)
+
+    @classmethod
+    def from_cache(cls, nhmap: str = "DL") -> "NHIndex":
+        """
+        load the index of an HI survey from the cache directory,
+        building it on first use
+
+        :param nhmap: the HI survey (LAB or DL)
+        :type nhmap: str
+        :returns:
+
+        """
+        directory = get_path_of_cache_dir() / "nh_index" / nhmap
+
+        if not (directory / "index.yml").is_file():
+            return cls.build(directory, nhmap=nhmap)
+
+        try:
+            return cls(directory)
+
+        except RuntimeError:
+            shutil.rmtree(directory, ignore_errors=True)
+
+            return cls.build(directory, nhmap=nhmap)
+
+    def _average(
+        self,
+        vector: np.ndarray,
+        center: np.ndarray,
+        cells: np.ndarray,
+        radius: float,
+    ) -> float:
+        idx = _concatenate_ranges(
+            self._offsets[cells], self._offsets[cells + 1]
+        )
+
+        pixels = self._pixels[idx]
+
+        low = np.round(center - self._half_box)
+        high = np.round(center + self._half_box)
+
+        in_box = np.all((pixels >= low) & (pixels <= high), axis=1)
+
+        distance = _angular_distance(self._vectors[idx], vector)
+
+        # same selection and weighting as GasMap.nhf
+
+        good = in_box & (distance <= radius) & (distance > 0)
+
+        weights = (radius - distance[good]) / radius
+
+        if len(weights) == 0:
+            warnings.warn(
+                f"No points are within {radius} deg from input position.",
+                AstropyWarning,
+            )
+
+            return np.nan
+
+        return np.sum(self._nh[idx][good] * weights) / weights.sum()
+
+    def nh(
+        self,
+        ra: Union[float, np.ndarray],
+        dec: Union[float, np.ndarray],
+        radius: float = 1.0,
+    ) -> Union[float, np.ndarray]:
+        """
+        the weighted mean HI column density (cm^-2) within radius of
+        the given ICRS positions. Scalar positions give a float, arrays
+        of positions (e.g. a whole catalog) give an array
+
+        :param ra: right ascension in deg
+        :param dec: declination in deg
+        :param radius: averaging radius in deg
+        :type radius: float
+        :returns:
+
+        """
+        if radius > 3:
+            msg = "radius must be <= 3 deg!!!"
+
+            log.error(msg)
+
+            raise ValueError(msg)
+
+        scalar = np.ndim(ra) == 0 and np.ndim(dec) == 0
+
+        sky = coords.SkyCoord(
+            ra=np.atleast_1d(ra), dec=np.atleast_1d(dec), unit="deg", frame="icrs"
+        ).galactic
+
+        vectors = sky.cartesian.xyz.value.T
+
+        centers = np.stack(self._wcs.world_to_pixel(sky), axis=1)
+
+        cone = (radius * u.deg) + self._margin
+
+        out = np.empty(len(vectors))
+
+        for i, (vector, center, lon, lat) in enumerate(
+            zip(vectors, centers, sky.l, sky.b)
+        ):
+            cells = self._healpix.cone_search_lonlat(lon, lat, cone)
+
+            out[i] = self._average(vector, center, cells, radius)
+
+        if scalar:
+            return float(out[0])
+
+        return out
+
+
+@lru_cache(maxsize=None)
+def get_nh_index(nhmap: str = "DL") -> NHIndex:
+    """
+    the process wide NH index of an HI survey
+
+    :param nhmap: the HI survey (LAB or DL)
+    :type nhmap: str
+    :returns:
+
+    """
+    return NHIndex.from_cache(nhmap)
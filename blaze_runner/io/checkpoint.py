@@ -0,0 +1,79 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Tuple, Union
+
+import h5py
+import numpy as np
+
+from ..utils.logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+_checkpoint_version = 1
+
+
+def write_checkpoint(
+    file_name: Union[str, Path],
+    metadata: Dict[str, Any],
+    arrays: Dict[str, np.ndarray],
+) -> None:
+    """
+    write the state of a sampler to an HDF5 file. The file is written
+    next to the old one and moved over it, so a run killed while
+    writing leaves the previous checkpoint intact. The metadata is
+    stored as JSON
+
+    :param file_name: the checkpoint file
+    :type file_name: Union[str, Path]
+    :param metadata: the scalars of the state
+    :type metadata: Dict[str, Any]
+    :param arrays: the arrays of the state
+    :type arrays: Dict[str, np.ndarray]
+    :returns:
+
+    """
+    file_name = Path(file_name)
+
+    tmp_file = file_name.with_suffix(f".{os.getpid()}.tmp")
+
+    with h5py.File(tmp_file, "w") as f:
+        f.attrs["version"] = _checkpoint_version
+
+        f.attrs["metadata"] = json.dumps(metadata)
+
+        for k, v in arrays.items():
+            f.create_dataset(k, data=v)
+
+    os.replace(tmp_file, file_name)
+
+    log.debug(f"wrote checkpoint {file_name}")
+
+
+def read_checkpoint(
+    file_name: Union[str, Path],
+) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """
+    read the state of a sampler written by write_checkpoint
+
+    :param file_name: the checkpoint file
+    :type file_name: Union[str, Path]
+    :returns: the metadata and the arrays
+
+    """
+    with h5py.File(file_name, "r") as f:
+        version = f.attrs["version"]
+
+        if version != _checkpoint_version:
+            msg = f"{file_name} has version {version}, expected {_checkpoint_version}"
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+        metadata = json.loads(f.attrs["metadata"])
+
+        arrays = {k: v[()] for k, v in f.items()}
+
+    return metadata, arrays
@@ -0,0 +1,125 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Tuple, Union
+
+import h5py
+import numpy as np
+
+from ..utils.logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+_snapshot_version = 1
+
+# an entry is the metadata and the arrays of one observation
+
+Entry = Tuple[Dict[str, Any], Dict[str, np.ndarray]]
+
+
+def write_snapshot(file_name: Union[str, Path], entries: List[Entry]) -> None:
+    """
+    write observations to a single HDF5 snapshot. The arrays are
+    stored contiguous and uncompressed so that they can be memory
+    mapped when read back. The metadata is stored as JSON
+
+    :param file_name: the snapshot file
+    :type file_name: Union[str, Path]
+    :param entries: the metadata and arrays of the observations
+    :type entries: List[Entry]
+    :returns:
+
+    """
+    file_name = Path(file_name)
+
+    tmp_file = file_name.with_suffix(f".{os.getpid()}.tmp")
+
+    with h5py.File(tmp_file, "w") as f:
+        f.attrs["version"] = _snapshot_version
+        f.attrs["n_observations"] = len(entries)
+
+        for i, (metadata, arrays) in enumerate(entries):
+            group = f.create_group(f"observation_{i:04d}")
+
+            group.attrs["metadata"] = json.dumps(metadata)
+
+            for k, v in arrays.items():
+                # a dataset with data given at creation time is
+                # allocated contiguously
+
+                group.create_dataset(k, data=np.ascontiguousarray(v))
+
+    os.replace(tmp_file, file_name)
+
+    log.info(f"wrote {len(entries)} observations to {file_name}")
+
+
+def _memory_map(file_name: Path, dataset: h5py.Dataset) -> np.ndarray:
+    offset = dataset.id.get_offset()
+
+    if offset is None or dataset.size == 0:
+        # nothing is allocated for empty datasets
+
+        return dataset[()]
+
+    # copy on write, threeML sorts some arrays in place
+
+    return np.memmap(
+        file_name,
+        dtype=dataset.dtype,
+        mode="c",
+        offset=offset,
+        shape=dataset.shape,
+    )
+
+
+def read_snapshot(file_name: Union[str, Path]) -> List[Entry]:
+    """
+    read the observations of a snapshot. The arrays are memory maps
+    of the file, nothing is read before it is used
+
+    :param file_name: the snapshot file
+    :type file_name: Union[str, Path]
+    :returns:
+
+    """
+    file_name = Path(file_name)
+
+    entries: List[Entry] = []
+
+    with h5py.File(file_name, "r") as f:
+        if f.attrs["version"] != _snapshot_version:
+            msg = (
+                f"{file_name} is a version {f.attrs['version']} snapshot, "
+                f"version {_snapshot_version} is required"
+            )
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+        for i in range(f.attrs["n_observations"]):
+            group = f[f"observation_{i:04d}"]
+
+            metadata = json.loads(group.attrs["metadata"])
+
+            arrays = {
+                k: _memory_map(file_name, v)
+                for k, v in group.items()
+                if v.dtype.kind not in "SO"
+            }
+
+            # strings (e.g. band names) are small and read directly
+
+            arrays.update(
+                {
+                    k: v.asstr()[()]
+                    for k, v in group.items()
+                    if v.dtype.kind in "SO"
+                }
+            )
+
+            entries.append((metadata, arrays))
+
+    return entries
@@ -0,0 +1,306 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import h5py
+import numpy as np
+
+from ..utils.logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+_stream_version = 1
+
+
+class PosteriorStream:
+    def __init__(
+        self,
+        file_name: Union[str, Path],
+        parameters: Sequence[str],
+        chunk_size: int = 1024,
+        n_rows: Optional[int] = None,
+    ) -> None:
+        """
+        append posterior samples, their log likelihoods and weights to
+        a chunked, compressed HDF5 file as the sampler produces them.
+        At most chunk_size rows are held in memory. The file is written
+        in SWMR mode, so read_stream can read what was flushed while
+        the run goes on.
+
+        A new file is started unless n_rows is given, in which case the
+        existing file is continued after its first n_rows rows, e.g.
+        those up to the checkpoint a run is resumed from
+
+        :param file_name: the stream file
+        :type file_name: Union[str, Path]
+        :param parameters: the names of the sampled parameters
+        :type parameters: Sequence[str]
+        :param chunk_size: the rows per chunk of the file
+        :type chunk_size: int
+        :param n_rows: the rows of an existing file to keep
+        :type n_rows: Optional[int]
+        :returns:
+
+        """
+        self._file_name: Path = Path(file_name)
+
+        self._parameters: List[str] = list(parameters)
+
+        self._chunk_size: int = int(chunk_size)
+
+        if n_rows is None:
+            self._file = self._create(self._file_name)
+
+        else:
+            self._file = self._continue(n_rows)
+
+        # the datasets cannot be created any more, only grown
+
+        self._file.swmr_mode = True
+
+        self._n_rows: int = self._file["log_like"].shape[0]
+
+        self._buffer: List[Tuple[np.ndarray, ...]] = []
+
+        self._n_buffered: int = 0
+
+    def _create(self, file_name: Path) -> h5py.File:
+        n_dim = len(self._parameters)
+
+        f = h5py.File(file_name, "w", libver="latest")
+
+        f.attrs["version"] = _stream_version
+
+        f.attrs["parameters"] = json.dumps(self._parameters)
+
+        for name, shape in (
+            ("samples", (n_dim,)),
+            ("log_like", ()),
+            ("weights", ()),
+        ):
+            f.create_dataset(
+                name,
+                shape=(0, *shape),
+                maxshape=(None, *shape),
+                chunks=(self._chunk_size, *shape),
+                dtype=np.float64,
+                compression="gzip",
+                shuffle=True,
+            )
+
+        return f
+
+    def _continue(self, n_rows: int) -> h5py.File:
+        # a writer which was killed leaves the file flagged as open, it
+        # can only be read. The rows to keep are copied chunk by chunk
+        # to a new file which replaces it
+
+        tmp_file = self._file_name.with_suffix(f".{os.getpid()}.tmp")
+
+        with h5py.File(
+            self._file_name, "r", libver="latest", swmr=True
+        ) as old:
+            self._check(old)
+
+            n_written = min(dataset.shape[0] for dataset in old.values())
+
+            if n_written < n_rows:
+                msg = f"{self._file_name} has {n_written} rows, fewer than the {n_rows} to continue after"
+
+                log.error(msg)
+
+                raise RuntimeError(msg)
+
+            f = self._create(tmp_file)
+
+            for name, dataset in old.items():
+                f[name].resize(n_rows, axis=0)
+
+                for start in range(0, n_rows, self._chunk_size):
+                    stop = min(start + self._chunk_size, n_rows)
+
+                    f[name][start:stop] = dataset[start:stop]
+
+        os.replace(tmp_file, self._file_name)
+
+        return f
+
+    def _check(self, f: h5py.File) -> None:
+        version = f.attrs["version"]
+
+        if version != _stream_version:
+            msg = f"{self._file_name} has version {version}, expected {_stream_version}"
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+        parameters = json.loads(f.attrs["parameters"])
+
+        if parameters != self._parameters:
+            msg = f"{self._file_name} was written for the parameters {parameters}"
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+    @property
+    def n_rows(self) -> int:
+        """
+        the number of rows appended so far, including the buffered ones
+
+        :returns:
+
+        """
+        return self._n_rows + self._n_buffered
+
+    def append(
+        self,
+        samples: np.ndarray,
+        log_like: np.ndarray,
+        weights: Optional[np.ndarray] = None,
+    ) -> None:
+        """
+        append rows of samples, written once a chunk is full
+
+        :param samples: the samples, one row per sample
+        :type samples: np.ndarray
+        :param log_like: their log likelihoods
+        :type log_like: np.ndarray
+        :param weights: their weights, by default one
+        :type weights: Optional[np.ndarray]
+        :returns:
+
+        """
+        samples = np.asarray(samples, dtype=np.float64).reshape(
+            -1, len(self._parameters)
+        )
+
+        log_like = np.asarray(log_like, dtype=np.float64).reshape(-1)
+
+        if weights is None:
+            weights = np.ones_like(log_like)
+
+        weights = np.asarray(weights, dtype=np.float64).reshape(-1)
+
+        if not (len(samples) == len(log_like) == len(weights)):
+            msg = f"got {len(samples)} samples, {len(log_like)} log likelihoods and {len(weights)} weights"
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+        self._buffer.append((samples, log_like, weights))
+
+        self._n_buffered += len(log_like)
+
+        if self._n_buffered >= self._chunk_size:
+            self._write()
+
+    def _write(self) -> None:
+        if self._n_buffered == 0:
+            return
+
+        start = self._n_rows
+
+        self._n_rows += self._n_buffered
+
+        for name, rows in zip(
+            ("samples", "log_like", "weights"), zip(*self._buffer)
+        ):
+            dataset = self._file[name]
+
+            dataset.resize(self._n_rows, axis=0)
+
+            dataset[start:] = np.concatenate(rows)
+
+        self._buffer = []
+
+        self._n_buffered = 0
+
+    def flush(self) -> None:
+        """
+        write the buffered rows and make them visible to readers
+
+        :returns:
+
+        """
+        self._write()
+
+        self._file.flush()
+
+    def close(self) -> None:
+        self.flush()
+
+        self._file.close()
+
+        log.debug(f"wrote {self._n_rows} samples to {self._file_name}")
+
+
+def _rows(
+    f: h5py.File, file_name: Union[str, Path]
+) -> Tuple[List[str], int]:
+    version = f.attrs["version"]
+
+    if version != _stream_version:
+        msg = f"{file_name} has version {version}, expected {_stream_version}"
+
+        log.error(msg)
+
+        raise RuntimeError(msg)
+
+    parameters = json.loads(f.attrs["parameters"])
+
+    # the datasets are grown one after the other, keep the rows all of
+    # them have
+
+    for dataset in f.values():
+        dataset.refresh()
+
+    return parameters, min(dataset.shape[0] for dataset in f.values())
+
+
+def read_stream(
+    file_name: Union[str, Path],
+) -> Tuple[List[str], Dict[str, np.ndarray]]:
+    """
+    read the rows of a PosteriorStream, also while it is written
+
+    :param file_name: the stream file
+    :type file_name: Union[str, Path]
+    :returns: the parameter names and the samples, log_like and
+    weights
+
+    """
+    with h5py.File(file_name, "r", libver="latest", swmr=True) as f:
+        parameters, n_rows = _rows(f, file_name)
+
+        arrays = {k: v[:n_rows] for k, v in f.items()}
+
+    return parameters, arrays
+
+
+def iter_stream(
+    file_name: Union[str, Path], chunk_size: int = 65536
+) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    the rows of a PosteriorStream in blocks of at most chunk_size
+    rows, so that a long chain can be worked through without holding
+    the file in memory
+
+    :param file_name: the stream file
+    :type file_name: Union[str, Path]
+    :param chunk_size: the rows per block
+    :type chunk_size: int
+    :returns: the samples, log_like and weights of every block
+
+    """
+    with h5py.File(file_name, "r", libver="latest", swmr=True) as f:
+        _, n_rows = _rows(f, file_name)
+
+        for start in range(0, n_rows, chunk_size):
+            stop = min(start + chunk_size, n_rows)
+
+            yield {k: v[start:stop] for k, v in f.items()}
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from astromodels import Model as LikelihoodModel
+
+from .utils.logging import setup_logger
+from .utils.package_data import get_path_of_cache_dir
+
+log = setup_logger(__name__)
+
+
+# the configuration sections the data products depend on
+
+_product_sections = ("data", "selection", "binning", "gtlike")
+
+_chunk_size = 1 << 24
+
+
+def _is_source_map(product: Path) -> bool:
+    return product.name.startswith("srcmap")
+
+
+def file_hash(file_name: Path) -> str:
+    """
+    the blake2b hash of the content of a file. As the event and
+    spacecraft files are large, the hash is remembered for the path,
+    size and modification time of the file
+
+    :param file_name: the file to hash
+    :type file_name: Path
+    :returns:
+
+    """
+    file_name = Path(file_name).resolve()
+
+    stat = file_name.stat()
+
+    index_file = get_path_of_cache_dir() / "file_hashes.json"
+
+    index: Dict[str, Any] = {}
+
+    if index_file.is_file():
+        try:
+            with index_file.open("r") as f:
+                index = json.load(f)
+
+        except json.JSONDecodeError:
+            index = {}
+
+    stamp = [stat.st_size, stat.st_mtime_ns]
+
+    entry = index.get(str(file_name))
+
+    if entry is not None and entry["stamp"] == stamp:
+        return entry["hash"]
+
+    h = hashlib.blake2b(digest_size=20)
+
+    with file_name.open("rb") as f:
+        for chunk in iter(lambda: f.read(_chunk_size), b""):
+            h.update(chunk)
+
+    index[str(file_name)] = dict(stamp=stamp, hash=h.hexdigest())
+
+    tmp_file = index_file.with_suffix(f".{os.getpid()}.tmp")
+
+    with tmp_file.open("w") as f:
+        json.dump(index, f)
+
+    os.replace(tmp_file, index_file)
+
+    return h.hexdigest()
+
+
+def _store(product: Path, destination: Path) -> None:
+    if destination.exists():
+        return
+
+    destination.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_file = destination.with_suffix(f".{os.getpid()}.tmp")
+
+    shutil.copy2(product, tmp_file)
+
+    os.replace(tmp_file, destination)
+
+
+class LATProductCache:
+    def __init__(
+        self,
+        configuration: Dict[str, Any],
+        likelihood_model: LikelihoodModel,
+    ) -> None:
+        """
+        a content addressed store of the Fermipy setup products.
+
+        The livetime and counts cubes, the selected events and the
+        exposure maps are keyed by the content of the event and
+        spacecraft files and the selection, binning and likelihood
+        configuration. The source maps are additionally keyed by the
+        positions of the point sources in the model and the spatial
+        shapes of the extended ones, with the content of their
+        templates, but not by their spectra, so a new spectral model
+        reuses everything
+
+        :param configuration: the FermipyLike configuration
+        :type configuration: Dict[str, Any]
+        :param likelihood_model: the model of the analysis
+        :type likelihood_model: LikelihoodModel
+        :returns:
+
+        """
+        self._root: Path = get_path_of_cache_dir() / "lat_products"
+
+        self._data_key: str = self._hash(self._data_description(configuration))
+
+        self._source_key: str = self._hash(
+            [self._data_key, self._source_description(likelihood_model)]
+        )
+
+    @staticmethod
+    def _hash(description: Any) -> str:
+        text = json.dumps(description, sort_keys=True, default=str)
+
+        return hashlib.blake2b(text.encode(), digest_size=20).hexdigest()
+
+    @staticmethod
+    def _data_description(configuration: Dict[str, Any]) -> Dict[str, Any]:
+        description = {
+            k: dict(configuration[k])
+            for k in _product_sections
+            if k in configuration
+        }
+
+        # the data files are identified by their content, not path
+
+        for k in ("evfile", "scfile"):
+            description["data"][k] = file_hash(Path(configuration["data"][k]))
+
+        return description
+
+    @staticmethod
+    def _spatial_description(shape: Any) -> List[Any]:
+        # the position and extent of an extended source are parameters
+        # of its spatial shape, a template is a file given as property
+
+        description: List[Any] = [shape.name]
+
+        for name, parameter in sorted(shape.parameters.items()):
+            description.append((name, round(parameter.value, 8)))
+
+        for name, prop in sorted((shape.properties or {}).items()):
+            value = prop.value
+
+            if isinstance(value, str) and Path(value).is_file():
+                value = file_hash(Path(value))
+
+            description.append((name, value))
+
+        return description
+
+    @classmethod
+    def _source_description(
+        cls,
+        likelihood_model: LikelihoodModel,
+    ) -> List[Any]:
+        point_sources: List[Tuple[str, float, float]] = sorted(
+            (
+                name,
+                round(source.position.ra.value, 8),
+                round(source.position.dec.value, 8),
+            )
+            for name, source in likelihood_model.point_sources.items()
+        )
+
+        extended_sources = sorted(
+            [name] + cls._spatial_description(source.spatial_shape)
+            for name, source in likelihood_model.extended_sources.items()
+        )
+
+        return point_sources + extended_sources
+
+    @property
+    def data_directory(self) -> Path:
+        return self._root / self._data_key
+
+    @property
+    def source_directory(self) -> Path:
+        return self.data_directory / "srcmaps" / self._source_key
+
+    def restore(self, outdir: Path) -> bool:
+        """
+        attach the cached products to a Fermipy output directory. The
+        data products are linked, the source maps copied as fermipy
+        updates them in place
+
+        :param outdir: the Fermipy output directory
+        :type outdir: Path
+        :returns: whether there was anything to restore
+
+        """
+        if not self.data_directory.is_dir():
+            return False
+
+        outdir.mkdir(parents=True, exist_ok=True)
+
+        products = list(self.data_directory.glob("*.fits")) + list(
+            self.source_directory.glob("*.fits")
+        )
+
+        for product in products:
+            destination = outdir / product.name
+
+            if destination.exists():
+                continue
+
+            if _is_source_map(product):
+                shutil.copy2(product, destination)
+
+            else:
+                destination.symlink_to(product)
+
+        log.info(f"restored {len(products)} LAT products into {outdir}")
+
+        return len(products) > 0
+
+    def store(self, outdir: Path) -> None:
+        """
+        add the products of a finished Fermipy setup to the cache
+
+        :param outdir: the Fermipy output directory
+        :type outdir: Path
+        :returns:
+
+        """
+        for product in outdir.glob("*.fits"):
+            if product.is_symlink():
+                # already in the cache
+
+                continue
+
+            if _is_source_map(product):
+                _store(product, self.source_directory / product.name)
+
+            else:
+                _store(product, self.data_directory / product.name)
+
+        log.debug(f"cached the LAT products of {outdir}")
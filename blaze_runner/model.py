@@ -1,8 +1,14 @@
-from typing import Optional
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+from collections.abc import Sequence
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
 
 import astromodels
-import astropy.coordinates as coords
-import astropy.units as u
 import numpy as np
 from astro_custom import TbAbsCut
 from astromodels import (
@@ -19,13 +25,18 @@ from astromodels import (
     load_model,
 )
 from astropy.cosmology import Planck18 as cosmo
-from gdpyc import GasMap
 from netspec import EmulatorModel
 
 
 from threeML.catalogs.Fermi import ModelFrom3FGL, silence_warnings
 
+from .absorption import TabulatedTransmission, tabulate_transmission
+from .emulator import evaluate_emulator_batch
+from .fused import FusedAbsorbedSpectrum, fuse_absorbed_spectrum
+from .gas_map import get_nh_index
+from .utils.configuration import blaze_runner_config
 from .utils.logging import setup_logger
+from .utils.package_data import get_path_of_cache_dir
 
 log = setup_logger(__name__)
 
@@ -33,6 +44,113 @@ log = setup_logger(__name__)
 silence_warnings()
 
 
+# column (10^22 cm^-2) at which the Galactic absorption is tabulated
+
+_reference_nh = 1.0e-3
+
+# E(B-V) at which the host extinction curve is tabulated
+
+_reference_e_bmv = 1.0e-3
+
+
+# sources of the LAT region model within this radius (deg) are freed
+# and their normalizations get log uniform priors spanning this factor
+# around the catalog value
+
+_lat_free_radius = 3.0
+
+_lat_prior_span = 1e5
+
+
+# name of the emulator network of the leptonic model
+
+_leptonic_network = "lepto_ml_fuck"
+
+
+class _SharingPickler(pickle.Pickler):
+    def __init__(self, file: io.BytesIO, shared: Any) -> None:
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self._shared = shared
+
+    def persistent_id(self, obj: Any) -> Optional[str]:
+        return "shared" if obj is self._shared else None
+
+
+class _SharingUnpickler(pickle.Unpickler):
+    def __init__(self, file: io.BytesIO, shared: Any) -> None:
+        super().__init__(file)
+
+        self._shared = shared
+
+    def persistent_load(self, pid: str) -> Any:
+        return self._shared
+
+
+def _copy_sharing(function: Function1D, shared: Any) -> Function1D:
+    """
+    copy an astromodels function while keeping a reference to
+    one of its members instead of copying it. astromodels deep copies
+    by pickling, which would duplicate e.g. an emulator network
+
+    :param function: the function to copy
+    :type function: Function1D
+    :param shared: the object to share between the copies
+    :returns:
+
+    """
+    buffer = io.BytesIO()
+
+    _SharingPickler(buffer, shared).dump(function)
+
+    buffer.seek(0)
+
+    return _SharingUnpickler(buffer, shared).load()
+
+
+@lru_cache(maxsize=None)
+def _emulator_template(network: str) -> EmulatorModel:
+    """
+    the emulator of the leptonic model with its priors set. It is
+    loaded once per process and copied for every source
+
+    :param network: the name of the emulator network
+    :type network: str
+    :returns:
+
+    """
+    spectrum = EmulatorModel(network)
+
+    spectrum.K.fix = True
+    spectrum.redshift.fix = True
+
+    spectrum.log_B = -1.0
+    spectrum.log_electron_luminosity = 44.0
+
+    # spectrum.log_electron_luminosity.prior = Truncated_gaussian(
+    #     mu=44, sigma=1, lower_bound=42, upper_bound=46
+    # )
+
+    spectrum.log_electron_luminosity.set_uninformative_prior(Uniform_prior)
+
+    spectrum.log_gamma_max.set_uninformative_prior(Uniform_prior)
+
+    spectrum.log_gamma_min.prior = Uniform_prior(
+        lower_bound=3, upper_bound=5.0
+    )
+
+    spectrum.log_gamma_min = 3.1
+
+    spectrum.log_radius.set_uninformative_prior(Uniform_prior)
+    spectrum.log_B.set_uninformative_prior(Uniform_prior)
+    spectrum.lorentz_factor.set_uninformative_prior(Log_uniform_prior)
+    spectrum.spectral_index.prior = Truncated_gaussian(
+        mu=3, sigma=0.5, lower_bound=2, upper_bound=4
+    )
+
+    return spectrum
+
+
 class Model:
     def __init__(
         self,
@@ -42,14 +160,39 @@ class Model:
         dec: float,
         lat_model: Optional[str] = None,
         lat_source: Optional[str] = None,
+        mw_nh: Optional[float] = None,
     ) -> None:
+        """
+        the model of a single source
+
+        :param source_name: name of the source
+        :type source_name: str
+        :param redshift: redshift of the source
+        :type redshift: float
+        :param ra: right ascension in deg
+        :type ra: float
+        :param dec: declination in deg
+        :type dec: float
+        :param lat_model: a LAT model file of the region
+        :type lat_model: Optional[str]
+        :param lat_source: the name of the source in the LAT model
+        :type lat_source: Optional[str]
+        :param mw_nh: the Galactic NH (10^22 cm^-2) if already known,
+        otherwise it is looked up
+        :type mw_nh: Optional[float]
+        :returns:
+
+        """
         self._source_name: str = source_name
         self._redshift: float = redshift
         self._ra: float = ra
         self._dec: float = dec
+        self._mw_nh: Optional[float] = mw_nh
 
         self._spectrum: Optional[Function1D] = None
 
+        self._fused: Optional[FusedAbsorbedSpectrum] = None
+
         self._create_gas_model()
         self._create_spectrum()
 
@@ -70,33 +213,158 @@ class Model:
         else:
             log.info(f"using LAT model for {self._lat_source}")
 
-            tmp = load_model("pks_lat_model.yml")
-            sources = list(tmp.point_sources.values())
+            self._model = self._lat_region()
 
-            self._model = ModelFrom3FGL(self._ra, self._dec, *sources)
+            self._model.add_source(self.point_source)
 
-            self._model.free_point_sources_within_radius(
-                3.0, normalization_only=True
-            )
+        self._model_linking()
 
-            for _, v in self._model.point_sources.items():
-                if v.has_free_parameters:
-                    for _, par in v.free_parameters.items():
-                        if "K" in par.name:
-                            val = par.value
+    def _build_lat_region(self) -> astromodels.Model:
+        """
+        the LAT region model around the source, without the source
 
-                            par.prior = Log_uniform_prior(
-                                lower_bound=val * 1e-5, upper_bound=val * 1e5
-                            )
+        :returns:
 
-                        else:
-                            par.set_uninformative_prior(Uniform_prior)
+        """
+        tmp = load_model(self._lat_model)
+        sources = list(tmp.point_sources.values())
 
-            self._model.remove_source(self._lat_source)
+        region = ModelFrom3FGL(self._ra, self._dec, *sources)
 
-            self._model.add_source(self.point_source)
+        region.free_point_sources_within_radius(
+            _lat_free_radius, normalization_only=True
+        )
 
-        self._model_linking()
+        for _, v in region.point_sources.items():
+            if v.has_free_parameters:
+                for _, par in v.free_parameters.items():
+                    if "K" in par.name:
+                        val = par.value
+
+                        par.prior = Log_uniform_prior(
+                            lower_bound=val / _lat_prior_span,
+                            upper_bound=val * _lat_prior_span,
+                        )
+
+                    else:
+                        par.set_uninformative_prior(Uniform_prior)
+
+        region.remove_source(self._lat_source)
+
+        return region
+
+    def _lat_region_key(self) -> str:
+        h = hashlib.sha256()
+
+        h.update(Path(self._lat_model).read_bytes())
+
+        h.update(
+            repr(
+                (
+                    self._ra,
+                    self._dec,
+                    self._lat_source,
+                    _lat_free_radius,
+                    _lat_prior_span,
+                    astromodels.__version__,
+                )
+            ).encode()
+        )
+
+        return h.hexdigest()
+
+    def _lat_region(self) -> astromodels.Model:
+        """
+        the LAT region model, from the cache if it was built before
+        for the same model file, position, free radius and priors
+
+        :returns:
+
+        """
+        if not blaze_runner_config.performance.cache_lat_models:
+            return self._build_lat_region()
+
+        cache_dir = get_path_of_cache_dir() / "lat_models"
+
+        cache_file = cache_dir / f"{self._lat_region_key()}.pkl"
+
+        if cache_file.is_file():
+            try:
+                with cache_file.open("rb") as f:
+                    region = pickle.load(f)
+
+                log.debug(f"loaded the LAT region model from {cache_file}")
+
+                return region
+
+            except (pickle.UnpicklingError, EOFError, AttributeError) as e:
+                log.warning(f"could not read {cache_file} ({e}), rebuilding")
+
+        region = self._build_lat_region()
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # written next to the target and moved into place so that
+        # ranks building the same region do not see partial files
+
+        with tempfile.NamedTemporaryFile(
+            dir=cache_dir, suffix=".tmp", delete=False
+        ) as f:
+            pickle.dump(region, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(f.name, cache_file)
+
+        log.debug(f"cached the LAT region model in {cache_file}")
+
+        return region
+
+    @classmethod
+    def _catalog_quantities(cls, redshifts: np.ndarray) -> Dict[str, Any]:
+        """
+        per source keyword arguments which can be computed for
+        a whole catalog at once
+
+        :param redshifts: the redshifts of the sources
+        :type redshifts: np.ndarray
+        :returns:
+
+        """
+        return {}
+
+    @classmethod
+    def from_catalog(
+        cls,
+        source_names: List[str],
+        redshifts: np.ndarray,
+        ras: np.ndarray,
+        decs: np.ndarray,
+        lat_models: Optional[List[Optional[str]]] = None,
+        lat_sources: Optional[List[Optional[str]]] = None,
+    ) -> "ModelCatalog":
+        """
+        prepare the models of a whole catalog of sources. The work
+        that does not depend on a single source (Galactic NH lookup,
+        distances, emulator loading) is done once for all of them
+        and the models themselves are only built when accessed
+
+        :param source_names: names of the sources
+        :type source_names: List[str]
+        :param redshifts: redshifts of the sources
+        :type redshifts: np.ndarray
+        :param ras: right ascensions in deg
+        :type ras: np.ndarray
+        :param decs: declinations in deg
+        :type decs: np.ndarray
+        :param lat_models: LAT model files of the sources
+        :type lat_models: Optional[List[Optional[str]]]
+        :param lat_sources: names of the sources in the LAT models
+        :type lat_sources: Optional[List[Optional[str]]]
+        :returns:
+
+        """
+        return ModelCatalog(
+            cls, source_names, redshifts, ras, decs, lat_models, lat_sources
+        )
 
     @property
     def source_name(self) -> str:
@@ -109,20 +377,30 @@ class Model:
         pass
 
     def _create_gas_model(self) -> None:
-        c = coords.SkyCoord(
-            ra=self._ra, dec=self._dec, unit="deg", frame="icrs"
-        )
+        if self._mw_nh is None:
+            self._mw_nh = (
+                get_nh_index("DL").nh(self._ra, self._dec, radius=1.0) / 1.0e22
+            )
 
-        mw_nh = GasMap.nhf(c, nhmap="DL", radius=1 * u.deg).value / 1.0e22
+        mw_nh = self._mw_nh
 
         self._mw_gas = TbAbsCut(NH=mw_nh, redshift=0.0, low_cutoff=4e-2)
 
+        if blaze_runner_config.performance.tabulate_absorption:
+            tabulate_transmission(self._mw_gas, "NH", _reference_nh)
+
         self._mw_gas.NH.fix = False
 
         self._mw_gas.NH.prior = Gaussian(mu=mw_nh, sigma=np.abs(mw_nh * 0.05))
 
         self._z_dust = ZDust(e_bmv=0.18)
 
+        # only e_bmv is sampled, the curve of the extinction law at the
+        # fixed rv and redshift is kept per energy grid
+
+        if blaze_runner_config.performance.tabulate_extinction:
+            tabulate_transmission(self._z_dust, "e_bmv", _reference_e_bmv)
+
         self._z_dust.e_bmv.bounds = (0, 5)
 
         self._z_dust.e_bmv.prior = Log_uniform_prior(
@@ -140,17 +418,74 @@ class Model:
 
             raise RuntimeError(msg)
 
+        shape = self._mw_gas * self._z_dust * self._spectrum
+
+        tabulated = all(
+            isinstance(f.evaluate, TabulatedTransmission)
+            for f in (self._mw_gas, self._z_dust)
+        )
+
+        if blaze_runner_config.performance.fused_evaluation and tabulated:
+            fuse_absorbed_spectrum(
+                shape, [self._mw_gas, self._z_dust], self._spectrum
+            )
+
+            self._fused = shape.evaluate
+
         return PointSource(
             self._source_name,
             self._ra,
             self._dec,
-            spectral_shape=self._mw_gas * self._z_dust * self._spectrum,
+            spectral_shape=shape,
         )
 
     @property
     def model(self) -> astromodels.Model:
         return self._model
 
+    def cache_info(self) -> Optional[Dict[str, Dict[str, int]]]:
+        """
+        how often the absorption and the spectrum of the source were
+        reused or recomputed during evaluation. None if the fused
+        evaluation is not used
+
+        :returns:
+
+        """
+        if self._fused is None:
+            return None
+
+        return self._fused.cache_info()
+
+    def reset_cache_info(self) -> None:
+        if self._fused is not None:
+            self._fused.reset_cache_info()
+
+    def use_union_grid(self) -> None:
+        """
+        evaluate the spectrum once per parameter point on the union of
+        the energy grids of the plugins. The plugins must have
+        evaluated the model once so that their grids are known. Only
+        possible with the fused evaluation
+
+        :returns:
+
+        """
+        if self._fused is None:
+            log.warning(
+                f"{self._source_name} is not fused, "
+                "every plugin evaluates the spectrum on its own grid"
+            )
+
+            return
+
+        n_energies = self._fused.use_union_grid()
+
+        log.info(
+            f"{self._source_name} is evaluated on a union grid "
+            f"of {n_energies} energies"
+        )
+
 
 class Leptonic(Model):
     def __init__(
@@ -161,46 +496,99 @@ class Leptonic(Model):
         dec: float,
         lat_model: Optional[str] = None,
         lat_source: Optional[str] = None,
+        mw_nh: Optional[float] = None,
+        flux_factor: Optional[float] = None,
     ) -> None:
-        super().__init__(source_name, redshift, ra, dec, lat_model, lat_source)
+        self._flux_factor: Optional[float] = flux_factor
 
-    def _create_spectrum(self) -> None:
-        factor = (1 + self._redshift) / (
-            4 * np.pi * cosmo.luminosity_distance(self._redshift).to("cm") ** 2
+        super().__init__(
+            source_name, redshift, ra, dec, lat_model, lat_source, mw_nh
+        )
+
+    @staticmethod
+    def flux_factor(
+        redshift: Union[float, np.ndarray]
+    ) -> Union[float, np.ndarray]:
+        """
+        the factor (1+z) / (4 pi d_L^2) converting the emulated
+        luminosity to an observed flux. Arrays of redshifts are
+        computed in one call
+
+        :param redshift: the redshift(s)
+        :returns:
+
+        """
+        factor = (1 + np.asarray(redshift)) / (
+            4 * np.pi * cosmo.luminosity_distance(redshift).to("cm") ** 2
         ).value
 
-        self._spectrum = EmulatorModel("lepto_ml_fuck")
+        if np.ndim(factor) == 0:
+            return float(factor)
 
-        self._spectrum.K.fix = True
-        self._spectrum.K = factor
+        return factor
 
-        self._spectrum.redshift = self._redshift
-        self._spectrum.redshift.fix = True
+    @classmethod
+    def _catalog_quantities(cls, redshifts: np.ndarray) -> Dict[str, Any]:
+        return dict(flux_factor=cls.flux_factor(redshifts))
 
-        self._spectrum.log_B = -1.0
-        self._spectrum.log_electron_luminosity = 44.0
+    def _create_spectrum(self) -> None:
+        if self._flux_factor is None:
+            self._flux_factor = self.flux_factor(self._redshift)
 
-        # self._spectrum.log_electron_luminosity.prior = Truncated_gaussian(
-        #     mu=44, sigma=1, lower_bound=42, upper_bound=46
-        # )
+        template = _emulator_template(_leptonic_network)
 
-        self._spectrum.log_electron_luminosity.set_uninformative_prior(
-            Uniform_prior
-        )
+        # the copies share the network of the template
 
-        self._spectrum.log_gamma_max.set_uninformative_prior(Uniform_prior)
+        self._spectrum = _copy_sharing(template, template._model_storage)
 
-        self._spectrum.log_gamma_min.prior = Uniform_prior(
-            lower_bound=3, upper_bound=5.0
-        )
+        self._spectrum.K = self._flux_factor
+
+        self._spectrum.redshift = self._redshift
 
-        self._spectrum.log_gamma_min = 3.1
+        # the names are suffixed once the spectrum enters the composite
 
-        self._spectrum.log_radius.set_uninformative_prior(Uniform_prior)
-        self._spectrum.log_B.set_uninformative_prior(Uniform_prior)
-        self._spectrum.lorentz_factor.set_uninformative_prior(Log_uniform_prior)
-        self._spectrum.spectral_index.prior = Truncated_gaussian(
-            mu=3, sigma=0.5, lower_bound=2, upper_bound=4
+        self._emulator_parameter_names: List[str] = list(
+            self._spectrum.parameters.keys()
+        )
+
+    @property
+    def emulator_parameter_names(self) -> List[str]:
+        """
+        the names of the columns of the parameters of evaluate_batch
+
+        """
+        return self._emulator_parameter_names
+
+    def emulator_parameter_vector(self) -> np.ndarray:
+        """
+        the current parameters of the emulator, including the
+        linked scale, in the order used by evaluate_batch
+
+        :returns:
+
+        """
+        return np.array([p.value for p in self._spectrum.parameters.values()])
+
+    def evaluate_batch(
+        self, energies: np.ndarray, parameters: np.ndarray
+    ) -> np.ndarray:
+        """
+        evaluate the leptonic spectrum (without absorption) for many
+        parameter vectors with one forward pass of the emulator, e.g.
+        for the population of an ensemble sampler. parameters has shape
+        (N, n_params) with the columns in the order of
+        emulator_parameter_names and the result has shape
+        (N, n_energies)
+
+        :param energies: the energies in keV
+        :type energies: np.ndarray
+        :param parameters: the parameter vectors
+        :type parameters: np.ndarray
+        :returns:
+
+        """
+        return evaluate_emulator_batch(
+            self._spectrum, np.asarray(energies, dtype=float), parameters
         )
 
     def _model_linking(self) -> None:
@@ -248,8 +636,11 @@ class LogParabola(Model):
         dec: float,
         lat_model: Optional[str] = None,
         lat_source: Optional[str] = None,
+        mw_nh: Optional[float] = None,
     ) -> None:
-        super().__init__(source_name, redshift, ra, dec, lat_model, lat_source)
+        super().__init__(
+            source_name, redshift, ra, dec, lat_model, lat_source, mw_nh
+        )
 
     def _create_spectrum(self) -> None:
         lpl_low = Log_parabola(K=1e-3)
@@ -266,3 +657,133 @@ class LogParabola(Model):
         )
 
         self._spectrum = lpl_low + lpl_high
+
+
+class ModelCatalog(Sequence):
+    def __init__(
+        self,
+        model_class: type,
+        source_names: List[str],
+        redshifts: np.ndarray,
+        ras: np.ndarray,
+        decs: np.ndarray,
+        lat_models: Optional[List[Optional[str]]] = None,
+        lat_sources: Optional[List[Optional[str]]] = None,
+    ) -> None:
+        """
+        the models of a catalog of sources. The quantities shared by
+        all sources are computed on creation, the models are built
+        when they are accessed and are not kept
+
+        :param model_class: the Model subclass to build
+        :type model_class: type
+        :param source_names: names of the sources
+        :type source_names: List[str]
+        :param redshifts: redshifts of the sources
+        :type redshifts: np.ndarray
+        :param ras: right ascensions in deg
+        :type ras: np.ndarray
+        :param decs: declinations in deg
+        :type decs: np.ndarray
+        :param lat_models: LAT model files of the sources
+        :type lat_models: Optional[List[Optional[str]]]
+        :param lat_sources: names of the sources in the LAT models
+        :type lat_sources: Optional[List[Optional[str]]]
+        :returns:
+
+        """
+        self._model_class: type = model_class
+
+        self._source_names: List[str] = list(source_names)
+
+        n_sources = len(self._source_names)
+
+        self._redshifts: np.ndarray = np.asarray(redshifts, dtype=float)
+        self._ras: np.ndarray = np.asarray(ras, dtype=float)
+        self._decs: np.ndarray = np.asarray(decs, dtype=float)
+
+        for name, values in (
+            ("redshifts", self._redshifts),
+            ("ras", self._ras),
+            ("decs", self._decs),
+        ):
+            if values.shape != (n_sources,):
+                msg = f"{name} must have one entry for each of the sources"
+
+                log.error(msg)
+
+                raise RuntimeError(msg)
+
+        if lat_models is None:
+            lat_models = [None] * n_sources
+
+        if lat_sources is None:
+            lat_sources = [None] * n_sources
+
+        self._lat_models: List[Optional[str]] = list(lat_models)
+        self._lat_sources: List[Optional[str]] = list(lat_sources)
+
+        log.info(f"preparing {n_sources} {model_class.__name__} models")
+
+        # one batched query for the whole catalog
+
+        self._mw_nh: np.ndarray = (
+            np.atleast_1d(
+                get_nh_index("DL").nh(self._ras, self._decs, radius=1.0)
+            )
+            / 1.0e22
+        )
+
+        self._quantities: Dict[str, Any] = model_class._catalog_quantities(
+            self._redshifts
+        )
+
+    @property
+    def source_names(self) -> List[str]:
+        return self._source_names
+
+    @property
+    def mw_nh(self) -> np.ndarray:
+        return self._mw_nh
+
+    def __len__(self) -> int:
+        return len(self._source_names)
+
+    def _build(self, i: int) -> Model:
+        kwargs = {k: float(v[i]) for k, v in self._quantities.items()}
+
+        return self._model_class(
+            self._source_names[i],
+            float(self._redshifts[i]),
+            float(self._ras[i]),
+            float(self._decs[i]),
+            lat_model=self._lat_models[i],
+            lat_source=self._lat_sources[i],
+            mw_nh=float(self._mw_nh[i]),
+            **kwargs,
+        )
+
+    def __getitem__(
+        self, item: Union[int, slice]
+    ) -> Union[Model, List[Model]]:
+        if isinstance(item, slice):
+            return [self._build(i) for i in range(len(self))[item]]
+
+        if item < 0:
+            item += len(self)
+
+        if not 0 <= item < len(self):
+            raise IndexError("catalog index out of range")
+
+        return self._build(item)
+
+    def by_name(self, source_name: str) -> Model:
+        """
+        build the model of a source by its name
+
+        :param source_name: name of the source
+        :type source_name: str
+        :returns:
+
+        """
+        return self._build(self._source_names.index(source_name))
@@ -1,33 +1,71 @@
-from dataclasses import dataclass
-from typing import Any, List, Dict
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, List, Dict, Optional, Tuple
 
 import numpy as np
 import yaml
 from mpi4py import MPI
 from threeML import (
     DataList,
+    DispersionSpectrumLike,
     FermipyLike,
     OGIPLike,
     PhotometryLike,
     silence_progress_bars,
 )
+from astromodels import Model as LikelihoodModel
 from threeML.plugin_prototype import PluginPrototype
+from threeML.utils.OGIP.response import InstrumentResponse
 from threeML.utils.photometry import get_photometric_filter_library
 from threeML.utils.photometry.photometric_observation import (
     PhotometericObservation,
 )
+from threeML.utils.spectrum.binned_spectrum import (
+    BinnedSpectrum,
+    BinnedSpectrumWithDispersion,
+    Quality,
+)
 
+from .io.snapshot import read_snapshot, write_snapshot
+from .lat_cache import LATProductCache
+from .quadrature import gauss_legendre_integration
+from .response import SparseFolding, sparse_folding
+from .shared_memory import node_comm, share_arrays
+from .simulation import SimulatedLATLike, simulated_filters
+from .utils.configuration import blaze_runner_config
 from .utils.logging import setup_logger
 
-comm = MPI.COMM_WORLD
-rank = comm.Get_rank()
-size = comm.Get_size()
-
-
 log = setup_logger(__name__)
 
 silence_progress_bars()
-threeML_filter_library = get_photometric_filter_library()
+
+# the rank which runs the Fermipy setup for all others
+
+_lat_leader = 0
+
+
+_filter_library_lock = threading.Lock()
+
+
+def threeML_filter_library():
+    """
+    the photometric filter library is only loaded once it is needed
+    by a photometric observation. Observations built concurrently
+    wait for the first one to load it
+
+    """
+    with _filter_library_lock:
+        return _load_filter_library()
+
+
+@lru_cache(maxsize=1)
+def _load_filter_library():
+    return get_photometric_filter_library()
 
 
 @dataclass(frozen=True)
@@ -56,14 +94,143 @@ class LATDataContainer(DataContainer):
     dec: float
 
 
+@dataclass(frozen=True)
+class SimulatedLATDataContainer(DataContainer):
+    cube: str
+    ra: float
+    dec: float
+
+
 class Observation:
-    def __init__(self, plugin: PluginPrototype):
+    def __init__(
+        self,
+        plugin: PluginPrototype,
+        data_container: Optional[DataContainer] = None,
+    ):
         self._plugin: PluginPrototype = plugin
+        self._data_container: Optional[DataContainer] = data_container
+
+    def setup(
+        self,
+        likelihood_model: LikelihoodModel,
+        comm: Optional[MPI.Comm] = None,
+    ) -> None:
+        """
+        collective preparation before the model is set on the plugin.
+        Nothing is needed for most observations
+
+        :param likelihood_model: the model of the analysis
+        :type likelihood_model: LikelihoodModel
+        :param comm: the ranks of the analysis, by default COMM_WORLD
+        :type comm: Optional[MPI.Comm]
+        :returns:
+
+        """
+        pass
+
+    def share(self, comm: Optional[MPI.Comm] = None) -> None:
+        """
+        move the large read-only arrays of the plugin into memory
+        shared between the ranks of a node. Collective over the node.
+        Nothing is shared for most observations
+
+        :param comm: the ranks of the node, by default those of
+        COMM_WORLD
+        :type comm: Optional[MPI.Comm]
+        :returns:
+
+        """
+        pass
+
+    def to_snapshot(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+        """
+        the metadata and arrays needed to rebuild the plugin without
+        reading the original files. Nothing is needed for observations
+        which are rebuilt from their data container
+
+        :returns:
+
+        """
+        return {}, {}
+
+    @classmethod
+    def from_snapshot(
+        cls,
+        data_container: DataContainer,
+        metadata: Dict[str, Any],
+        arrays: Dict[str, np.ndarray],
+    ) -> "Observation":
+        """
+        rebuild an observation from what was written by to_snapshot
+
+        :param data_container: the data container of the observation
+        :type data_container: DataContainer
+        :param metadata: the metadata of the snapshot
+        :type metadata: Dict[str, Any]
+        :param arrays: the arrays of the snapshot
+        :type arrays: Dict[str, np.ndarray]
+        :returns:
+
+        """
+        return cls(data_container)
 
     @property
     def plugin(self) -> PluginPrototype:
         return self._plugin
 
+    @property
+    def data_container(self) -> Optional[DataContainer]:
+        return self._data_container
+
+
+def _private_pfiles(directory: Path) -> None:
+    """
+    give this process its own fermitools parameter file directory
+    so that tools running concurrently on other ranks do not
+    overwrite each others .par files
+
+    :param directory: the private parameter file directory
+    :type directory: Path
+    :returns:
+
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+
+    system = os.environ.get("PFILES", "")
+
+    if ";" in system:
+        system = system.split(";", 1)[1]
+
+    os.environ["PFILES"] = f"{directory};{system}"
+
+
+def _link_products(source: Path, target: Path) -> None:
+    """
+    make the Fermipy products in source available in target. The
+    source maps are updated in place by fermipy and are copied, all
+    other products are linked
+
+    :param source: the directory holding the products
+    :type source: Path
+    :param target: the directory to attach them to
+    :type target: Path
+    :returns:
+
+    """
+    target.mkdir(parents=True, exist_ok=True)
+
+    for product in source.glob("*.fits"):
+        destination = target / product.name
+
+        if destination.exists():
+            continue
+
+        if product.name.startswith("srcmap"):
+            shutil.copy2(product, destination)
+
+        else:
+            destination.symlink_to(product.resolve())
+
 
 class LATObservation(Observation):
     def __init__(self, data_container: LATDataContainer):
@@ -82,85 +249,407 @@ class LATObservation(Observation):
         }
         config["selection"]["emax"] = 300000
 
-        randNum = np.zeros(1)
+        # building the plugin only reads the configuration, the
+        # products are made when the model is set (see setup)
 
-        if rank == 0:
-            plugin = FermipyLike(data_container.name, config)
+        plugin = FermipyLike(data_container.name, config)
 
-            if size > 1:
-                comm.Isend(randNum, dest=1, tag=12)
-                log.info(f"rank {rank} is sending ")
+        super().__init__(plugin, data_container)
 
-        else:
-            log.info(f"rank {rank} is waiting")
-            req = comm.Irecv(randNum, source=rank - 1, tag=12)
-            req.Wait()
-            plugin = FermipyLike(data_container.name, config)
+    def setup(
+        self,
+        likelihood_model: LikelihoodModel,
+        comm: Optional[MPI.Comm] = None,
+    ) -> None:
+        """
+        collective over the ranks of comm. The leader runs the Fermipy setup
+        (event selection, livetime and counts cubes, exposure and source
+        maps) in the shared output directory. Once it is done, every
+        other rank gets a private output directory with the products
+        attached, so they can all set the model concurrently without
+        recomputing or overwriting each others files
+
+        :param likelihood_model: the model of the analysis
+        :type likelihood_model: LikelihoodModel
+        :param comm: the ranks of the analysis, by default COMM_WORLD
+        :type comm: Optional[MPI.Comm]
+        :returns:
+
+        """
+        if comm is None:
+            comm = MPI.COMM_WORLD
+
+        rank = comm.Get_rank()
+
+        outdir = Path(self._plugin.configuration["fileio"]["outdir"])
+
+        if rank == _lat_leader:
+            log.info(f"rank {rank} is running the Fermipy setup in {outdir}")
+
+            try:
+                self._setup_leader(likelihood_model, outdir)
+
+            except Exception as e:
+                # do not leave the other ranks waiting
+
+                comm.bcast(f"{type(e).__name__}: {e}", root=_lat_leader)
+
+                raise
 
-            log.info(f"rank {rank} is finished")
+            comm.bcast(None, root=_lat_leader)
 
-            if rank < size - 1:
-                comm.Isend(randNum, dest=rank + 1, tag=12)
+            return
 
-        super().__init__(plugin)
+        failure = comm.bcast(None, root=_lat_leader)
+
+        if failure is not None:
+            msg = f"the Fermipy setup failed on rank {_lat_leader}: {failure}"
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+        # named by the rank in COMM_WORLD, analyses of the same data on
+        # different communicators must not share them
+
+        world_rank = MPI.COMM_WORLD.Get_rank()
+
+        private = outdir.parent / f"{outdir.name}_rank{world_rank}"
+
+        _link_products(outdir, private)
+
+        _private_pfiles(private / "pfiles")
+
+        self._plugin.configuration["fileio"]["outdir"] = str(private)
+
+        log.info(f"rank {rank} attached the Fermipy products in {private}")
+
+    # the source maps are held by the Science Tools in C++ and cannot
+    # be shared, so share is left a no-op
+
+    def _setup_leader(
+        self, likelihood_model: LikelihoodModel, outdir: Path
+    ) -> None:
+        if not blaze_runner_config.performance.cache_lat_products:
+            self._plugin.set_model(likelihood_model)
+
+            return
+
+        # products of an earlier run on the same data are put in
+        # place first, so that fermipy skips making them
+
+        cache = LATProductCache(self._plugin.configuration, likelihood_model)
+
+        cache.restore(outdir)
+
+        self._plugin.set_model(likelihood_model)
+
+        cache.store(outdir)
+
+
+def _spectrum_to_snapshot(
+    spectrum: BinnedSpectrum, prefix: str
+) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    metadata = {
+        f"{prefix}_exposure": float(spectrum.exposure),
+        f"{prefix}_scale_factor": float(spectrum.scale_factor),
+        f"{prefix}_is_poisson": bool(spectrum.is_poisson),
+        f"{prefix}_mission": spectrum.mission,
+        f"{prefix}_instrument": spectrum.instrument,
+    }
+
+    arrays = {
+        f"{prefix}_counts": spectrum.counts,
+        f"{prefix}_sys_errors": spectrum.sys_errors,
+        f"{prefix}_quality": spectrum.quality.to_ogip(),
+    }
+
+    if spectrum.count_errors is not None:
+        arrays[f"{prefix}_count_errors"] = spectrum.count_errors
+
+    return metadata, arrays
+
+
+def _spectrum_from_snapshot(
+    prefix: str, metadata: Dict[str, Any], arrays: Dict[str, np.ndarray]
+) -> Dict[str, Any]:
+    return dict(
+        counts=arrays[f"{prefix}_counts"],
+        exposure=metadata[f"{prefix}_exposure"],
+        count_errors=arrays.get(f"{prefix}_count_errors"),
+        sys_errors=arrays[f"{prefix}_sys_errors"],
+        quality=Quality.from_ogip(arrays[f"{prefix}_quality"]),
+        scale_factor=metadata[f"{prefix}_scale_factor"],
+        is_poisson=metadata[f"{prefix}_is_poisson"],
+        mission=metadata[f"{prefix}_mission"],
+        instrument=metadata[f"{prefix}_instrument"],
+    )
 
 
 class XRayObservation(Observation):
     def __init__(
-        self, data_containter: XRayDataContainer, e_min: float, e_max: float
+        self,
+        data_containter: XRayDataContainer,
+        e_min: float,
+        e_max: float,
+        plugin: Optional[DispersionSpectrumLike] = None,
     ):
-        plugin: OGIPLike = OGIPLike(
-            data_containter.name,
-            observation=data_containter.observation,
-            background=data_containter.background,
-            response=data_containter.response,
-            arf_file=data_containter.arf,
-        )
+        if plugin is None:
+            plugin = OGIPLike(
+                data_containter.name,
+                observation=data_containter.observation,
+                background=data_containter.background,
+                response=data_containter.response,
+                arf_file=data_containter.arf,
+            )
 
         plugin.set_active_measurements(f"{e_min}-{e_max}")
         plugin.rebin_on_background(1)
-        plugin.model_integrate_method = "riemann"
 
-        super().__init__(plugin=plugin)
+        integrate_method = blaze_runner_config.performance.integrate_method
+
+        if integrate_method == "gauss_legendre":
+            gauss_legendre_integration(
+                plugin, blaze_runner_config.performance.quadrature_nodes
+            )
+
+        else:
+            plugin.model_integrate_method = integrate_method
+
+        self._folding: Optional[SparseFolding] = None
+
+        if blaze_runner_config.performance.sparse_responses:
+            self._folding = sparse_folding(plugin.observed_spectrum.response)
+
+        super().__init__(plugin, data_containter)
+
+    def share(self, comm: Optional[MPI.Comm] = None) -> None:
+        response = self._plugin.observed_spectrum.response
+
+        # with an ARF, the response also keeps the bare RMF
+
+        if getattr(response, "rmf", None) is not None:
+            matrix, response._rmf = share_arrays(
+                [response.matrix, response.rmf], comm=comm
+            )
+
+        else:
+            (matrix,) = share_arrays([response.matrix], comm=comm)
+
+        response.replace_matrix(matrix)
+
+        if self._folding is not None:
+            self._folding.share(comm)
+
+    def to_snapshot(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+        background = self._plugin.background_spectrum
+
+        if background is None:
+            msg = f"{self._plugin.name} has no binned background and cannot be written to a snapshot"
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+        # the ARF is already folded into the matrix of the response
+
+        response = self._plugin.observed_spectrum.response
+
+        metadata, arrays = _spectrum_to_snapshot(
+            self._plugin.observed_spectrum, "observation"
+        )
+
+        background_metadata, background_arrays = _spectrum_to_snapshot(
+            background, "background"
+        )
+
+        metadata.update(background_metadata)
+        arrays.update(background_arrays)
+
+        arrays["matrix"] = response.matrix
+        arrays["ebounds"] = response.ebounds
+        arrays["monte_carlo_energies"] = response.monte_carlo_energies
+
+        return metadata, arrays
+
+    @classmethod
+    def from_snapshot(
+        cls,
+        data_container: XRayDataContainer,
+        metadata: Dict[str, Any],
+        arrays: Dict[str, np.ndarray],
+    ) -> "XRayObservation":
+        response = InstrumentResponse(
+            arrays["matrix"],
+            arrays["ebounds"],
+            arrays["monte_carlo_energies"],
+        )
+
+        observation = BinnedSpectrumWithDispersion(
+            response=response,
+            **_spectrum_from_snapshot("observation", metadata, arrays),
+        )
+
+        background = BinnedSpectrum(
+            ebounds=arrays["ebounds"],
+            **_spectrum_from_snapshot("background", metadata, arrays),
+        )
+
+        plugin = DispersionSpectrumLike(
+            data_container.name,
+            observation=observation,
+            background=background,
+            verbose=False,
+        )
+
+        # the energy selection and binning are redone on the stored
+        # spectra, which is cheap compared to reading the files
+
+        return cls(data_container, plugin=plugin)
 
 
 class XRTObservation(XRayObservation):
-    def __init__(self, data_containter: XRayDataContainer):
-        super().__init__(data_containter, e_min=0.3, e_max=15)
+    def __init__(
+        self,
+        data_containter: XRayDataContainer,
+        plugin: Optional[DispersionSpectrumLike] = None,
+    ):
+        super().__init__(data_containter, e_min=0.3, e_max=15, plugin=plugin)
 
 
 class NuStarObservation(XRayObservation):
-    def __init__(self, data_containter: XRayDataContainer):
-        super().__init__(data_containter, e_min=2, e_max=60)
+    def __init__(
+        self,
+        data_containter: XRayDataContainer,
+        plugin: Optional[DispersionSpectrumLike] = None,
+    ):
+        super().__init__(data_containter, e_min=2, e_max=60, plugin=plugin)
 
 
 class PhotometricObservation(Observation):
-    def __init__(self, data_containter: PhotometricDataContainer, filter_set):
-        obs = PhotometericObservation.from_hdf5(data_containter.observation)
+    def __init__(
+        self,
+        data_containter: PhotometricDataContainer,
+        filter_set,
+        observation: Optional[PhotometericObservation] = None,
+    ):
+        if observation is None:
+            observation = PhotometericObservation.from_hdf5(
+                data_containter.observation
+            )
+
+        self._observation: PhotometericObservation = observation
 
         plugin = PhotometryLike(
             data_containter.name,
             filters=filter_set,
-            observation=obs,
+            observation=observation,
+        )
+
+        super().__init__(plugin, data_containter)
+
+    def to_snapshot(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+        bands = list(self._observation.keys())
+
+        arrays = {
+            "band_names": np.array(bands, dtype="S"),
+            "ab_magnitudes": np.array(
+                [self._observation[b][0] for b in bands], dtype=float
+            ),
+            "ab_magnitude_errors": np.array(
+                [self._observation[b][1] for b in bands], dtype=float
+            ),
+        }
+
+        return {}, arrays
+
+    @classmethod
+    def from_snapshot(
+        cls,
+        data_container: PhotometricDataContainer,
+        metadata: Dict[str, Any],
+        arrays: Dict[str, np.ndarray],
+    ) -> "PhotometricObservation":
+        observation = PhotometericObservation(
+            list(arrays["band_names"]),
+            np.array(arrays["ab_magnitudes"]),
+            np.array(arrays["ab_magnitude_errors"]),
         )
 
-        super().__init__(plugin)
+        return cls(data_container, observation=observation)
 
 
 class UVOTObservation(PhotometricObservation):
-    def __init__(self, data_containter: PhotometricDataContainer):
+    def __init__(
+        self,
+        data_containter: PhotometricDataContainer,
+        observation: Optional[PhotometericObservation] = None,
+    ):
         super().__init__(
-            data_containter, filter_set=threeML_filter_library.Swift.UVOT
+            data_containter,
+            filter_set=threeML_filter_library().Swift.UVOT,
+            observation=observation,
         )
 
 
 class GRONDObservation(PhotometricObservation):
-    def __init__(self, data_containter: PhotometricDataContainer):
+    def __init__(
+        self,
+        data_containter: PhotometricDataContainer,
+        observation: Optional[PhotometericObservation] = None,
+    ):
+        super().__init__(
+            data_containter,
+            filter_set=threeML_filter_library().LaSilla.GROND,
+            observation=observation,
+        )
+
+
+class SimulatedUVOTObservation(PhotometricObservation):
+    def __init__(
+        self,
+        data_containter: PhotometricDataContainer,
+        observation: Optional[PhotometericObservation] = None,
+    ):
+        super().__init__(
+            data_containter,
+            filter_set=simulated_filters("uvot"),
+            observation=observation,
+        )
+
+
+class SimulatedGRONDObservation(PhotometricObservation):
+    def __init__(
+        self,
+        data_containter: PhotometricDataContainer,
+        observation: Optional[PhotometericObservation] = None,
+    ):
         super().__init__(
-            data_containter, filter_set=threeML_filter_library.LaSilla.GROND
+            data_containter,
+            filter_set=simulated_filters("grond"),
+            observation=observation,
         )
 
 
+class SimulatedLATObservation(LATObservation):
+    def __init__(self, data_container: SimulatedLATDataContainer):
+        # a LAT observation for the analysis, with the nuisance
+        # parameters of FermipyLike, which needs no Fermi tools
+
+        plugin = SimulatedLATLike(data_container.name, data_container.cube)
+
+        Observation.__init__(self, plugin, data_container)
+
+    def setup(
+        self,
+        likelihood_model: LikelihoodModel,
+        comm: Optional[MPI.Comm] = None,
+    ) -> None:
+        # there are no products to make
+
+        pass
+
+
 _known_data_types = {
     "xrt": {"class": XRTObservation, "container": XRayDataContainer},
     "nustar": {"class": NuStarObservation, "container": XRayDataContainer},
@@ -170,18 +659,65 @@ _known_data_types = {
         "container": PhotometricDataContainer,
     },
     "lat": {"class": LATObservation, "container": LATDataContainer},
+    "sim_uvot": {
+        "class": SimulatedUVOTObservation,
+        "container": PhotometricDataContainer,
+    },
+    "sim_grond": {
+        "class": SimulatedGRONDObservation,
+        "container": PhotometricDataContainer,
+    },
+    "sim_lat": {
+        "class": SimulatedLATObservation,
+        "container": SimulatedLATDataContainer,
+    },
 }
 
 
+def _data_type(observation: Observation) -> str:
+    for data_type, v in _known_data_types.items():
+        if type(observation) is v["class"]:
+            return data_type
+
+    msg = f"{type(observation).__name__} is not a known observation class"
+
+    log.error(msg)
+
+    raise RuntimeError(msg)
+
+
+def _build_observation(job: Tuple[type, DataContainer]) -> Observation:
+    obs_class, data_container = job
+
+    return obs_class(data_container)
+
+
 class DataSet:
     def __init__(self, observations: List[Observation]) -> None:
         self._observations: List[Observation] = observations
 
     @classmethod
-    def from_dict(cls, d: Dict[str, Any]) -> "DataSet":
+    def from_dict(
+        cls, d: Dict[str, Any], max_workers: Optional[int] = None
+    ) -> "DataSet":
+        """
+        build the observations described in a dictionary (e.g. the
+        data section of an analysis file). The observations can be
+        loaded concurrently by a pool of threads, the plugins mostly
+        wait on reading FITS and HDF5 files. The order of the
+        observations is that of the dictionary
+
+        :param d: the observations by name
+        :type d: Dict[str, Any]
+        :param max_workers: the number of threads loading observations,
+        by default performance.load_workers of the configuration
+        :type max_workers: Optional[int]
+        :returns:
+
+        """
         # collect observations
 
-        observations = []
+        jobs: List[Tuple[type, DataContainer]] = []
 
         for name, v in d.items():
             # get the observation
@@ -201,12 +737,142 @@ class DataSet:
                 name=name, **v
             )
 
-            observations.append(obs_class(data_container))
+            jobs.append((obs_class, data_container))
+
+        if max_workers is None:
+            max_workers = blaze_runner_config.performance.load_workers
+
+        max_workers = min(max_workers, len(jobs))
+
+        if max_workers <= 1:
+            return cls([_build_observation(job) for job in jobs])
+
+        log.info(f"loading {len(jobs)} observations with {max_workers} threads")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            observations = list(executor.map(_build_observation, jobs))
 
         return cls(observations)
 
+    @classmethod
     def from_file(cls, file_name: str) -> "DataSet":
-        pass
+        """
+        load a data set from a snapshot written by to_file. The spectra,
+        responses and magnitudes are memory mapped from the snapshot,
+        so no OGIP files are parsed. LAT observations are rebuilt from
+        their configuration, their products come from the cache
+
+        :param file_name: the snapshot file
+        :type file_name: str
+        :returns:
+
+        """
+        observations: List[Observation] = []
+
+        for metadata, arrays in read_snapshot(file_name):
+            data_type = metadata["type"]
+
+            if data_type not in _known_data_types:
+                msg = f"{data_type} is not a known data type from {_known_data_types.keys()}"
+
+                log.error(msg)
+
+                raise RuntimeError(msg)
+
+            data_container = _known_data_types[data_type]["container"](
+                **metadata["container"]
+            )
+
+            observations.append(
+                _known_data_types[data_type]["class"].from_snapshot(
+                    data_container, metadata, arrays
+                )
+            )
+
+        log.info(f"loaded {len(observations)} observations from {file_name}")
+
+        return cls(observations)
+
+    def to_file(self, file_name: str) -> None:
+        """
+        write the data set to a single snapshot which from_file loads
+        without parsing the original files
+
+        :param file_name: the snapshot file
+        :type file_name: str
+        :returns:
+
+        """
+        entries = []
+
+        for observation in self._observations:
+            if observation.data_container is None:
+                msg = f"{observation.plugin.name} has no data container and cannot be written to a snapshot"
+
+                log.error(msg)
+
+                raise RuntimeError(msg)
+
+            metadata, arrays = observation.to_snapshot()
+
+            metadata["type"] = _data_type(observation)
+            metadata["container"] = asdict(observation.data_container)
+
+            entries.append((metadata, arrays))
+
+        write_snapshot(file_name, entries)
+
+    def setup(
+        self,
+        likelihood_model: LikelihoodModel,
+        comm: Optional[MPI.Comm] = None,
+    ) -> None:
+        """
+        collective preparation of all observations for the model.
+        Must be called on all ranks of the analysis before it is built
+
+        :param likelihood_model: the model of the analysis
+        :type likelihood_model: LikelihoodModel
+        :param comm: the ranks of the analysis, by default COMM_WORLD
+        :type comm: Optional[MPI.Comm]
+        :returns:
+
+        """
+        for observation in self._observations:
+            observation.setup(likelihood_model, comm)
+
+    def share(self, comm: Optional[MPI.Comm] = None) -> None:
+        """
+        keep a single copy per node of the read-only arrays of the
+        observations (the response matrices). Collective over the
+        ranks of the analysis, all of which must hold the same data
+        set
+
+        :param comm: the ranks of the analysis, by default COMM_WORLD
+        :type comm: Optional[MPI.Comm]
+        :returns:
+
+        """
+        node = node_comm(comm)
+
+        # every rank has to share the same arrays in the same order,
+        # or the ranks wait for each other forever
+
+        description = [
+            (o.plugin.name, type(o).__name__) for o in self._observations
+        ]
+
+        mismatch = node.bcast(description, root=0) != description
+
+        if node.allreduce(mismatch, op=MPI.LOR):
+            msg = "the ranks of the node hold different data sets, their arrays cannot be shared. Turn off performance.share_memory"
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+        for observation in self._observations:
+            observation.share(node)
 
     @property
     def observations(self) -> List[Observation]:
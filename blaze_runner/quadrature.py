@@ -0,0 +1,100 @@
+from typing import Callable, Tuple
+
+import numpy as np
+from astromodels import Model as LikelihoodModel
+from threeML.plugins.SpectrumLike import SpectrumLike
+
+from .utils.logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+class GaussLegendreIntegration:
+    def __init__(self, plugin: SpectrumLike, n_nodes: int) -> None:
+        """
+        a replacement for the _get_diff_flux_and_integral of a plugin
+        which integrates the model over its energy bins with an
+        n_nodes Gauss-Legendre rule. The nodes and weights of every bin
+        are computed once, each integral is a single evaluation of the
+        model on all nodes.
+
+        Two nodes are exact for cubic spectra, about as accurate as
+        simpson with one evaluation less per bin
+
+        :param plugin: the plugin
+        :type plugin: SpectrumLike
+        :param n_nodes: the number of nodes per bin
+        :type n_nodes: int
+        :returns:
+
+        """
+        if plugin._predefined_energies is None:
+            msg = f"{plugin.name} has no predefined energies to integrate over"
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+        self._plugin: SpectrumLike = plugin
+
+        self._n_nodes: int = n_nodes
+
+        edges = np.asarray(plugin._predefined_energies, dtype=float)
+
+        t, w = np.polynomial.legendre.leggauss(n_nodes)
+
+        centers = 0.5 * (edges[1:] + edges[:-1])
+        half_widths = 0.5 * (edges[1:] - edges[:-1])
+
+        # the nodes of a bin are contiguous
+
+        self._nodes: np.ndarray = (
+            centers[:, np.newaxis] + half_widths[:, np.newaxis] * t
+        ).ravel()
+
+        self._weights: np.ndarray = half_widths[:, np.newaxis] * w
+
+    @property
+    def n_nodes(self) -> int:
+        return self._n_nodes
+
+    def __call__(
+        self, likelihood_model: LikelihoodModel, integrate_method: str = ""
+    ) -> Tuple[Callable, Callable]:
+        # the differential flux of the plugin, whatever the method
+
+        differential_flux, _ = type(self._plugin)._get_diff_flux_and_integral(
+            self._plugin, likelihood_model, integrate_method="riemann"
+        )
+
+        nodes = self._nodes
+        weights = self._weights
+
+        def integral():
+            fluxes = differential_flux(nodes).reshape(weights.shape)
+
+            return np.einsum("ij,ij->i", fluxes, weights)
+
+        return differential_flux, integral
+
+
+def gauss_legendre_integration(
+    plugin: SpectrumLike, n_nodes: int = 2
+) -> GaussLegendreIntegration:
+    """
+    switch a plugin with predefined energies (e.g. the Monte Carlo
+    energies of a response) to Gauss-Legendre integration of the
+    model. Must be done before the model is set
+
+    :param plugin: the plugin
+    :type plugin: SpectrumLike
+    :param n_nodes: the number of nodes per bin
+    :type n_nodes: int
+    :returns:
+
+    """
+    integration = GaussLegendreIntegration(plugin, n_nodes)
+
+    plugin._get_diff_flux_and_integral = integration
+
+    return integration
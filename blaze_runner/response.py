@@ -0,0 +1,113 @@
+from typing import Optional
+
+import numpy as np
+import scipy.sparse as sp
+from mpi4py import MPI
+from threeML.utils.OGIP.response import InstrumentResponse
+
+from .shared_memory import share_arrays
+from .utils.logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+# above this fraction of non-zero elements the dense product is
+# faster than the sparse one
+
+_max_density = 0.35
+
+
+class SparseFolding:
+    def __init__(self, response: InstrumentResponse) -> None:
+        """
+        a replacement for the convolve of a response which folds the
+        fluxes through a CSR copy of the matrix. Only the non-zero
+        elements of the matrix are touched, which for the mostly empty
+        X-ray redistribution matrices is a fraction of the dense
+        product
+
+        :param response: the response to fold through
+        :type response: InstrumentResponse
+        :returns:
+
+        """
+        self._response: InstrumentResponse = response
+
+        self._matrix: sp.csr_matrix = sp.csr_matrix(response.matrix)
+
+    @property
+    def density(self) -> float:
+        return self._matrix.nnz / np.prod(self._matrix.shape)
+
+    def __call__(
+        self, precalc_fluxes: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        response = self._response
+
+        if precalc_fluxes is None:
+            try:
+                fluxes = response._integral_function()
+
+            except TypeError:
+                fluxes = response._integral_function(
+                    response.monte_carlo_energies[:-1],
+                    response.monte_carlo_energies[1:],
+                )
+
+        else:
+            fluxes = precalc_fluxes
+
+        # as in convolve, empty channels where the model is not
+        # defined must not spoil the counts
+
+        fluxes[~np.isfinite(fluxes)] = 0
+
+        return self._matrix @ fluxes
+
+    def share(self, comm: Optional[MPI.Comm] = None) -> None:
+        """
+        move the CSR arrays into memory shared between the ranks of a
+        node. Collective over the node
+
+        :param comm: the ranks of the node, by default those of
+        COMM_WORLD
+        :type comm: Optional[MPI.Comm]
+        :returns:
+
+        """
+        data, indices, indptr = share_arrays(
+            [self._matrix.data, self._matrix.indices, self._matrix.indptr],
+            comm=comm,
+        )
+
+        # constructing from the arrays copies nothing
+
+        self._matrix = sp.csr_matrix(
+            (data, indices, indptr), shape=self._matrix.shape, copy=False
+        )
+
+
+def sparse_folding(response: InstrumentResponse) -> Optional[SparseFolding]:
+    """
+    switch a response to sparse folding if its matrix is sparse
+    enough for it to be faster. The plugins look convolve up on the
+    instance of the response
+
+    :param response: the response
+    :type response: InstrumentResponse
+    :returns: the folding or None if the matrix is too dense
+
+    """
+    folding = SparseFolding(response)
+
+    if folding.density > _max_density:
+        log.debug(
+            f"the response is {folding.density:.0%} filled, "
+            "keeping the dense folding"
+        )
+
+        return None
+
+    response.convolve = folding
+
+    return folding
@@ -0,0 +1,522 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from mpi4py import MPI
+
+from .utils.logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+# the cost of a likelihood evaluation of each data type relative to
+# an XRT spectrum, from the profiles of the plugins
+
+_data_type_costs = {
+    "xrt": 1.0,
+    "nustar": 2.0,
+    "uvot": 0.5,
+    "grond": 0.5,
+    "lat": 30.0,
+    "sim_uvot": 0.5,
+    "sim_grond": 0.5,
+    "sim_lat": 5.0,
+}
+
+# the evaluation of the emulator and the many free parameters of the
+# leptonic model make every call and the sampling longer
+
+_model_costs = {"logparabola": 1.0, "leptonic": 5.0}
+
+# the LAT region model adds the sources around the blazar
+
+_lat_model_cost = 2.0
+
+# the seconds per unit of cost until there are measurements
+
+_seconds_per_unit = 60.0
+
+
+def _prior_cost(config: Dict[str, Any]) -> float:
+    data_types = [v["type"] for v in config["data"].values()]
+
+    cost = 1.0 + sum(_data_type_costs.get(t, 1.0) for t in data_types)
+
+    cost *= _model_costs.get(config["model"]["name"], 1.0)
+
+    if config["model"].get("lat_model") is not None and "lat" in data_types:
+        cost *= _lat_model_cost
+
+    return cost
+
+
+def _measurement(config: Dict[str, Any], seconds: float) -> Dict[str, Any]:
+    return dict(
+        model=config["model"]["name"],
+        cost=_prior_cost(config),
+        seconds=seconds,
+    )
+
+
+def _journals(file_name: Path) -> List[Path]:
+    return sorted(file_name.parent.glob(f"{file_name.stem}.*.jsonl"))
+
+
+def journal_file(file_name: Union[str, Path], rank: int) -> Path:
+    """
+    the file next to the measurements of a CostModel to which a rank
+    appends the times of its jobs as they finish, with append_cost.
+    CostModel.load merges them, so the times of a batch which is
+    stopped are not lost
+
+    :param file_name: the file of the measurements
+    :type file_name: Union[str, Path]
+    :param rank: the rank writing the journal
+    :type rank: int
+    :returns:
+
+    """
+    file_name = Path(file_name)
+
+    return file_name.with_suffix(f".{rank}.jsonl")
+
+
+def append_cost(
+    journal: Union[str, Path],
+    name: str,
+    config: Dict[str, Any],
+    seconds: float,
+) -> None:
+    """
+    append the measured time of a job to a journal
+
+    :param journal: the journal of the rank, from journal_file
+    :type journal: Union[str, Path]
+    :param name: the name of the job
+    :type name: str
+    :param config: its configuration
+    :type config: Dict[str, Any]
+    :param seconds: the time it took
+    :type seconds: float
+    :returns:
+
+    """
+    line = json.dumps(dict(name=name, **_measurement(config, seconds)))
+
+    with Path(journal).open("a") as f:
+        f.write(line + "\n")
+
+        f.flush()
+
+        os.fsync(f.fileno())
+
+
+class CostModel:
+    def __init__(self, measurements: Optional[Dict[str, Any]] = None):
+        """
+        estimates of the run time of analyses from their configuration:
+        the data types, the model and whether there is a LAT region
+        model. The relative costs are turned into seconds with the
+        measured times of earlier jobs, by model where there are some.
+        A job which was timed before is estimated by its own time
+
+        :param measurements: the measured jobs by name, as written by
+        save
+        :type measurements: Optional[Dict[str, Any]]
+        :returns:
+
+        """
+        self._measurements: Dict[str, Any] = dict(measurements or {})
+
+    @classmethod
+    def load(cls, file_name: Union[str, Path]) -> "CostModel":
+        """
+        the cost model of the measurements in a file and in the
+        journals next to it, empty if there are none yet
+
+        :param file_name: the file written by save
+        :type file_name: Union[str, Path]
+        :returns:
+
+        """
+        file_name = Path(file_name)
+
+        measurements: Dict[str, Any] = {}
+
+        if file_name.exists():
+            with file_name.open() as f:
+                measurements.update(json.load(f))
+
+        for journal in _journals(file_name):
+            with journal.open() as f:
+                for line in f:
+                    # the last line of a rank which was killed while
+                    # writing it is cut off
+
+                    try:
+                        measurement = json.loads(line)
+
+                    except json.JSONDecodeError:
+                        continue
+
+                    measurements[measurement.pop("name")] = measurement
+
+        return cls(measurements)
+
+    def save(self, file_name: Union[str, Path]) -> None:
+        """
+        write the measurements to a file and remove the journals next
+        to it, whose measurements a model from load already has. No
+        rank may still write to them
+
+        :param file_name: the file to write
+        :type file_name: Union[str, Path]
+        :returns:
+
+        """
+        file_name = Path(file_name)
+
+        tmp_file = file_name.with_suffix(f".{os.getpid()}.tmp")
+
+        with tmp_file.open("w") as f:
+            json.dump(self._measurements, f, indent=2)
+
+        os.replace(tmp_file, file_name)
+
+        for journal in _journals(file_name):
+            journal.unlink()
+
+    def record(
+        self, name: str, config: Dict[str, Any], seconds: float
+    ) -> None:
+        """
+        add the measured time of a job
+
+        :param name: the name of the job
+        :type name: str
+        :param config: its configuration
+        :type config: Dict[str, Any]
+        :param seconds: the time it took
+        :type seconds: float
+        :returns:
+
+        """
+        self._measurements[name] = _measurement(config, seconds)
+
+    def seconds_per_unit(self, model: Optional[str] = None) -> float:
+        """
+        the median seconds per unit of cost of the measured jobs, of
+        those with the model if there are any
+
+        :param model: the name of the model
+        :type model: Optional[str]
+        :returns:
+
+        """
+        measured = list(self._measurements.values())
+
+        same_model = [m for m in measured if m["model"] == model]
+
+        if same_model:
+            measured = same_model
+
+        if not measured:
+            return _seconds_per_unit
+
+        return float(np.median([m["seconds"] / m["cost"] for m in measured]))
+
+    def estimate(self, name: str, config: Dict[str, Any]) -> float:
+        """
+        the estimated run time of a job in seconds
+
+        :param name: the name of the job
+        :type name: str
+        :param config: its configuration
+        :type config: Dict[str, Any]
+        :returns:
+
+        """
+        cost = _prior_cost(config)
+
+        measured = self._measurements.get(name)
+
+        if measured is not None and measured["cost"] == cost:
+            return measured["seconds"]
+
+        return cost * self.seconds_per_unit(config["model"]["name"])
+
+
+def job_sizes(
+    requested: Sequence[Optional[int]],
+    estimates: Sequence[float],
+    n_ranks: int,
+    ranks_per_job: Optional[int] = None,
+) -> List[int]:
+    """
+    the number of ranks of every job: as many as its ranks entry
+    requests, or else ranks_per_job, or else its share of the ranks in
+    proportion to its estimated run time, rounded down to a power of
+    two. At most all ranks
+
+    :param requested: the ranks requested by each job or None
+    :type requested: Sequence[Optional[int]]
+    :param estimates: the estimated time of every job
+    :type estimates: Sequence[float]
+    :param n_ranks: the number of ranks running jobs
+    :type n_ranks: int
+    :param ranks_per_job: the ranks of the jobs without a request
+    :type ranks_per_job: Optional[int]
+    :returns:
+
+    """
+    for r in [ranks_per_job, *requested]:
+        if r is not None and r < 1:
+            msg = f"a job cannot run on {r} ranks"
+
+            log.error(msg)
+
+            raise RuntimeError(msg)
+
+    total = sum(estimates)
+
+    sizes = []
+
+    for r, estimate in zip(requested, estimates):
+        if r is None:
+            r = ranks_per_job
+
+        if r is None:
+            share = n_ranks * estimate / total if total > 0 else 1.0
+
+            r = 2 ** int(np.log2(max(share, 1.0)))
+
+        sizes.append(min(r, n_ranks))
+
+    return sizes
+
+
+def plan_pools(
+    sizes: Sequence[int], estimates: Sequence[float], n_ranks: int
+) -> Tuple[List[Tuple[int, int]], List[int]]:
+    """
+    the pools of groups which run the jobs, one for every size of job.
+    Every pool has one group to begin with, the ranks left are given
+    group by group to the pool with the most estimated time per group,
+    as long as it has more jobs than groups. If the ranks do not
+    suffice for a group of every size, the jobs of the largest size
+    run on groups of the next size and a warning is logged
+
+    :param sizes: the number of ranks of every job, at most n_ranks
+    :type sizes: Sequence[int]
+    :param estimates: the estimated time of every job
+    :type estimates: Sequence[float]
+    :param n_ranks: the number of ranks running jobs
+    :type n_ranks: int
+    :returns: the ranks per group and the number of groups of every
+    pool, and the pool of every job
+
+    """
+    group_sizes = sorted(set(sizes), reverse=True)
+
+    runs_on = {n: n for n in group_sizes}
+
+    while len(group_sizes) > 1 and sum(group_sizes) > n_ranks:
+        largest = group_sizes.pop(0)
+
+        log.warning(
+            f"{n_ranks} ranks are too few for a group of every size, the "
+            f"jobs of {largest} ranks run on {group_sizes[0]}"
+        )
+
+        for n in runs_on:
+            if runs_on[n] == largest:
+                runs_on[n] = group_sizes[0]
+
+    job_pools = [group_sizes.index(runs_on[n]) for n in sizes]
+
+    n_jobs = [job_pools.count(p) for p in range(len(group_sizes))]
+
+    load = [
+        sum(e for e, p in zip(estimates, job_pools) if p == pool)
+        for pool in range(len(group_sizes))
+    ]
+
+    n_groups = [1] * len(group_sizes)
+
+    free = n_ranks - sum(group_sizes)
+
+    while True:
+        candidates = [
+            p
+            for p, n in enumerate(group_sizes)
+            if n <= free and n_groups[p] < n_jobs[p]
+        ]
+
+        if not candidates:
+            break
+
+        pool = max(candidates, key=lambda p: load[p] / n_groups[p])
+
+        n_groups[pool] += 1
+
+        free -= group_sizes[pool]
+
+    return list(zip(group_sizes, n_groups)), job_pools
+
+
+def split_pools(
+    comm: MPI.Comm, pools: Sequence[Tuple[int, int]]
+) -> Tuple[MPI.Comm, Optional[int]]:
+    """
+    split the ranks of comm into the groups of the pools, consecutive
+    ranks per group. Rank 0 hands out the jobs and is in no group,
+    unless it is the only rank. The ranks left over join the last
+    group. Collective over comm
+
+    :param comm: the communicator to split
+    :type comm: MPI.Comm
+    :param pools: the ranks per group and the number of groups of
+    every pool, from plan_pools
+    :type pools: Sequence[Tuple[int, int]]
+    :returns: the group of this rank and its pool, COMM_NULL and None
+    on the dispatcher
+
+    """
+    rank = comm.Get_rank()
+
+    dispatcher = comm.Get_size() > 1
+
+    color = MPI.UNDEFINED
+
+    pool = None
+
+    if not (dispatcher and rank == 0):
+        worker = rank - 1 if dispatcher else rank
+
+        start = 0
+
+        n_groups = 0
+
+        for p, (group_size, n) in enumerate(pools):
+            for _ in range(n):
+                if start <= worker < start + group_size:
+                    color, pool = n_groups, p
+
+                start += group_size
+
+                n_groups += 1
+
+        if pool is None:
+            color, pool = n_groups - 1, len(pools) - 1
+
+    return comm.Split(color, rank), pool
+
+
+# the tags of the messages between the group leaders and the
+# dispatcher
+
+_request_tag = 1
+
+_job_tag = 2
+
+# the seconds between the looks of the dispatcher for requests
+
+_poll_interval = 0.01
+
+
+class WorkQueue:
+    def __init__(
+        self, comm: MPI.Comm, queues: Sequence[Sequence[int]]
+    ) -> None:
+        """
+        queues of jobs handed out by rank 0 of comm, which runs no jobs
+        itself: the leaders of the groups ask it for the next job of
+        their queue with next and rank 0 answers them in serve. A
+        request is answered whatever the other groups do, also while
+        their jobs do not enter MPI for hours. On a single rank, which
+        has to run the jobs itself, the queues are served locally
+
+        :param comm: the dispatcher and the group leaders
+        :type comm: MPI.Comm
+        :param queues: the jobs of every queue, in the order they are
+        handed out
+        :type queues: Sequence[Sequence[int]]
+        :returns:
+
+        """
+        self._comm: MPI.Comm = comm
+
+        self._queues: List[List[int]] = [list(q) for q in queues]
+
+        self._drawn: List[int] = [0] * len(self._queues)
+
+    def _pop(self, queue: int) -> Optional[int]:
+        if self._drawn[queue] == len(self._queues[queue]):
+            return None
+
+        self._drawn[queue] += 1
+
+        return self._queues[queue][self._drawn[queue] - 1]
+
+    def next(self, queue: int = 0) -> Optional[int]:
+        """
+        the next job of a queue, None once it is empty. Called by the
+        group leaders until they get None
+
+        :param queue: the queue of the group
+        :type queue: int
+        :returns:
+
+        """
+        if self._comm.Get_size() == 1:
+            return self._pop(queue)
+
+        self._comm.send(queue, dest=0, tag=_request_tag)
+
+        return self._comm.recv(source=0, tag=_job_tag)
+
+    def serve(self, n_leaders: int) -> None:
+        """
+        answer the requests of the group leaders until every one of
+        them was told that its queue is empty. Called on rank 0 only
+
+        :param n_leaders: the number of group leaders
+        :type n_leaders: int
+        :returns:
+
+        """
+        status = MPI.Status()
+
+        while n_leaders > 0:
+            # rather than spinning in recv the dispatcher sleeps, so
+            # that it leaves its core to the ranks running jobs
+
+            while not self._comm.Iprobe(
+                source=MPI.ANY_SOURCE, tag=_request_tag, status=status
+            ):
+                time.sleep(_poll_interval)
+
+            leader = status.Get_source()
+
+            job = self._pop(self._comm.recv(source=leader, tag=_request_tag))
+
+            self._comm.send(job, dest=leader, tag=_job_tag)
+
+            if job is None:
+                n_leaders -= 1
+
+
+def longest_first(estimates: List[float]) -> List[int]:
+    """
+    the order in which to hand out jobs: the longest first, so that
+    the short ones fill the gaps at the end
+
+    :param estimates: the estimated time of every job
+    :type estimates: List[float]
+    :returns: the job indices in order
+
+    """
+    return [int(i) for i in np.argsort(-np.asarray(estimates), kind="stable")]
@@ -0,0 +1,148 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from mpi4py import MPI
+
+from .utils.logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+# arrays in a window start on cache line boundaries
+
+_alignment = 64
+
+# the windows live until free_windows, the plugins hold views into
+# them
+
+_windows: List[MPI.Win] = []
+
+# the node communicators by the handle of the communicator split
+
+_node_comms: Dict[int, MPI.Comm] = {}
+
+
+def node_comm(comm: Optional[MPI.Comm] = None) -> MPI.Comm:
+    """
+    the communicator of the ranks of comm sharing memory with this
+    one, i.e. on the same node. Collective over comm on the first call
+
+    :param comm: the communicator to split, by default COMM_WORLD
+    :type comm: Optional[MPI.Comm]
+    :returns:
+
+    """
+    if comm is None:
+        comm = MPI.COMM_WORLD
+
+    key = comm.py2f()
+
+    if key not in _node_comms:
+        _node_comms[key] = comm.Split_type(MPI.COMM_TYPE_SHARED)
+
+    return _node_comms[key]
+
+
+def share_arrays(
+    arrays: Sequence[np.ndarray], comm: Optional[MPI.Comm] = None
+) -> List[np.ndarray]:
+    """
+    place read-only arrays in a single shared memory window of the
+    node. The arrays of the node leader are copied into the window,
+    every rank gets read-only views of them so that its own copies
+    can be freed.
+
+    Collective over the node: all ranks have to share arrays of the
+    same shapes and types in the same order
+
+    :param arrays: the arrays to share
+    :type arrays: Sequence[np.ndarray]
+    :param comm: the ranks sharing the window, by default the node
+    :type comm: Optional[MPI.Comm]
+    :returns: views of the arrays in shared memory
+
+    """
+    if comm is None:
+        comm = node_comm()
+
+    arrays = [np.asarray(a) for a in arrays]
+
+    layout = [(a.shape, a.dtype.str) for a in arrays]
+
+    mismatch = comm.bcast(layout, root=0) != layout
+
+    # all ranks give up, the leader must not wait in the window alone
+
+    if comm.allreduce(mismatch, op=MPI.LOR):
+        msg = "the ranks of the node have different arrays to share"
+
+        log.error(msg)
+
+        raise RuntimeError(msg)
+
+    offsets = []
+
+    n_bytes = 0
+
+    for a in arrays:
+        offsets.append(n_bytes)
+
+        n_bytes += -(-a.nbytes // _alignment) * _alignment
+
+    if n_bytes == 0:
+        return arrays
+
+    is_leader = comm.Get_rank() == 0
+
+    # the window itself is not necessarily aligned, leave room to
+    # move the arrays to the next boundary
+
+    window = MPI.Win.Allocate_shared(
+        n_bytes + _alignment if is_leader else 0, 1, comm=comm
+    )
+
+    buffer, _ = window.Shared_query(0)
+
+    # the window is mapped at the same offset into a page on all ranks
+
+    padding = -buffer.address % _alignment
+
+    views = [
+        np.ndarray(
+            a.shape, dtype=a.dtype, buffer=buffer, offset=padding + offset
+        )
+        for a, offset in zip(arrays, offsets)
+    ]
+
+    if is_leader:
+        for a, view in zip(arrays, views):
+            view[...] = a
+
+    comm.Barrier()
+
+    for view in views:
+        view.flags.writeable = False
+
+    _windows.append(window)
+
+    if is_leader:
+        log.debug(
+            f"shared {len(arrays)} arrays ({n_bytes / 2**20:.1f} MiB) "
+            f"between {comm.Get_size()} ranks"
+        )
+
+    return views
+
+
+def free_windows() -> None:
+    """
+    free all shared windows, e.g. once an analysis is done and before
+    the next one shares its arrays. Nothing may use the views any
+    more. Collective over the ranks sharing each window, which free
+    them in the order they were made
+
+    :returns:
+
+    """
+    while _windows:
+        _windows.pop(0).Free()
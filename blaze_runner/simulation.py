@@ -0,0 +1,697 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+import astropy.units as u
+import h5py
+import numpy as np
+import speclite.filters
+from astromodels import Function1D, Log_parabola, Parameter, Powerlaw
+from astromodels import Model as LikelihoodModel
+from scipy.special import gammaln
+from threeML.plugin_prototype import PluginPrototype
+from threeML.plugins.DispersionSpectrumLike import DispersionSpectrumLike
+from threeML.utils.OGIP.response import InstrumentResponse
+from threeML.utils.photometry.photometric_observation import (
+    PhotometericObservation,
+)
+
+from .utils.logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+# the channel and Monte Carlo energy grids (keV) of the production
+# responses, the energy resolution (sigma / sqrt(E)), the peak
+# effective area (cm2) and a typical exposure (s)
+
+_xray_instruments: Dict[str, Dict[str, Any]] = {
+    "xrt": dict(
+        channels=(0.1, 10.24, 1024),
+        energies=(0.1, 12.0, 2400),
+        resolution=0.06,
+        area=110.0,
+        exposure=5e3,
+    ),
+    "nustar": dict(
+        channels=(1.6, 165.44, 4096),
+        energies=(1.6, 165.0, 4096),
+        resolution=0.04,
+        area=800.0,
+        exposure=2e4,
+    ),
+}
+
+# central wavelengths and widths (angstrom) of the filters
+
+_photometric_instruments: Dict[str, Dict[str, tuple]] = {
+    "uvot": {
+        "UVW2": (2030.0, 330.0),
+        "UVM2": (2231.0, 250.0),
+        "UVW1": (2634.0, 350.0),
+        "U": (3465.0, 390.0),
+        "B": (4392.0, 490.0),
+        "V": (5468.0, 380.0),
+    },
+    "grond": {
+        "g": (4587.0, 690.0),
+        "r": (6220.0, 690.0),
+        "i": (7641.0, 600.0),
+        "z": (8999.0, 690.0),
+        "J": (12399.0, 1200.0),
+        "H": (16468.0, 1500.0),
+        "K": (21706.0, 1900.0),
+    },
+}
+
+_n_filter_points = 400
+
+# the LAT counts cube: 100 MeV to 300 GeV (in keV) over a 10 deg ROI
+
+_lat_energies = (1e5, 3e8)
+
+_lat_exposure = 3e11
+
+_lat_psf_1gev = 0.8
+
+_lat_psf_floor = 0.1
+
+
+def _default_spectrum() -> Function1D:
+    return Log_parabola(K=1e-2, piv=1.0, alpha=-2.0, beta=0.1)
+
+
+def _default_lat_spectrum() -> Function1D:
+    # a bright blazar, some 10000 counts above 100 MeV
+
+    return Powerlaw(K=1e-13, piv=1e6, index=-2.2)
+
+
+@contextmanager
+def _seeded_global_generator(seed: Optional[int]) -> Iterator[None]:
+    # threeML draws the counts from the global numpy generator, which
+    # is seeded for the simulation and restored afterwards
+
+    if seed is None:
+        yield
+
+        return
+
+    state = np.random.get_state()
+
+    np.random.seed(seed)
+
+    try:
+        yield
+
+    finally:
+        np.random.set_state(state)
+
+
+def _simpson_nodes(edges: np.ndarray) -> np.ndarray:
+    # the edges and the (arithmetic) middles of the bins
+
+    return np.concatenate([edges, 0.5 * (edges[1:] + edges[:-1])])
+
+
+def _simpson(edges: np.ndarray, fluxes: np.ndarray) -> np.ndarray:
+    # the integrals over the bins of the fluxes on _simpson_nodes
+
+    n = len(edges)
+
+    at_edges, at_middles = fluxes[..., :n], fluxes[..., n:]
+
+    return (
+        np.diff(edges)
+        / 6.0
+        * (at_edges[..., :-1] + 4 * at_middles + at_edges[..., 1:])
+    )
+
+
+def _seeds(seed: Optional[int], n: int) -> list:
+    # independent seeds for the observations of a data set
+
+    if seed is None:
+        return [None] * n
+
+    rng = np.random.default_rng(seed)
+
+    return [int(s) for s in rng.integers(2**32, size=n)]
+
+
+def _gaussian_response(
+    channels: tuple,
+    energies: tuple,
+    resolution: float,
+    area: float,
+) -> InstrumentResponse:
+    ebounds = np.linspace(*channels[:2], channels[2] + 1)
+
+    mc_energies = np.geomspace(*energies[:2], energies[2] + 1)
+
+    c = 0.5 * (ebounds[1:] + ebounds[:-1])
+    e = np.sqrt(mc_energies[1:] * mc_energies[:-1])
+
+    sigma = resolution * np.sqrt(e)
+
+    matrix = np.exp(-0.5 * ((c[:, np.newaxis] - e) / sigma) ** 2)
+
+    # as in the RMF files, the far tails are not stored
+
+    matrix[matrix < 1e-6] = 0
+
+    matrix /= np.maximum(matrix.sum(axis=0), 1e-30)
+
+    # an effective area rising to its peak and falling at high energy
+
+    peak = np.sqrt(energies[0] * energies[1])
+
+    effective_area = area * np.exp(-0.5 * np.log(e / peak) ** 2)
+
+    return InstrumentResponse(matrix * effective_area, ebounds, mc_energies)
+
+
+def simulate_xray(
+    directory: Path,
+    name: str,
+    instrument: str = "xrt",
+    source_function: Optional[Function1D] = None,
+    exposure: Optional[float] = None,
+    seed: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    simulate an X-ray observation with a response of production size
+    and write the OGIP source and background spectra and the response
+
+    :param directory: where the files are written
+    :type directory: Path
+    :param name: the name of the observation
+    :type name: str
+    :param instrument: xrt or nustar
+    :type instrument: str
+    :param source_function: the spectrum of the source
+    :type source_function: Optional[Function1D]
+    :param exposure: the exposure in s, by default that typical for
+    the instrument
+    :type exposure: Optional[float]
+    :param seed: the seed of the counts, by default they are drawn
+    from the global numpy generator
+    :type seed: Optional[int]
+    :returns: the entry of the observation for DataSet.from_dict
+
+    """
+    if instrument not in _xray_instruments:
+        msg = f"{instrument} is not one of {list(_xray_instruments)}"
+
+        log.error(msg)
+
+        raise RuntimeError(msg)
+
+    setup = _xray_instruments[instrument]
+
+    directory = Path(directory)
+
+    directory.mkdir(parents=True, exist_ok=True)
+
+    response = _gaussian_response(
+        setup["channels"],
+        setup["energies"],
+        setup["resolution"],
+        setup["area"],
+    )
+
+    if source_function is None:
+        source_function = _default_spectrum()
+
+    if exposure is None:
+        exposure = setup["exposure"]
+
+    # the background is folded through the response like the source.
+    # The source counts include a second realization of it
+
+    with _seeded_global_generator(seed):
+        source, background, on_source_background = [
+            DispersionSpectrumLike.from_function(
+                f"{name}_{kind}",
+                source_function=function,
+                response=response,
+                exposure=exposure,
+            ).observed_spectrum
+            for kind, function in (
+                ("src", source_function),
+                ("bkg", Powerlaw(K=1e-3, index=-1.0)),
+                ("bkg_src", Powerlaw(K=1e-3, index=-1.0)),
+            )
+        ]
+
+    simulation = DispersionSpectrumLike(
+        name,
+        observation=source.clone(
+            new_counts=source.counts + on_source_background.counts
+        ),
+        background=background,
+    )
+
+    # the source and background spectra and the response
+
+    simulation.write_pha(str(directory / name), overwrite=True)
+
+    return dict(
+        type=instrument,
+        observation=str(directory / f"{name}.pha{{1}}"),
+        background=str(directory / f"{name}_bak.pha{{1}}"),
+        response=str(directory / f"{name}.rsp"),
+        arf=None,
+    )
+
+
+def simulated_filters(instrument: str) -> speclite.filters.FilterSequence:
+    """
+    filter curves with the central wavelengths and widths of the UVOT
+    or GROND filters, sampled as finely as the real ones. They stand
+    in for the filter library which has to be downloaded
+
+    :param instrument: uvot or grond
+    :type instrument: str
+    :returns:
+
+    """
+    filters = []
+
+    for band, (center, width) in _photometric_instruments[instrument].items():
+        wavelength = np.linspace(
+            center - 3 * width, center + 3 * width, _n_filter_points
+        )
+
+        response = np.exp(-0.5 * ((wavelength - center) / width) ** 2)
+
+        response[[0, -1]] = 0
+
+        filters.append(
+            speclite.filters.FilterResponse(
+                wavelength * u.AA,
+                response,
+                meta=dict(group_name=f"sim{instrument}", band_name=band),
+            )
+        )
+
+    return speclite.filters.FilterSequence(filters)
+
+
+def simulate_photometry(
+    directory: Path,
+    name: str,
+    instrument: str = "uvot",
+    source_function: Optional[Function1D] = None,
+    error: float = 0.05,
+    seed: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    simulate the AB magnitudes of a source in all filters of an
+    instrument and write them to an HDF5 file
+
+    :param directory: where the file is written
+    :type directory: Path
+    :param name: the name of the observation
+    :type name: str
+    :param instrument: uvot or grond
+    :type instrument: str
+    :param source_function: the spectrum of the source
+    :type source_function: Optional[Function1D]
+    :param error: the error of the magnitudes
+    :type error: float
+    :param seed: the seed of the scatter of the magnitudes
+    :type seed: Optional[int]
+    :returns: the entry of the observation for DataSet.from_dict,
+    using the simulated filters
+
+    """
+    if source_function is None:
+        source_function = _default_spectrum()
+
+    filters = simulated_filters(instrument)
+
+    bands = list(_photometric_instruments[instrument])
+
+    wavelength = np.linspace(1000.0, 30000.0, 5000) * u.AA
+
+    energy = wavelength.to(u.keV, equivalencies=u.spectral())
+
+    # the photon flux per keV to the energy flux per angstrom
+
+    flux = (
+        source_function(energy.value)
+        / (u.cm**2 * u.s * u.keV)
+        * energy**2
+        / wavelength
+    ).to(u.erg / (u.cm**2 * u.s * u.AA))
+
+    magnitudes = np.array(
+        [
+            filters.get_ab_magnitudes(flux, wavelength)[band][0]
+            for band in filters.names
+        ]
+    )
+
+    rng = np.random.default_rng(seed)
+
+    magnitudes += rng.normal(0.0, error, len(bands))
+
+    observation = PhotometericObservation.from_dict(
+        {band: (m, error) for band, m in zip(bands, magnitudes)}
+    )
+
+    directory = Path(directory)
+
+    directory.mkdir(parents=True, exist_ok=True)
+
+    file_name = directory / f"{name}.h5"
+
+    observation.to_hdf5(str(file_name), overwrite=True)
+
+    return dict(type=f"sim_{instrument}", observation=str(file_name))
+
+
+def _lat_grid(n_energies: int, n_pixels: int, pixel_size: float):
+    edges = np.geomspace(*_lat_energies, n_energies + 1)
+
+    offsets = (np.arange(n_pixels) - (n_pixels - 1) / 2) * pixel_size
+
+    x, y = np.meshgrid(offsets, offsets)
+
+    return edges, x.ravel(), y.ravel()
+
+
+def _psf_templates(
+    edges: np.ndarray,
+    x: np.ndarray,
+    y: np.ndarray,
+    pixel_size: float,
+    dx: float,
+    dy: float,
+) -> np.ndarray:
+    # an energy dependent gaussian PSF, normalized in every energy bin
+
+    energies = np.sqrt(edges[1:] * edges[:-1])
+
+    width = np.maximum(
+        _lat_psf_1gev * (energies / 1e6) ** -0.8, _lat_psf_floor
+    )[:, np.newaxis]
+
+    r2 = (x - dx) ** 2 + (y - dy) ** 2
+
+    templates = np.exp(-0.5 * r2 / width**2) * pixel_size**2
+
+    return templates / (2 * np.pi * width**2)
+
+
+def simulate_lat(
+    directory: Path,
+    name: str,
+    ra: float,
+    dec: float,
+    source_function: Optional[Function1D] = None,
+    n_energies: int = 30,
+    n_pixels: int = 100,
+    pixel_size: float = 0.1,
+    seed: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    simulate a LAT counts cube of a point source on top of a galactic
+    and an isotropic diffuse background and write it with its exposure
+    and background templates to an HDF5 file
+
+    :param directory: where the file is written
+    :type directory: Path
+    :param name: the name of the observation
+    :type name: str
+    :param ra: the right ascension of the ROI center in deg
+    :type ra: float
+    :param dec: the declination of the ROI center in deg
+    :type dec: float
+    :param source_function: the spectrum of the source at the center
+    :type source_function: Optional[Function1D]
+    :param n_energies: the number of energy bins
+    :type n_energies: int
+    :param n_pixels: the number of pixels on a side
+    :type n_pixels: int
+    :param pixel_size: the size of the pixels in deg
+    :type pixel_size: float
+    :param seed: the seed of the counts
+    :type seed: Optional[int]
+    :returns: the entry of the observation for DataSet.from_dict
+
+    """
+    if source_function is None:
+        source_function = _default_lat_spectrum()
+
+    edges, x, y = _lat_grid(n_energies, n_pixels, pixel_size)
+
+    energies = np.sqrt(edges[1:] * edges[:-1])
+
+    # an effective area rising to a plateau above 1 GeV
+
+    exposure = _lat_exposure * (1 - np.exp(-energies / 3e5))
+
+    width = np.diff(edges)
+
+    # about 1 and 10 background counts per pixel at 100 MeV
+
+    isotropic = np.outer(width * energies**-2.3, np.ones_like(x))
+    isotropic *= 1.0 / isotropic[0, 0]
+
+    galactic = np.outer(width * energies**-2.7, 1 + 0.5 * np.tanh(y))
+    galactic *= 10.0 / galactic[0].mean()
+
+    # integrated over the bins as SimulatedLATLike does
+
+    counts = _simpson(edges, source_function(_simpson_nodes(edges)))
+
+    counts *= exposure
+
+    expected = (
+        counts[:, np.newaxis]
+        * _psf_templates(edges, x, y, pixel_size, 0.0, 0.0)
+        + galactic
+        + isotropic
+    )
+
+    rng = np.random.default_rng(seed)
+
+    directory = Path(directory)
+
+    directory.mkdir(parents=True, exist_ok=True)
+
+    file_name = directory / f"{name}.h5"
+
+    with h5py.File(file_name, "w") as f:
+        f.attrs["ra"] = ra
+        f.attrs["dec"] = dec
+        f.attrs["pixel_size"] = pixel_size
+        f.attrs["n_pixels"] = n_pixels
+
+        f.create_dataset("energy_edges", data=edges)
+        f.create_dataset("exposure", data=exposure)
+        f.create_dataset("galactic", data=galactic)
+        f.create_dataset("isotropic", data=isotropic)
+        f.create_dataset("counts", data=rng.poisson(expected))
+
+    return dict(type="sim_lat", cube=str(file_name), ra=ra, dec=dec)
+
+
+def simulate_data_set(
+    directory: Path,
+    ra: float,
+    dec: float,
+    n_xrt: int = 1,
+    n_nustar: int = 0,
+    n_uvot: int = 1,
+    n_grond: int = 0,
+    n_lat: int = 0,
+    seed: Optional[int] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    simulate the observations of a source by several instruments, as
+    many of each as given. The result is the data of an analysis file
+    and can be loaded with DataSet.from_dict
+
+    :param directory: where the files are written
+    :type directory: Path
+    :param ra: the right ascension of the source in deg
+    :type ra: float
+    :param dec: the declination of the source in deg
+    :type dec: float
+    :param n_xrt: the number of XRT observations
+    :type n_xrt: int
+    :param n_nustar: the number of NuSTAR observations
+    :type n_nustar: int
+    :param n_uvot: the number of UVOT observations
+    :type n_uvot: int
+    :param n_grond: the number of GROND observations
+    :type n_grond: int
+    :param n_lat: the number of LAT observations
+    :type n_lat: int
+    :param seed: the seed from which those of the observations are
+    drawn
+    :type seed: Optional[int]
+    :returns: the entries by name
+
+    """
+    data: Dict[str, Dict[str, Any]] = {}
+
+    seeds = iter(_seeds(seed, n_xrt + n_nustar + n_uvot + n_grond + n_lat))
+
+    for instrument, n in (("xrt", n_xrt), ("nustar", n_nustar)):
+        for i in range(n):
+            name = f"{instrument}_{i}"
+
+            data[name] = simulate_xray(
+                directory, name, instrument, seed=next(seeds)
+            )
+
+    for instrument, n in (("uvot", n_uvot), ("grond", n_grond)):
+        for i in range(n):
+            name = f"{instrument}_{i}"
+
+            data[name] = simulate_photometry(
+                directory, name, instrument, seed=next(seeds)
+            )
+
+    for i in range(n_lat):
+        name = f"lat_{i}"
+
+        data[name] = simulate_lat(directory, name, ra, dec, seed=next(seeds))
+
+    log.info(f"simulated {len(data)} observations in {directory}")
+
+    return data
+
+
+class SimulatedLATLike(PluginPrototype):
+    def __init__(self, name: str, cube: str) -> None:
+        """
+        a local stand-in for FermipyLike on a simulated counts cube.
+        The likelihood is the binned Poisson likelihood of the point
+        sources of the model in the ROI, each with its own energy
+        dependent PSF, and the galactic and isotropic diffuse
+        backgrounds, whose normalizations are nuisance parameters
+        named as in FermipyLike. Its cost grows with the number of
+        sources, energy bins and pixels as that of the real one
+
+        :param name: the name of the plugin
+        :type name: str
+        :param cube: the file written by simulate_lat
+        :type cube: str
+        :returns:
+
+        """
+        with h5py.File(cube, "r") as f:
+            self._ra: float = float(f.attrs["ra"])
+            self._dec: float = float(f.attrs["dec"])
+            self._pixel_size: float = float(f.attrs["pixel_size"])
+            self._n_pixels: int = int(f.attrs["n_pixels"])
+
+            self._edges: np.ndarray = f["energy_edges"][()]
+            self._exposure: np.ndarray = f["exposure"][()]
+            self._galactic: np.ndarray = f["galactic"][()]
+            self._isotropic: np.ndarray = f["isotropic"][()]
+            self._counts: np.ndarray = f["counts"][()].astype(float)
+
+        _, self._x, self._y = _lat_grid(
+            len(self._edges) - 1, self._n_pixels, self._pixel_size
+        )
+
+        self._log_factorial: float = gammaln(self._counts + 1).sum()
+
+        # the model is integrated with simpson's rule over the bins
+
+        self._nodes: np.ndarray = _simpson_nodes(self._edges)
+
+        nuisance_parameters = {
+            f"{name}_galdiff_Prefactor": Parameter(
+                f"{name}_galdiff_Prefactor",
+                1.0,
+                min_value=0.5,
+                max_value=1.5,
+                delta=0.01,
+            ),
+            f"{name}_isodiff_Normalization": Parameter(
+                f"{name}_isodiff_Normalization",
+                1.0,
+                min_value=0.5,
+                max_value=1.5,
+                delta=0.01,
+            ),
+        }
+
+        self._likelihood_model: Optional[LikelihoodModel] = None
+
+        self._sources: list = []
+
+        self._templates: Optional[np.ndarray] = None
+
+        super().__init__(name, nuisance_parameters)
+
+    def set_model(self, likelihood_model: LikelihoodModel) -> None:
+        self._likelihood_model = likelihood_model
+
+        half_size = 0.5 * self._n_pixels * self._pixel_size
+
+        self._sources = []
+
+        templates = []
+
+        cos_dec = np.cos(np.deg2rad(self._dec))
+
+        for i, source in enumerate(likelihood_model.point_sources.values()):
+            dx = (source.position.ra.value - self._ra) * cos_dec
+            dy = source.position.dec.value - self._dec
+
+            if max(abs(dx), abs(dy)) > half_size:
+                continue
+
+            self._sources.append(i)
+
+            templates.append(
+                _psf_templates(
+                    self._edges, self._x, self._y, self._pixel_size, dx, dy
+                )
+            )
+
+        self._templates = np.array(templates)
+
+        log.debug(f"{self.name} has {len(self._sources)} sources in the ROI")
+
+    def _source_counts(self) -> np.ndarray:
+        counts = np.empty((len(self._sources), len(self._edges) - 1))
+
+        for row, i in enumerate(self._sources):
+            fluxes = self._likelihood_model.get_point_source_fluxes(
+                i, self._nodes
+            )
+
+            counts[row] = _simpson(self._edges, fluxes) * self._exposure
+
+        return counts
+
+    def get_log_like(self) -> float:
+        galactic, isotropic = (
+            p.value for p in self.nuisance_parameters.values()
+        )
+
+        expected = np.einsum(
+            "se,sep->ep", self._source_counts(), self._templates
+        )
+
+        expected += galactic * self._galactic + isotropic * self._isotropic
+
+        return float(
+            np.sum(self._counts * np.log(expected) - expected)
+            - self._log_factorial
+        )
+
+    def inner_fit(self) -> float:
+        return self.get_log_like()
+
+    def get_number_of_data_points(self) -> int:
+        return self._counts.size
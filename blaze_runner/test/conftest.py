@@ -4,6 +4,7 @@ import shutil
 from glob import glob
 from pathlib import Path
 
+import numpy as np
 import pytest
 from blaze_runner.utils.package_data import get_path_of_data_file
 
@@ -11,3 +12,67 @@ from blaze_runner.utils.package_data import get_path_of_data_file
 @pytest.fixture(scope="session")
 def thing():
     pass
+
+
+def write_ogip(directory: Path, name: str, n_channels: int = 64) -> dict:
+    """
+    simulate an X-ray observation (source and background PHA files
+    and a response) and return its entry for DataSet.from_dict
+
+    """
+    from astromodels import Powerlaw
+    from threeML.plugins.DispersionSpectrumLike import DispersionSpectrumLike
+    from threeML.utils.OGIP.response import InstrumentResponse
+
+    ebounds = np.geomspace(0.3, 15.0, n_channels + 1)
+    mc_energies = np.geomspace(0.2, 20.0, 2 * n_channels + 1)
+
+    channels = np.log(np.sqrt(ebounds[1:] * ebounds[:-1]))
+    energies = np.log(np.sqrt(mc_energies[1:] * mc_energies[:-1]))
+
+    matrix = np.exp(
+        -0.5 * ((channels[:, None] - energies[None, :]) / 0.1) ** 2
+    )
+
+    # as in real RMFs, the far tails of the redistribution are not stored
+
+    matrix[matrix < 1e-6] = 0
+    matrix = 100.0 * matrix / (matrix.sum(axis=0) + 1e-30)
+
+    response = InstrumentResponse(matrix, ebounds, mc_energies)
+
+    rsp_file = directory / f"{name}.rsp"
+
+    response.to_fits(str(rsp_file), "TEST", "TEST", overwrite=True)
+
+    for kind, k in (("src", 1.0), ("bkg", 0.5)):
+        simulation = DispersionSpectrumLike.from_function(
+            f"{name}_{kind}",
+            source_function=Powerlaw(K=k),
+            response=response,
+            exposure=1000.0,
+        )
+
+        simulation.write_pha(str(directory / f"{name}_{kind}"), overwrite=True)
+
+    return dict(
+        type="xrt",
+        observation=str(directory / f"{name}_src.pha{{1}}"),
+        background=str(directory / f"{name}_bkg.pha{{1}}"),
+        response=str(rsp_file),
+        arf=None,
+    )
+
+
+@pytest.fixture
+def ogip_data(tmp_path):
+    """
+    a function simulating named X-ray observations in a temporary
+    directory
+
+    """
+
+    def simulate(name: str, n_channels: int = 64) -> dict:
+        return write_ogip(tmp_path, name, n_channels)
+
+    return simulate
@@ -0,0 +1,144 @@
+import pickle
+
+import numpy as np
+import pytest
+
+pytest.importorskip("astromodels")
+
+from astromodels import Powerlaw, TbAbs, ZDust
+
+from blaze_runner.absorption import _max_tables, tabulate_transmission
+
+_energies = np.geomspace(0.05, 100.0, 500)
+
+# optical to UV, where the extinction curve matters
+
+_optical_energies = np.geomspace(1e-3, 5e-2, 200)
+
+
+@pytest.mark.parametrize("nh", [1e-3, 0.05, 0.3, 3.0])
+def test_tabulated_tbabs_matches_original(nh):
+    original = TbAbs(NH=nh)
+    tabulated = tabulate_transmission(TbAbs(NH=nh), "NH", 1e-3)
+
+    np.testing.assert_allclose(
+        tabulated(_energies), original(_energies), rtol=1e-10, atol=1e-14
+    )
+
+
+def test_tables_follow_grid_and_redshift():
+    original = TbAbs(NH=0.3)
+    tabulated = tabulate_transmission(TbAbs(NH=0.3), "NH", 1e-3)
+
+    tabulated(_energies)
+
+    for grid in (_energies, _energies[::3], np.geomspace(0.1, 10, 30)):
+        for z in (0.0, 0.5):
+            original.redshift = z
+            tabulated.redshift = z
+
+            np.testing.assert_allclose(
+                tabulated(grid), original(grid), rtol=1e-10, atol=1e-14
+            )
+
+    assert len(tabulated.evaluate._tables) == 6
+
+
+def test_tables_kept_for_many_grids():
+    tabulated = tabulate_transmission(TbAbs(NH=0.3), "NH", 1e-3)
+
+    table = tabulated.evaluate
+
+    n_tabulated = dict(n=0)
+
+    tabulate = table._tabulate
+
+    def counted(x, args):
+        n_tabulated["n"] += 1
+
+        return tabulate(x, args)
+
+    table._tabulate = counted
+
+    # the plugins evaluate the model on their grids in turn
+
+    grids = [np.geomspace(0.1 + 0.01 * i, 10.0, 50) for i in range(20)]
+
+    for _ in range(3):
+        for nh in (0.1, 0.2):
+            tabulated.NH = nh
+
+            for grid in grids:
+                tabulated(grid)
+
+    assert n_tabulated["n"] == len(grids)
+
+    # past the limit the grid used least recently is dropped, not the
+    # one tabulated first
+
+    tabulated(grids[0])
+
+    n_new = _max_tables - len(grids) + 1
+
+    for i in range(n_new):
+        tabulated(np.geomspace(20.0 + i, 50.0, 10))
+
+    tabulated(grids[0])
+
+    assert n_tabulated["n"] == len(grids) + n_new
+
+    tabulated(grids[1])
+
+    assert n_tabulated["n"] == len(grids) + n_new + 1
+
+
+def test_tabulated_in_composite_and_pickle():
+    original = TbAbs(NH=0.3) * Powerlaw()
+    tabulated = tabulate_transmission(TbAbs(NH=0.3), "NH", 1e-3) * Powerlaw()
+
+    np.testing.assert_allclose(
+        tabulated(_energies), original(_energies), rtol=1e-10
+    )
+
+    restored = pickle.loads(pickle.dumps(tabulated))
+
+    np.testing.assert_allclose(
+        restored(_energies), original(_energies), rtol=1e-10
+    )
+
+
+@pytest.mark.parametrize("law", ["mw", "lmc", "smc"])
+@pytest.mark.parametrize("redshift", [0.0, 0.7])
+def test_tabulated_zdust_matches_original(law, redshift):
+    original = ZDust(e_bmv=0.18, redshift=redshift)
+    tabulated = tabulate_transmission(
+        ZDust(e_bmv=0.18, redshift=redshift), "e_bmv", 1e-3
+    )
+
+    original.extinction_law = law
+    tabulated.extinction_law = law
+
+    for e_bmv in (1e-5, 0.18, 1.5):
+        original.e_bmv = e_bmv
+        tabulated.e_bmv = e_bmv
+
+        np.testing.assert_allclose(
+            tabulated(_optical_energies),
+            original(_optical_energies),
+            rtol=1e-10,
+            atol=1e-14,
+        )
+
+
+def test_zdust_tables_follow_the_law():
+    tabulated = tabulate_transmission(ZDust(e_bmv=0.18), "e_bmv", 1e-3)
+
+    tabulated.extinction_law = "mw"
+
+    mw = tabulated(_optical_energies)
+
+    tabulated.extinction_law = "smc"
+
+    assert not np.allclose(tabulated(_optical_energies), mw)
+
+    assert len(tabulated.evaluate._tables) == 2
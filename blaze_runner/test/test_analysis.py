@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("threeML")
+pytest.importorskip("mpi4py")
+pytest.importorskip("astro_custom")
+pytest.importorskip("netspec")
+
+import threeML.bayesian.ultranest_sampler
+from mpi4py import MPI
+
+from blaze_runner.analysis import _sampler_world
+
+_names = ("comm", "rank", "using_mpi", "ultranest")
+
+
+def _globals():
+    module = threeML.bayesian.ultranest_sampler
+
+    return {k: getattr(module, k) for k in _names if hasattr(module, k)}
+
+
+def test_sampler_world_restores_the_globals():
+    module = threeML.bayesian.ultranest_sampler
+
+    before = _globals()
+
+    with _sampler_world(MPI.COMM_SELF):
+        assert module.comm is MPI.COMM_SELF
+        assert module.rank == 0
+        assert not module.using_mpi
+
+        # UltraNest is given the ranks of the analysis
+
+        if "ultranest" in before:
+            sampler = module.ultranest.ReactiveNestedSampler
+
+            assert sampler.keywords["comm"] is MPI.COMM_SELF
+
+    after = _globals()
+
+    assert after.keys() == before.keys()
+    assert all(after[k] is before[k] for k in before)
+
+    # also when the sampler fails
+
+    with pytest.raises(RuntimeError):
+        with _sampler_world(MPI.COMM_SELF):
+            raise RuntimeError("the sampler failed")
+
+    after = _globals()
+
+    assert after.keys() == before.keys()
+    assert all(after[k] is before[k] for k in before)
@@ -0,0 +1,104 @@
+import pytest
+
+pytest.importorskip("threeML")
+pytest.importorskip("mpi4py")
+pytest.importorskip("emcee")
+pytest.importorskip("astro_custom")
+pytest.importorskip("netspec")
+
+import yaml
+
+from blaze_runner.batch import run_batch
+from blaze_runner.scheduling import CostModel
+from blaze_runner.simulation import simulate_data_set
+
+_ra = 150.0
+
+_dec = 5.0
+
+
+def _config(tmp_path, name, seed, missing=False):
+    data = simulate_data_set(
+        tmp_path / "data" / name, _ra, _dec, n_xrt=1, n_uvot=1, seed=seed
+    )
+
+    if missing:
+        data["xrt_0"]["observation"] = str(tmp_path / "missing.pha")
+
+    config = dict(
+        data=data,
+        model=dict(
+            name="logparabola",
+            redshift=0.1,
+            ra=_ra,
+            dec=_dec,
+            source_name="src",
+            mw_nh=0.05,
+        ),
+        sampler=dict(
+            name="emcee",
+            setup=dict(n_iterations=20, n_burn_in=10, n_walkers=20, seed=1),
+        ),
+    )
+
+    file_name = tmp_path / f"{name}.yml"
+
+    with file_name.open("w") as f:
+        yaml.dump(config, f)
+
+    return file_name
+
+
+def _statuses(summary):
+    return {s["name"]: s["status"] for s in summary}
+
+
+def test_run_batch(tmp_path):
+    config_files = [
+        _config(tmp_path, "a", 1),
+        _config(tmp_path, "b", 2),
+        _config(tmp_path, "broken", 3, missing=True),
+    ]
+
+    output_dir = tmp_path / "output"
+
+    summary = run_batch(config_files, output_dir, checkpoint_every=5)
+
+    # the failing job does not stop the others
+
+    assert _statuses(summary) == dict(a="done", b="done", broken="failed")
+
+    broken = [s for s in summary if s["name"] == "broken"][0]
+
+    assert broken["message"]
+
+    for name in ("a", "b"):
+        assert (output_dir / name / "results.fits").exists()
+
+    assert not (output_dir / "broken" / "results.fits").exists()
+
+    # the finished jobs were recorded, the journals merged
+
+    costs = CostModel.load(output_dir / "costs.json")
+
+    for s in summary:
+        if s["status"] == "done":
+            with (tmp_path / f"{s['name']}.yml").open() as f:
+                config = yaml.load(f, Loader=yaml.SafeLoader)
+
+            assert costs.estimate(s["name"], config) == s["time"]
+
+    assert not list(output_dir.glob("costs.*.jsonl"))
+
+    # started again, the finished jobs are skipped and one which was
+    # stopped before writing its results is resumed from its checkpoint
+
+    (output_dir / "a" / "results.fits").unlink()
+
+    summary = run_batch(config_files, output_dir, checkpoint_every=5)
+
+    assert _statuses(summary) == dict(
+        a="done", b="done before", broken="failed"
+    )
+
+    assert (output_dir / "a" / "results.fits").exists()
@@ -0,0 +1,387 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+pytest.importorskip("threeML")
+
+from astromodels import Log_parabola, Model, PointSource, TbAbs, ZDust
+from threeML.plugins.DispersionSpectrumLike import DispersionSpectrumLike
+
+from blaze_runner.absorption import tabulate_transmission
+from blaze_runner.fused import fuse_absorbed_spectrum
+from blaze_runner.quadrature import gauss_legendre_integration
+from blaze_runner.response import sparse_folding
+from blaze_runner.simulation import _gaussian_response, _xray_instruments
+
+# everything here runs offline: the X-ray data are simulated, the
+# photometric filters ship with speclite and the models are given
+# their Galactic NH instead of looking it up. The leptonic model needs
+# the emulator network of netspec and is skipped without it.
+#
+# compare two commits with
+#
+#   pytest blaze_runner/test/test_benchmarks.py --benchmark-autosave
+#   pytest-benchmark compare
+
+
+# the grids the spectrum is evaluated on by the plugins: the
+# Gauss-Legendre nodes of the XRT and NuSTAR Monte Carlo energies and
+# the wavelengths of the optical filters, in keV
+
+_grids = {
+    "xrt": np.geomspace(0.2, 12.0, 4800),
+    "nustar": np.geomspace(1.6, 165.0, 8192),
+    "optical": np.geomspace(1.3e-3, 6.5e-3, 1000),
+}
+
+_models = ["leptonic", "logparabola"]
+
+
+def _model_class(name):
+    pytest.importorskip("astro_custom")
+    pytest.importorskip("netspec")
+
+    from blaze_runner.model import (
+        Leptonic,
+        LogParabola,
+        _emulator_template,
+        _leptonic_network,
+    )
+
+    if name == "leptonic":
+        try:
+            _emulator_template(_leptonic_network)
+
+        except OSError as e:
+            pytest.skip(f"the emulator {_leptonic_network} is missing: {e}")
+
+    return dict(leptonic=Leptonic, logparabola=LogParabola)[name]
+
+
+def _model(name):
+    return _model_class(name)("src", 0.3, 150.0, 5.0, mw_nh=0.05)
+
+
+def _absorbed_log_parabola(tabulate=True, fuse=True, composite=False):
+    # the shape LogParabola builds
+
+    mw_gas = TbAbs(NH=0.05)
+    z_dust = ZDust(e_bmv=0.1)
+
+    if tabulate:
+        tabulate_transmission(mw_gas, "NH", 1e-3)
+        tabulate_transmission(z_dust, "e_bmv", 1e-3)
+
+    spectrum = Log_parabola(K=1e-2, piv=1.0, alpha=-2.0, beta=0.2)
+
+    if composite:
+        spectrum = spectrum + Log_parabola(piv=1146890.0, K=1e-14)
+
+    shape = mw_gas * z_dust * spectrum
+
+    if fuse:
+        fuse_absorbed_spectrum(shape, [mw_gas, z_dust], spectrum)
+
+    return shape
+
+
+# the absorbed spectrum evaluated through the expression tree of
+# astromodels, with the absorbers tabulated, and fused
+
+_evaluations = {
+    "expression tree": dict(tabulate=False, fuse=False),
+    "tabulated": dict(fuse=False),
+    "fused": dict(),
+}
+
+
+def _xray_response(instrument):
+    settings = _xray_instruments[instrument]
+
+    return _gaussian_response(
+        settings["channels"],
+        settings["energies"],
+        settings["resolution"],
+        settings["area"],
+    )
+
+
+def _moving(*parameters):
+    # a sampler moves the parameters on every call, which must not be
+    # served from the caches
+
+    values = [(p.value, p.value * 1.01) for p in parameters]
+
+    state = dict(i=0)
+
+    def move():
+        state["i"] += 1
+
+        for p, v in zip(parameters, values):
+            p.value = v[state["i"] % 2]
+
+    return move
+
+
+def _xray_plugin(ogip_data):
+    from blaze_runner.observation import DataSet
+
+    entry = ogip_data("xrt", n_channels=512)
+
+    plugin = DataSet.from_dict({"xrt": entry}).observations[0].plugin
+
+    shape = _absorbed_log_parabola()
+
+    plugin.set_model(
+        Model(PointSource("src", 150.0, 5.0, spectral_shape=shape))
+    )
+
+    return plugin, shape
+
+
+def _photometric_plugin():
+    import speclite.filters
+    from threeML.utils.photometry.photometric_observation import (
+        PhotometericObservation,
+    )
+
+    from blaze_runner.observation import (
+        PhotometricDataContainer,
+        PhotometricObservation,
+    )
+
+    filters = speclite.filters.load_filters("bessell-*")
+
+    bands = [name.split("-")[1] for name in filters.names]
+
+    observation = PhotometericObservation.from_dict(
+        {band: (18.0 + 0.1 * i, 0.05) for i, band in enumerate(bands)}
+    )
+
+    plugin = PhotometricObservation(
+        PhotometricDataContainer(name="optical", observation=""),
+        filter_set=filters,
+        observation=observation,
+    ).plugin
+
+    shape = _absorbed_log_parabola()
+
+    plugin.set_model(
+        Model(PointSource("src", 150.0, 5.0, spectral_shape=shape))
+    )
+
+    return plugin, shape
+
+
+def test_cold_import(benchmark):
+    # a new interpreter for every round, its start up is part of the
+    # time but the same between commits
+
+    benchmark.pedantic(
+        subprocess.run,
+        args=([sys.executable, "-c", "import blaze_runner"],),
+        kwargs=dict(check=True),
+        rounds=5,
+        iterations=1,
+    )
+
+
+@pytest.mark.parametrize("name", _models)
+def test_model_construction(benchmark, name):
+    cls = _model_class(name)
+
+    model = benchmark(cls, "src", 0.3, 150.0, 5.0, mw_nh=0.05)
+
+    assert model.source_name == "src"
+
+
+@pytest.mark.parametrize("grid", list(_grids))
+def test_absorbed_log_parabola_evaluation(benchmark, grid):
+    shape = _absorbed_log_parabola()
+
+    move = _moving(shape.K_3)
+
+    def evaluate():
+        move()
+
+        return shape(_grids[grid])
+
+    assert np.all(np.isfinite(benchmark(evaluate)))
+
+
+@pytest.mark.parametrize("grid", list(_grids))
+@pytest.mark.parametrize("name", _models)
+def test_model_evaluation(benchmark, name, grid):
+    model = _model(name)
+
+    shape = model.model["src"].spectrum.main.shape
+
+    move = _moving(shape.K_3)
+
+    def evaluate():
+        move()
+
+        return shape(_grids[grid])
+
+    assert np.all(np.isfinite(benchmark(evaluate)))
+
+
+def test_xray_likelihood(benchmark, ogip_data):
+    plugin, shape = _xray_plugin(ogip_data)
+
+    move = _moving(shape.K_3)
+
+    def log_like():
+        move()
+
+        return plugin.get_log_like()
+
+    assert np.isfinite(benchmark(log_like))
+
+
+def test_photometric_likelihood(benchmark):
+    plugin, shape = _photometric_plugin()
+
+    move = _moving(shape.K_3)
+
+    def log_like():
+        move()
+
+        return plugin.get_log_like()
+
+    assert np.isfinite(benchmark(log_like))
+
+
+@pytest.mark.parametrize("name", _models)
+def test_analysis_setup(benchmark, name, ogip_data):
+    model_class = _model_class(name)
+
+    from blaze_runner.analysis import Analysis
+    from blaze_runner.observation import DataSet
+
+    entries = {f"xrt_{i}": ogip_data(f"xrt_{i}") for i in range(3)}
+
+    def setup():
+        model = model_class("src", 0.3, 150.0, 5.0, mw_nh=0.05)
+
+        data_set = DataSet.from_dict(
+            {k: dict(v) for k, v in entries.items()}
+        )
+
+        return Analysis(model, data_set)
+
+    analysis = benchmark.pedantic(setup, rounds=3, iterations=1)
+
+    assert len(analysis.ba.data_list) == 3
+
+
+@pytest.mark.parametrize("composite", [False, True])
+@pytest.mark.parametrize("evaluation", list(_evaluations))
+def test_absorbed_spectrum_evaluation(benchmark, evaluation, composite):
+    shape = _absorbed_log_parabola(
+        composite=composite, **_evaluations[evaluation]
+    )
+
+    move = _moving(shape.NH_1, shape.e_bmv_2, shape.K_3)
+
+    def evaluate():
+        move()
+
+        return shape(_grids["xrt"])
+
+    assert np.all(np.isfinite(benchmark(evaluate)))
+
+
+@pytest.mark.parametrize("moving", ["K_3", "NH_1"])
+@pytest.mark.parametrize("evaluation", ["tabulated", "fused"])
+def test_factor_cache(benchmark, evaluation, moving):
+    # the fused evaluation reuses the factor which did not move
+
+    shape = _absorbed_log_parabola(
+        composite=True, **_evaluations[evaluation]
+    )
+
+    move = _moving(shape.parameters[moving])
+
+    def evaluate():
+        move()
+
+        return shape(_grids["xrt"])
+
+    assert np.all(np.isfinite(benchmark(evaluate)))
+
+
+@pytest.mark.parametrize("folding", ["dense", "sparse"])
+@pytest.mark.parametrize("instrument", list(_xray_instruments))
+def test_folding(benchmark, instrument, folding):
+    response = _xray_response(instrument)
+
+    if folding == "sparse":
+        sparse_folding(response)
+
+    fluxes = np.random.default_rng(1).uniform(
+        size=len(response.monte_carlo_energies) - 1
+    )
+
+    counts = benchmark(response.convolve, precalc_fluxes=fluxes)
+
+    assert len(counts) == len(response.ebounds) - 1
+
+
+# with the absorbed log parabola on the XRT response, Gauss-Legendre
+# with two nodes per bin took 2070 us per call against 1580 us for the
+# Riemann sum, about 1.3 times as long, which is why it is not the
+# default. The accuracy of the methods is checked in test_quadrature
+
+
+@pytest.mark.parametrize("method", ["riemann", "simpson", "gauss_legendre"])
+@pytest.mark.parametrize("name", _models)
+def test_model_integration(benchmark, name, method):
+    model = _model(name)
+
+    plugin = DispersionSpectrumLike.from_function(
+        "xrt", source_function=Log_parabola(), response=_xray_response("xrt")
+    )
+
+    if method == "gauss_legendre":
+        gauss_legendre_integration(plugin)
+
+    else:
+        plugin.model_integrate_method = method
+
+    plugin.set_model(model.model)
+
+    shape = model.model["src"].spectrum.main.shape
+
+    move = _moving(shape.K_3)
+
+    def evaluate():
+        move()
+
+        return plugin._evaluate_model()
+
+    assert np.all(np.isfinite(benchmark(evaluate)))
+
+
+@pytest.mark.parametrize("evaluation", ["scalar", "batch"])
+def test_emulator_evaluation(benchmark, evaluation):
+    model = _model_class("leptonic")("src", 0.3, 150.0, 5.0, mw_nh=0.05)
+
+    energies = np.geomspace(1e-3, 1e8, 400)
+
+    parameters = np.tile(model.emulator_parameter_vector(), (256, 1))
+
+    def scalar():
+        return np.array(
+            [model._spectrum.evaluate(energies, *row) for row in parameters]
+        )
+
+    def batch():
+        return model.evaluate_batch(energies, parameters)
+
+    fluxes = benchmark(dict(scalar=scalar, batch=batch)[evaluation])
+
+    assert fluxes.shape == (256, len(energies))
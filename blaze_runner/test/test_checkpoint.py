@@ -0,0 +1,271 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("threeML")
+pytest.importorskip("mpi4py")
+pytest.importorskip("emcee")
+
+from astromodels import Line, Model, PointSource, Uniform_prior
+from threeML import BayesianAnalysis, DataList, XYLike
+
+from blaze_runner.checkpoint import (
+    CheckpointedEmceeSampler,
+    checkpoint_sampler,
+    has_checkpoint,
+    resume_sampler,
+)
+from blaze_runner.io.stream import PosteriorStream, iter_stream, read_stream
+
+_n_walkers = 10
+
+
+class _Preempted(Exception):
+    pass
+
+
+class _Preemption:
+    def __init__(self, function, n_calls):
+        # the job is killed after n_calls likelihood evaluations
+
+        self._function = function
+
+        self._n_calls = n_calls
+
+    def __call__(self):
+        self._n_calls -= 1
+
+        if self._n_calls < 0:
+            raise _Preempted()
+
+        return self._function()
+
+
+def _bayesian_analysis():
+    x = np.linspace(1.0, 10.0, 20)
+
+    rng = np.random.default_rng(1234)
+
+    xy = XYLike(
+        "xy",
+        x,
+        2.0 * x + 1.0 + rng.normal(0, 0.5, len(x)),
+        np.full(len(x), 0.5),
+    )
+
+    line = Line(a=1.0, b=2.0)
+
+    line.a.prior = Uniform_prior(lower_bound=-10, upper_bound=10)
+    line.b.prior = Uniform_prior(lower_bound=-10, upper_bound=10)
+
+    model = Model(PointSource("src", 0.0, 0.0, spectral_shape=line))
+
+    return BayesianAnalysis(model, DataList(xy))
+
+
+def _sample(directory, preempt_after=None, stream=False, load_stream=True):
+    ba = _bayesian_analysis()
+
+    ba.set_sampler("emcee")
+    ba.sampler.setup(
+        n_iterations=30, n_burn_in=20, n_walkers=_n_walkers, seed=1234
+    )
+
+    checkpoint_sampler(
+        ba, directory, every=7, stream=stream, load_stream=load_stream
+    )
+
+    if preempt_after is not None:
+        xy = ba.data_list["xy"]
+
+        xy.get_log_like = _Preemption(xy.get_log_like, preempt_after)
+
+    # the starting points are drawn from the global generator
+
+    np.random.seed(42)
+
+    ba.sample(quiet=True)
+
+    return ba
+
+
+@pytest.mark.parametrize("preempt_after", [12, 35])
+def test_resume_continues_the_chain(tmp_path, preempt_after):
+    reference = _sample(tmp_path / "reference").sampler.raw_samples
+
+    with pytest.raises(_Preempted):
+        _sample(tmp_path / "run", preempt_after * _n_walkers)
+
+    # a new job, which only knows the checkpoint
+
+    ba = _bayesian_analysis()
+
+    resume_sampler(ba, tmp_path / "run")
+
+    ba.sample(quiet=True)
+
+    np.testing.assert_array_equal(ba.sampler.raw_samples, reference)
+
+    assert ba.sampler.raw_samples.shape == (30 * _n_walkers, 2)
+
+
+def test_resume_other_parameters(tmp_path):
+    _sample(tmp_path / "run")
+
+    ba = _bayesian_analysis()
+
+    ba._likelihood_model.src.spectrum.main.Line.a.fix = True
+
+    with pytest.raises(RuntimeError):
+        resume_sampler(ba, tmp_path / "run")
+
+
+def test_resume_without_checkpoint(tmp_path):
+    with pytest.raises(RuntimeError):
+        resume_sampler(_bayesian_analysis(), tmp_path)
+
+
+@pytest.mark.parametrize("preempt_after", [12, 35])
+def test_resume_streamed_chain(tmp_path, preempt_after):
+    reference = _sample(tmp_path / "reference").sampler
+
+    with pytest.raises(_Preempted):
+        _sample(tmp_path / "run", preempt_after * _n_walkers, stream=True)
+
+    ba = _bayesian_analysis()
+
+    resume_sampler(ba, tmp_path / "run")
+
+    ba.sample(quiet=True)
+
+    np.testing.assert_array_equal(
+        ba.sampler.raw_samples, reference.raw_samples
+    )
+
+    np.testing.assert_array_equal(
+        ba.sampler.log_like_values, reference.log_like_values
+    )
+
+    # only the last block is held by the sampler
+
+    assert ba.sampler._sampler.iteration < 30
+
+    _, arrays = read_stream(tmp_path / "run" / "posterior.h5")
+
+    np.testing.assert_array_equal(arrays["samples"], reference.raw_samples)
+
+    np.testing.assert_array_equal(arrays["weights"], 1.0)
+
+
+def test_stream_without_loading(tmp_path):
+    reference = _sample(tmp_path / "reference").sampler
+
+    ba = _sample(tmp_path / "run", stream=True, load_stream=False)
+
+    # the chain is only in the stream
+
+    assert ba.results is None
+
+    _, arrays = read_stream(ba.sampler.stream_file)
+
+    np.testing.assert_array_equal(arrays["samples"], reference.raw_samples)
+
+    np.testing.assert_array_equal(
+        arrays["log_like"], reference.log_like_values
+    )
+
+
+def test_log_priors_of_all_samples():
+    ba = _bayesian_analysis()
+
+    sampler = CheckpointedEmceeSampler(ba.likelihood_model, ba.data_list)
+
+    sampler._update_free_parameters()
+
+    # the last one is outside of the prior of b
+
+    samples = np.array([[1.0, 2.0], [-3.0, 9.5], [0.5, 11.0]])
+
+    log_priors = sampler._log_priors(samples)
+
+    np.testing.assert_allclose(
+        log_priors, [sampler._log_prior(x) for x in samples]
+    )
+
+    assert log_priors[-1] == -np.inf
+
+
+def test_read_stream_while_writing(tmp_path):
+    file_name = tmp_path / "posterior.h5"
+
+    stream = PosteriorStream(file_name, ["a", "b"], chunk_size=4)
+
+    samples = np.arange(20.0).reshape(10, 2)
+
+    stream.append(samples[:3], np.arange(3.0))
+
+    # nothing is written before a chunk is full
+
+    assert len(read_stream(file_name)[1]["log_like"]) == 0
+
+    stream.append(samples[3:6], np.arange(3.0, 6.0))
+
+    parameters, arrays = read_stream(file_name)
+
+    assert parameters == ["a", "b"]
+
+    np.testing.assert_array_equal(arrays["samples"], samples[:6])
+
+    stream.close()
+
+    # continued after the fourth row
+
+    stream = PosteriorStream(file_name, ["a", "b"], chunk_size=4, n_rows=4)
+
+    stream.append(samples[4:], np.arange(4.0, 10.0), np.full(6, 0.5))
+
+    stream.close()
+
+    _, arrays = read_stream(file_name)
+
+    np.testing.assert_array_equal(arrays["samples"], samples)
+    np.testing.assert_array_equal(arrays["log_like"], np.arange(10.0))
+    np.testing.assert_array_equal(arrays["weights"][4:], 0.5)
+
+    # in blocks, the last one shorter
+
+    blocks = list(iter_stream(file_name, chunk_size=4))
+
+    assert [len(b["log_like"]) for b in blocks] == [4, 4, 2]
+
+    np.testing.assert_array_equal(
+        np.concatenate([b["samples"] for b in blocks]), samples
+    )
+
+    with pytest.raises(RuntimeError):
+        PosteriorStream(file_name, ["a", "c"], n_rows=4)
+
+    with pytest.raises(RuntimeError):
+        PosteriorStream(file_name, ["a", "b"], n_rows=11)
+
+
+def test_refuse_settings_which_cannot_be_restored(tmp_path):
+    pytest.importorskip("ultranest")
+
+    from ultranest.stepsampler import (
+        SliceSampler,
+        generate_mixture_random_direction,
+    )
+
+    ba = _bayesian_analysis()
+
+    ba.set_sampler("ultranest")
+    ba.sampler.setup(
+        stepsampler=SliceSampler(
+            nsteps=10, generate_direction=generate_mixture_random_direction
+        )
+    )
+
+    with pytest.raises(RuntimeError):
+        checkpoint_sampler(ba, tmp_path)
+
+    assert not has_checkpoint(tmp_path)
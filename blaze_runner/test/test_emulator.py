@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from scipy.interpolate import PchipInterpolator
+
+from blaze_runner.emulator import batch_pchip
+
+_energies = np.geomspace(1e-3, 1e8, 400)
+
+
+def test_batch_pchip_matches_scipy():
+    rng = np.random.default_rng(1234)
+
+    nodes = np.log(np.geomspace(1e-6, 1e8, 300))
+
+    values = np.cumsum(rng.normal(size=(32, 300)), axis=1)
+
+    # includes points outside the nodes on both ends
+
+    points = np.log(np.geomspace(1e-8, 1e10, 500))[np.newaxis, :]
+    points = points + rng.normal(size=(32, 1))
+
+    batch = batch_pchip(nodes, values, points)
+
+    for row, (v, p) in enumerate(zip(values, points)):
+        np.testing.assert_allclose(
+            batch[row], PchipInterpolator(nodes, v)(p), rtol=1e-10, atol=1e-10
+        )
+
+
+def _random_parameters(model, n, rng):
+    emulator = model._spectrum
+
+    rows = np.tile(model.emulator_parameter_vector(), (n, 1))
+
+    for i, parameter in enumerate(emulator.parameters.values()):
+        if i < 3:
+            # K, scale and redshift
+
+            continue
+
+        rows[:, i] = rng.uniform(parameter.min_value, parameter.max_value, n)
+
+    # scale follows the lorentz factor as in the linked model
+
+    lorentz = model.emulator_parameter_names.index("lorentz_factor")
+
+    rows[:, 1] = rows[:, lorentz] / (1 + model._redshift)
+
+    return rows
+
+
+def test_leptonic_batch_matches_scalar():
+    pytest.importorskip("astro_custom")
+    pytest.importorskip("netspec")
+
+    from blaze_runner.model import Leptonic
+
+    model = Leptonic("src", 0.3, 150.0, 5.0)
+
+    rng = np.random.default_rng(42)
+
+    n = 256
+
+    parameters = _random_parameters(model, n, rng)
+
+    scalar = np.array(
+        [model._spectrum.evaluate(_energies, *row) for row in parameters]
+    )
+
+    batch = model.evaluate_batch(_energies, parameters)
+
+    assert batch.shape == (n, len(_energies))
+
+    np.testing.assert_allclose(batch, scalar, rtol=1e-5)
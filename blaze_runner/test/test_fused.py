@@ -0,0 +1,200 @@
+import pickle
+
+import numpy as np
+import pytest
+
+pytest.importorskip("astromodels")
+
+from astromodels import Log_parabola, PointSource, TbAbs, ZDust
+
+from blaze_runner.absorption import tabulate_transmission
+from blaze_runner.fused import fuse_absorbed_spectrum
+
+_energies = np.geomspace(1e-3, 100.0, 2000)
+
+
+def _spectrum(composite):
+    if composite:
+        return Log_parabola(K=1e-3) + Log_parabola(piv=1146890.0, K=1e-14)
+
+    return Log_parabola(K=1e-3)
+
+
+def _shape(composite, tabulate=True, fuse=True):
+    mw_gas = TbAbs(NH=0.1)
+    z_dust = ZDust(e_bmv=0.1)
+
+    if tabulate:
+        tabulate_transmission(mw_gas, "NH", 1e-3)
+        tabulate_transmission(z_dust, "e_bmv", 1e-3)
+
+    spectrum = _spectrum(composite)
+
+    shape = mw_gas * z_dust * spectrum
+
+    if fuse:
+        fuse_absorbed_spectrum(shape, [mw_gas, z_dust], spectrum)
+
+    return shape
+
+
+@pytest.mark.parametrize("composite", [False, True])
+def test_fused_matches_composite(composite):
+    original = _shape(composite, tabulate=False, fuse=False)
+    fused = _shape(composite)
+
+    for nh, e_bmv in [(0.1, 0.1), (0.5, 1e-4), (2.0, 0.7)]:
+        original.NH_1 = nh
+        fused.NH_1 = nh
+        original.e_bmv_2 = e_bmv
+        fused.e_bmv_2 = e_bmv
+
+        np.testing.assert_allclose(
+            fused(_energies), original(_energies), rtol=1e-10, atol=0
+        )
+
+
+def test_fused_in_point_source():
+    original = _shape(False, tabulate=False, fuse=False)
+    fused = _shape(False)
+
+    source = PointSource("src", 0.0, 0.0, spectral_shape=fused)
+
+    # a kept result is not changed by the next evaluation
+
+    first = source(_energies)
+
+    source.spectrum.main.shape.NH_1 = 1.0
+    original.NH_1 = 1.0
+
+    second = source(_energies)
+
+    assert not np.allclose(first, second)
+
+    np.testing.assert_allclose(second, original(_energies), rtol=1e-10)
+
+
+def test_fused_result_is_kept():
+    fused = _shape(False)
+
+    first = fused(_energies)
+
+    expected = first.copy()
+
+    # a new parameter point on the same grid
+
+    fused.NH_1 = 1.0
+
+    second = fused(_energies)
+
+    np.testing.assert_array_equal(first, expected)
+
+    assert not np.allclose(first, second)
+
+
+def test_fused_pickle():
+    fused = _shape(False)
+
+    restored = pickle.loads(pickle.dumps(fused))
+
+    np.testing.assert_allclose(
+        restored(_energies), fused(_energies), rtol=1e-12
+    )
+
+
+def test_fused_requires_tabulation():
+    mw_gas = TbAbs(NH=0.1)
+    z_dust = ZDust(e_bmv=0.1)
+    spectrum = Log_parabola()
+
+    with pytest.raises(RuntimeError):
+        fuse_absorbed_spectrum(
+            mw_gas * z_dust * spectrum, [mw_gas, z_dust], spectrum
+        )
+
+
+def test_factor_cache_counts():
+    original = _shape(False, tabulate=False, fuse=False)
+    fused = _shape(False)
+
+    fused(_energies)
+
+    info = fused.evaluate.cache_info()
+
+    assert info["absorption"] == dict(hits=0, misses=1)
+    assert info["spectrum"] == dict(hits=0, misses=1)
+
+    # only the spectrum moves
+
+    fused.K_3 = 2e-3
+    original.K_3 = 2e-3
+
+    np.testing.assert_allclose(
+        fused(_energies), original(_energies), rtol=1e-10
+    )
+
+    info = fused.evaluate.cache_info()
+
+    assert info["absorption"] == dict(hits=1, misses=1)
+    assert info["spectrum"] == dict(hits=0, misses=2)
+
+    # only the absorption moves
+
+    fused.e_bmv_2 = 0.3
+    original.e_bmv_2 = 0.3
+
+    np.testing.assert_allclose(
+        fused(_energies), original(_energies), rtol=1e-10
+    )
+
+    info = fused.evaluate.cache_info()
+
+    assert info["absorption"] == dict(hits=1, misses=2)
+    assert info["spectrum"] == dict(hits=1, misses=2)
+
+    # a second grid has its own cache
+
+    fused(_energies[::2])
+
+    info = fused.evaluate.cache_info()
+
+    assert info["absorption"]["misses"] == 3
+
+    fused.evaluate.reset_cache_info()
+
+    assert fused.evaluate.cache_info()["spectrum"] == dict(hits=0, misses=0)
+
+
+def test_union_grid():
+    original = _shape(False, tabulate=False, fuse=False)
+    fused = _shape(False)
+
+    # overlapping grids, as the plugins of several instruments
+
+    grids = [_energies, np.geomspace(0.5, 200.0, 700), _energies[::3]]
+
+    for x in grids:
+        fused(x)
+
+    n_energies = fused.evaluate.use_union_grid()
+
+    assert n_energies == len(np.unique(np.concatenate(grids)))
+
+    fused.evaluate.reset_cache_info()
+
+    for k in (2e-3, 3e-3):
+        fused.K_3 = k
+        original.K_3 = k
+
+        for x in grids:
+            np.testing.assert_allclose(fused(x), original(x), rtol=1e-10)
+
+    # the spectrum is evaluated once per parameter point
+
+    assert fused.evaluate.cache_info()["spectrum"] == dict(hits=4, misses=2)
+
+    # a grid seen later is evaluated on its own
+
+    np.testing.assert_allclose(
+        fused(_energies[1::2]), original(_energies[1::2]), rtol=1e-10
+    )
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("gdpyc")
+
+import astropy.coordinates as coords
+import astropy.units as u
+from gdpyc import GasMap
+
+from blaze_runner.gas_map import NHIndex
+
+
+@pytest.fixture(scope="module")
+def nh_index(tmp_path_factory):
+    return NHIndex.build(tmp_path_factory.mktemp("nh_index") / "DL")
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    rng = np.random.default_rng(1234)
+
+    ra = rng.uniform(0, 360, 50)
+    dec = np.rad2deg(np.arcsin(rng.uniform(-1, 1, 50)))
+
+    return ra, dec
+
+
+def test_matches_nhf(nh_index, catalog):
+    ra, dec = catalog
+
+    c = coords.SkyCoord(ra=ra, dec=dec, unit="deg", frame="icrs")
+
+    expected = GasMap.nhf(c, nhmap="DL", radius=1 * u.deg).value
+
+    np.testing.assert_allclose(
+        nh_index.nh(ra, dec, radius=1.0), expected.astype(float), rtol=1e-10
+    )
+
+
+def test_batch_matches_scalar(nh_index, catalog):
+    ra, dec = catalog
+
+    batch = nh_index.nh(ra, dec)
+
+    single = nh_index.nh(ra[0], dec[0])
+
+    assert isinstance(single, float)
+
+    assert single == batch[0]
+
+
+def test_reload(nh_index, catalog):
+    ra, dec = catalog
+
+    reloaded = NHIndex(nh_index._directory)
+
+    assert reloaded.nhmap == "DL"
+
+    np.testing.assert_array_equal(reloaded.nh(ra, dec), nh_index.nh(ra, dec))
@@ -0,0 +1,64 @@
+import subprocess
+import sys
+
+import pytest
+
+# modules which must not be loaded by a plain import of the package
+
+_heavy_modules = (
+    "threeML",
+    "astromodels",
+    "mpi4py",
+    "netspec",
+    "gdpyc",
+    "astro_custom",
+)
+
+# the time of a cold import is in test_benchmarks
+
+_probe = """
+import sys
+
+import blaze_runner
+
+heavy = [m for m in {heavy} if m in sys.modules]
+
+print(",".join(heavy))
+"""
+
+
+def _cold_import():
+    out = subprocess.run(
+        [sys.executable, "-c", _probe.format(heavy=_heavy_modules)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+    return [m for m in out.strip().split(",") if m]
+
+
+def test_import_is_lazy():
+    loaded = _cold_import()
+
+    assert not loaded, f"importing blaze_runner loaded {loaded}"
+
+
+def test_lazy_members_resolve():
+    pytest.importorskip("threeML")
+    pytest.importorskip("astro_custom")
+
+    import blaze_runner
+
+    assert "Analysis" in dir(blaze_runner)
+
+    from blaze_runner import Analysis, DataSet, Leptonic, LogParabola
+
+    assert blaze_runner.Analysis is Analysis
+
+
+def test_unknown_attribute():
+    import blaze_runner
+
+    with pytest.raises(AttributeError):
+        blaze_runner.not_a_member
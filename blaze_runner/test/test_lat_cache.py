@@ -0,0 +1,187 @@
+import pytest
+
+pytest.importorskip("astromodels")
+
+from astromodels import (
+    ExtendedSource,
+    Gaussian_on_sphere,
+    Log_parabola,
+    Model,
+    PointSource,
+    Powerlaw,
+    SpatialTemplate_2D,
+)
+
+import blaze_runner.lat_cache as lat_cache
+from blaze_runner.lat_cache import LATProductCache, file_hash
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    directory = tmp_path / "cache"
+    directory.mkdir()
+
+    monkeypatch.setattr(lat_cache, "get_path_of_cache_dir", lambda: directory)
+
+    return directory
+
+
+@pytest.fixture
+def configuration(tmp_path):
+    evfile = tmp_path / "events.fits"
+    scfile = tmp_path / "spacecraft.fits"
+
+    evfile.write_bytes(b"events")
+    scfile.write_bytes(b"spacecraft")
+
+    return dict(
+        data=dict(evfile=str(evfile), scfile=str(scfile)),
+        selection=dict(ra=150.0, dec=5.0, emax=300000),
+        binning=dict(roiwidth=10.0),
+        gtlike=dict(edisp=True),
+        fileio=dict(outdir="__abc"),
+    )
+
+
+def _model(shape, ra=150.0):
+    return Model(
+        PointSource("src", ra, 5.0, spectral_shape=shape),
+        PointSource("neighbour", 151.0, 5.5, spectral_shape=Powerlaw()),
+    )
+
+
+def _fake_setup(outdir):
+    outdir.mkdir()
+
+    for name in ["ft1_00.fits", "ltcube_00.fits", "srcmap_00.fits"]:
+        (outdir / name).write_bytes(name.encode())
+
+    (outdir / "fermipy.log").write_text("log")
+
+
+def test_store_and_restore(tmp_path, cache_dir, configuration):
+    cache = LATProductCache(configuration, _model(Powerlaw()))
+
+    assert not cache.restore(tmp_path / "first")
+
+    _fake_setup(tmp_path / "first")
+
+    cache.store(tmp_path / "first")
+
+    # a new spectral model of the same sources hits the cache
+
+    again = LATProductCache(configuration, _model(Log_parabola()))
+
+    assert again.source_directory == cache.source_directory
+
+    outdir = tmp_path / "second"
+
+    assert again.restore(outdir)
+
+    assert (outdir / "ltcube_00.fits").is_symlink()
+    assert not (outdir / "srcmap_00.fits").is_symlink()
+    assert (outdir / "srcmap_00.fits").read_bytes() == b"srcmap_00.fits"
+    assert not (outdir / "fermipy.log").exists()
+
+
+def test_keys(tmp_path, cache_dir, configuration):
+    cache = LATProductCache(configuration, _model(Powerlaw()))
+
+    # moving a source only changes the source maps
+
+    moved = LATProductCache(configuration, _model(Powerlaw(), ra=150.5))
+
+    assert moved.data_directory == cache.data_directory
+    assert moved.source_directory != cache.source_directory
+
+    # the data files are identified by content, not by path
+
+    copied = tmp_path / "copy.fits"
+    copied.write_bytes(b"events")
+
+    configuration["data"]["evfile"] = str(copied)
+
+    assert (
+        LATProductCache(configuration, _model(Powerlaw())).data_directory
+        == cache.data_directory
+    )
+
+    configuration["selection"]["emax"] = 100000
+
+    assert (
+        LATProductCache(configuration, _model(Powerlaw())).data_directory
+        != cache.data_directory
+    )
+
+
+def _template(file_name, value):
+    import numpy as np
+    from astropy.io import fits
+    from astropy.wcs import WCS
+
+    wcs = WCS(naxis=2)
+    wcs.wcs.crpix = [5.5, 5.5]
+    wcs.wcs.cdelt = [-0.1, 0.1]
+    wcs.wcs.crval = [150.0, 5.0]
+    wcs.wcs.ctype = ["RA---CAR", "DEC--CAR"]
+
+    fits.PrimaryHDU(
+        np.full((10, 10), value), header=wcs.to_header()
+    ).writeto(file_name, overwrite=True)
+
+    return SpatialTemplate_2D(fits_file=str(file_name))
+
+
+def test_extended_source_keys(tmp_path, cache_dir, configuration):
+    def source_key(spatial_shape):
+        model = _model(Powerlaw())
+
+        model.add_source(
+            ExtendedSource(
+                "extended",
+                spatial_shape=spatial_shape,
+                spectral_shape=Powerlaw(),
+            )
+        )
+
+        return LATProductCache(configuration, model).source_directory
+
+    gaussian = source_key(Gaussian_on_sphere(lon0=150.0, lat0=5.0, sigma=1.0))
+
+    assert gaussian == source_key(
+        Gaussian_on_sphere(lon0=150.0, lat0=5.0, sigma=1.0)
+    )
+
+    # moved or wider
+
+    assert gaussian != source_key(
+        Gaussian_on_sphere(lon0=150.5, lat0=5.0, sigma=1.0)
+    )
+
+    assert gaussian != source_key(
+        Gaussian_on_sphere(lon0=150.0, lat0=5.0, sigma=2.0)
+    )
+
+    # a template is identified by its content
+
+    template = tmp_path / "template.fits"
+
+    first = source_key(_template(template, 1.0))
+
+    assert first == source_key(_template(template, 1.0))
+
+    assert first != source_key(_template(template, 2.0))
+
+
+def test_file_hash_follows_content(tmp_path, cache_dir):
+    data = tmp_path / "events.fits"
+
+    data.write_bytes(b"one")
+
+    first = file_hash(data)
+
+    assert file_hash(data) == first
+
+    data.write_bytes(b"other content")
+
+    assert file_hash(data) != first
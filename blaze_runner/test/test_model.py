@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("astro_custom")
+pytest.importorskip("netspec")
+
+from blaze_runner.model import Leptonic, LogParabola, ModelCatalog
+
+
+def test_flux_factor_is_vectorized():
+    redshifts = np.array([0.05, 0.3, 1.2])
+
+    batch = Leptonic.flux_factor(redshifts)
+
+    for z, factor in zip(redshifts, batch):
+        assert np.isclose(Leptonic.flux_factor(z), factor, rtol=1e-12)
+
+
+def test_catalog_matches_single_models():
+    names = ["src_a", "src_b", "src_c"]
+    redshifts = [0.1, 0.5, 1.0]
+    ras = [10.0, 150.0, 300.0]
+    decs = [-30.0, 5.0, 60.0]
+
+    catalog = LogParabola.from_catalog(names, redshifts, ras, decs)
+
+    assert isinstance(catalog, ModelCatalog)
+    assert len(catalog) == 3
+
+    for i, name in enumerate(names):
+        single = LogParabola(name, redshifts[i], ras[i], decs[i])
+
+        from_catalog = catalog[i]
+
+        assert from_catalog.source_name == name
+
+        assert np.isclose(
+            from_catalog.model[name].spectrum.main.shape.NH_1.value,
+            single.model[name].spectrum.main.shape.NH_1.value,
+        )
+
+
+def test_catalog_shares_the_emulator():
+    catalog = Leptonic.from_catalog(
+        ["src_a", "src_b"], [0.1, 0.5], [10.0, 150.0], [-30.0, 5.0]
+    )
+
+    a = catalog[0].model["src_a"].spectrum.main.shape
+    b = catalog.by_name("src_b").model["src_b"].spectrum.main.shape
+
+    assert a.K_3.value != b.K_3.value
+    # mw_gas * z_dust * emulator
+
+    assert a.functions[2]._model_storage is b.functions[2]._model_storage
+
+
+def test_cache_info():
+    model = LogParabola("src", 0.3, 150.0, 5.0)
+
+    energies = np.geomspace(1.0, 100.0, 50)
+
+    source = model.model["src"]
+
+    source(energies)
+    source(energies)
+
+    info = model.cache_info()
+
+    assert info["absorption"] == dict(hits=1, misses=1)
+    assert info["spectrum"] == dict(hits=1, misses=1)
+
+    model.reset_cache_info()
+
+    assert model.cache_info()["spectrum"] == dict(hits=0, misses=0)
+
+
+def test_lat_region_cache(tmp_path, monkeypatch):
+    import blaze_runner.model as model_module
+    from astromodels import Model, PointSource, Powerlaw
+
+    monkeypatch.setattr(
+        model_module, "get_path_of_cache_dir", lambda: tmp_path
+    )
+
+    region = Model(
+        PointSource("target", 150.0, 5.0, spectral_shape=Powerlaw()),
+        PointSource("neighbour", 151.0, 5.5, spectral_shape=Powerlaw()),
+    )
+
+    lat_model = tmp_path / "region.yml"
+
+    region.save(str(lat_model))
+
+    first = LogParabola(
+        "src", 0.3, 150.0, 5.0, lat_model=str(lat_model), lat_source="target"
+    )
+
+    assert len(list((tmp_path / "lat_models").glob("*.pkl"))) == 1
+
+    second = LogParabola(
+        "src", 0.3, 150.0, 5.0, lat_model=str(lat_model), lat_source="target"
+    )
+
+    assert set(first.model.point_sources) == set(second.model.point_sources)
+    assert "target" not in second.model.point_sources
+
+    for name, par in first.model.free_parameters.items():
+        cached = second.model.free_parameters[name]
+
+        assert cached.value == par.value
+        assert type(cached.prior) is type(par.prior)
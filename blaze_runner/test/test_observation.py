@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+pytest.importorskip("threeML")
+pytest.importorskip("mpi4py")
+
+from blaze_runner.observation import _link_products, _private_pfiles
+
+
+def test_link_products(tmp_path):
+    shared = tmp_path / "__shared"
+    shared.mkdir()
+
+    for name in ["ft1_00.fits", "ccube_00.fits", "srcmap_00.fits"]:
+        (shared / name).write_bytes(name.encode())
+
+    (shared / "fermipy.log").write_text("not a product")
+
+    private = tmp_path / "__shared_rank1"
+
+    _link_products(shared, private)
+
+    assert (private / "ccube_00.fits").is_symlink()
+    assert (private / "ft1_00.fits").is_symlink()
+
+    # source maps are written to by fermipy and must be private
+
+    assert not (private / "srcmap_00.fits").is_symlink()
+    assert (private / "srcmap_00.fits").read_bytes() == b"srcmap_00.fits"
+
+    assert not (private / "fermipy.log").exists()
+
+    # attaching twice is harmless
+
+    _link_products(shared, private)
+
+
+def test_private_pfiles(tmp_path, monkeypatch):
+    monkeypatch.setenv("PFILES", "/home/user/pfiles;/opt/fermitools/syspfiles")
+
+    _private_pfiles(tmp_path / "pfiles")
+
+    assert os.environ["PFILES"] == (
+        f"{tmp_path / 'pfiles'};/opt/fermitools/syspfiles"
+    )
+
+    assert (tmp_path / "pfiles").is_dir()
+
+
+def test_parallel_loading_keeps_order(ogip_data):
+    from blaze_runner.observation import DataSet
+
+    names = [f"xrt_{i}" for i in range(6)]
+
+    entries = {name: ogip_data(name) for name in names}
+
+    serial = DataSet.from_dict({k: dict(v) for k, v in entries.items()})
+
+    parallel = DataSet.from_dict(
+        {k: dict(v) for k, v in entries.items()}, max_workers=4
+    )
+
+    assert [o.plugin.name for o in parallel.observations] == names
+
+    for a, b in zip(serial.observations, parallel.observations):
+        assert a.plugin.name == b.plugin.name
+        assert a.plugin.n_data_points == b.plugin.n_data_points
+
+
+def test_snapshot_round_trip(ogip_data, tmp_path):
+    import numpy as np
+    from astromodels import Model, PointSource, Powerlaw
+
+    from blaze_runner.io.snapshot import read_snapshot
+    from blaze_runner.observation import DataSet
+
+    names = ["xrt_a", "xrt_b"]
+
+    data_set = DataSet.from_dict({name: ogip_data(name) for name in names})
+
+    data_set.to_file(tmp_path / "data_set.h5")
+
+    loaded = DataSet.from_file(tmp_path / "data_set.h5")
+
+    # the arrays are not read before they are used
+
+    for _, arrays in read_snapshot(tmp_path / "data_set.h5"):
+        assert isinstance(arrays["matrix"], np.memmap)
+        assert isinstance(arrays["observation_counts"], np.memmap)
+
+    assert [o.plugin.name for o in loaded.observations] == names
+
+    model = Model(PointSource("src", 0.0, 0.0, spectral_shape=Powerlaw()))
+
+    for a, b in zip(data_set.observations, loaded.observations):
+        assert a.data_container == b.data_container
+        assert b.plugin.n_data_points == a.plugin.n_data_points
+
+        a.plugin.set_model(model)
+        b.plugin.set_model(model)
+
+        assert b.plugin.get_log_like() == pytest.approx(
+            a.plugin.get_log_like()
+        )
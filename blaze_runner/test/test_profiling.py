@@ -0,0 +1,96 @@
+import pickle
+import time
+
+import numpy as np
+import pytest
+
+from blaze_runner.utils.profiling import CallStatistics, Profiler
+
+
+class _Plugin:
+    name = "xrt"
+
+    def get_log_like(self, delay=1e-3):
+        time.sleep(delay)
+
+        return -1.0
+
+
+def test_percentiles():
+    statistics = CallStatistics()
+
+    for latency in np.geomspace(1e-5, 1e-1, 1001):
+        statistics.record(latency)
+
+    summary = statistics.summary()
+
+    assert summary["calls"] == 1001
+
+    # good to the width of a bin
+
+    assert summary["p50"] == pytest.approx(1e-3, rel=0.15)
+    assert summary["p90"] == pytest.approx(10 ** -1.4, rel=0.15)
+
+    other = CallStatistics()
+
+    other.record(2.0)
+
+    statistics.merge(other)
+
+    assert statistics.calls == 1002
+    assert statistics.percentile(100) == pytest.approx(2.0, rel=0.15)
+
+
+def test_wrap_and_pickle():
+    profiler = Profiler()
+
+    plugin = _Plugin()
+
+    profiler.wrap(plugin, "get_log_like", plugin.name)
+
+    for _ in range(5):
+        assert plugin.get_log_like() == -1.0
+
+    plugin.get_log_like(delay=0.02)
+
+    summary = profiler.statistics["xrt"]
+
+    assert summary["calls"] == 6
+    assert summary["total"] > 0.025
+    assert summary["p50"] < 0.01 < summary["p99"]
+
+    # the plugins must stay picklable for the sampler
+
+    copy = pickle.loads(pickle.dumps(plugin))
+
+    assert copy.get_log_like() == -1.0
+
+    profiler.reset()
+
+    assert profiler.statistics["xrt"]["calls"] == 0
+
+
+def test_gather_and_table():
+    pytest.importorskip("mpi4py")
+
+    from mpi4py import MPI
+    from rich.console import Console
+
+    profiler = Profiler()
+
+    plugin = _Plugin()
+
+    profiler.wrap(plugin, "get_log_like", plugin.name)
+
+    plugin.get_log_like()
+
+    summaries = profiler.gather(MPI.COMM_SELF)
+
+    assert summaries["xrt"]["calls"] == 1
+    assert summaries["xrt"]["slowest_rank"] == summaries["xrt"]["total"]
+
+    console = Console(record=True, width=120)
+
+    console.print(Profiler.table(summaries, title="likelihood calls"))
+
+    assert "xrt" in console.export_text()
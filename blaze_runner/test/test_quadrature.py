@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("threeML")
+
+from astromodels import Log_parabola, Model, PointSource, TbAbs, ZDust
+from threeML.plugins.DispersionSpectrumLike import DispersionSpectrumLike
+from threeML.utils.OGIP.response import InstrumentResponse
+
+from blaze_runner.quadrature import gauss_legendre_integration
+
+def _response():
+    # the channels and Monte Carlo energies of the XRT PC RMF
+
+    ebounds = np.geomspace(0.3, 10.0, 1025)
+    mc_energies = np.geomspace(0.2, 12.0, 2401)
+
+    channels = np.sqrt(ebounds[1:] * ebounds[:-1])
+    energies = np.sqrt(mc_energies[1:] * mc_energies[:-1])
+
+    sigma = 0.06 * np.sqrt(energies)
+
+    matrix = np.exp(-0.5 * ((channels[:, None] - energies) / sigma) ** 2)
+
+    matrix /= matrix.sum(axis=0) + 1e-30
+
+    return InstrumentResponse(100.0 * matrix, ebounds, mc_energies)
+
+
+def _log_parabola():
+    # steep and curved, as for the synchrotron peaked blazars
+
+    return (
+        TbAbs(NH=0.05)
+        * ZDust(e_bmv=0.1)
+        * Log_parabola(K=1e-2, piv=1.0, alpha=-2.5, beta=0.5)
+    )
+
+
+def _leptonic():
+    pytest.importorskip("astro_custom")
+    pytest.importorskip("netspec")
+
+    from blaze_runner.model import Leptonic
+
+    return Leptonic("src", 0.3, 150.0, 5.0).point_source.spectrum.main.shape
+
+
+_shapes = {"logparabola": _log_parabola, "leptonic": _leptonic}
+
+
+def _plugin(shape, method, n_nodes=2):
+    plugin = DispersionSpectrumLike.from_function(
+        "xrt", source_function=Log_parabola(), response=_response()
+    )
+
+    if method == "gauss_legendre":
+        gauss_legendre_integration(plugin, n_nodes)
+
+    else:
+        plugin.model_integrate_method = method
+
+    plugin.set_model(
+        Model(PointSource("src", 150.0, 5.0, spectral_shape=shape))
+    )
+
+    return plugin
+
+
+def test_gauss_legendre_is_exact_for_cubics():
+    plugin = _plugin(Log_parabola(), "gauss_legendre")
+
+    integration = plugin._get_diff_flux_and_integral
+
+    nodes = integration._nodes.reshape(integration._weights.shape)
+
+    cubic = np.einsum("ij,ij->i", nodes**3 - 2 * nodes, integration._weights)
+
+    e1 = plugin._predefined_energies[:-1]
+    e2 = plugin._predefined_energies[1:]
+
+    np.testing.assert_allclose(
+        cubic, (e2**4 - e1**4) / 4 - (e2**2 - e1**2), rtol=1e-10
+    )
+
+
+@pytest.mark.parametrize("name", list(_shapes))
+def test_integration_accuracy(name):
+    shape = _shapes[name]()
+
+    reference = _plugin(shape, "gauss_legendre", n_nodes=16)._evaluate_model()
+
+    errors = {}
+
+    for method in ["riemann", "gauss_legendre"]:
+        counts = _plugin(shape, method)._evaluate_model()
+
+        relative = np.abs(counts / reference - 1)[reference > 0]
+
+        errors[method] = np.median(relative)
+
+    assert errors["gauss_legendre"] < 0.1 * errors["riemann"]
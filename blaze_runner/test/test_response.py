@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("threeML")
+
+from threeML.utils.OGIP.response import InstrumentResponse
+
+from blaze_runner.response import SparseFolding, sparse_folding
+
+def _response(n_channels, n_energies, width, e_min, e_max):
+    # a gaussian redistribution cut off where the RMF files stop
+    # storing elements
+
+    ebounds = np.geomspace(e_min, e_max, n_channels + 1)
+    mc_energies = np.geomspace(0.7 * e_min, 1.2 * e_max, n_energies + 1)
+
+    channels = np.sqrt(ebounds[1:] * ebounds[:-1])
+    energies = np.sqrt(mc_energies[1:] * mc_energies[:-1])
+
+    sigma = width * np.sqrt(energies)
+
+    matrix = np.exp(-0.5 * ((channels[:, None] - energies) / sigma) ** 2)
+
+    matrix /= np.maximum(matrix.sum(axis=0), 1e-30)
+    matrix[matrix < 1e-6] = 0
+
+    return InstrumentResponse(100.0 * matrix, ebounds, mc_energies)
+
+
+# the channel and energy grids of the Swift XRT PC and NuSTAR FPM RMFs
+
+_shapes = {
+    "xrt": (1024, 2400, 0.06, 0.3, 10.0),
+    "nustar": (4096, 4096, 0.04, 3.0, 79.0),
+}
+
+
+def _integral(e1, e2):
+    # a power law with index -2, infinite at the first bin edge
+
+    e1 = e1.copy()
+    e1[0] = 0
+
+    with np.errstate(divide="ignore"):
+        return 1 / e1 - 1 / e2
+
+
+@pytest.mark.parametrize("instrument", list(_shapes))
+def test_sparse_matches_dense(instrument):
+    response = _response(*_shapes[instrument])
+
+    response.set_function(_integral)
+
+    dense = response.convolve()
+
+    assert sparse_folding(response) is not None
+
+    np.testing.assert_allclose(response.convolve(), dense, rtol=1e-12)
+
+    fluxes = _integral(
+        response.monte_carlo_energies[:-1], response.monte_carlo_energies[1:]
+    )
+
+    np.testing.assert_allclose(
+        response.convolve(precalc_fluxes=fluxes), dense, rtol=1e-12
+    )
+
+
+def test_dense_matrix_is_kept():
+    rng = np.random.default_rng(1)
+
+    response = InstrumentResponse(
+        rng.uniform(size=(64, 128)),
+        np.geomspace(1, 10, 65),
+        np.geomspace(1, 10, 129),
+    )
+
+    assert sparse_folding(response) is None
+
+    assert not isinstance(response.convolve, SparseFolding)
+
+
+def test_sparse_in_plugin(ogip_data):
+    from astromodels import Model, PointSource, Powerlaw
+
+    from blaze_runner.observation import DataSet
+
+    data_set = DataSet.from_dict({"xrt": ogip_data("xrt")})
+
+    plugin = data_set.observations[0].plugin
+
+    response = plugin.observed_spectrum.response
+
+    assert isinstance(response.convolve, SparseFolding)
+
+    plugin.set_model(
+        Model(PointSource("src", 0.0, 0.0, spectral_shape=Powerlaw()))
+    )
+
+    sparse = plugin.get_log_like()
+
+    del response.convolve
+
+    assert plugin.get_log_like() == pytest.approx(sparse)
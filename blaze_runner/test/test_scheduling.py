@@ -0,0 +1,271 @@
+import time
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("mpi4py")
+
+from mpi4py import MPI
+
+from blaze_runner.scheduling import (
+    CostModel,
+    WorkQueue,
+    append_cost,
+    job_sizes,
+    journal_file,
+    longest_first,
+    plan_pools,
+    split_pools,
+)
+
+
+def _config(model, *data_types, lat_model=None):
+    return dict(
+        data={f"{t}_{i}": dict(type=t) for i, t in enumerate(data_types)},
+        model=dict(name=model, lat_model=lat_model),
+    )
+
+
+def test_cost_model_priors():
+    cost_model = CostModel()
+
+    xray = cost_model.estimate("a", _config("logparabola", "xrt"))
+
+    lat = cost_model.estimate("b", _config("logparabola", "xrt", "lat"))
+
+    leptonic = cost_model.estimate("c", _config("leptonic", "xrt", "lat"))
+
+    region = cost_model.estimate(
+        "d", _config("leptonic", "xrt", "lat", lat_model="region.yml")
+    )
+
+    assert xray < lat < leptonic < region
+
+
+def test_cost_model_refines(tmp_path):
+    cost_model = CostModel()
+
+    short = _config("logparabola", "xrt", "uvot")
+
+    long = _config("leptonic", "xrt", "lat")
+
+    # the log parabola fits turn out ten times faster than thought
+
+    prior = cost_model.estimate("a", short)
+
+    cost_model.record("a", short, prior / 10)
+
+    assert cost_model.estimate("b", short) == pytest.approx(prior / 10)
+
+    # a job which ran before takes as long again
+
+    cost_model.record("c", long, 1234.0)
+
+    assert cost_model.estimate("c", long) == 1234.0
+
+    # the measurements are kept between batches
+
+    cost_model.save(tmp_path / "costs.json")
+
+    loaded = CostModel.load(tmp_path / "costs.json")
+
+    assert loaded.estimate("c", long) == 1234.0
+    assert loaded.estimate("b", short) == pytest.approx(prior / 10)
+
+    # a changed configuration is estimated again
+
+    assert loaded.estimate("c", _config("leptonic", "xrt")) != 1234.0
+
+    assert CostModel.load(tmp_path / "none.json").estimate("a", short) == prior
+
+
+def test_longest_first():
+    assert longest_first([1.0, 5.0, 3.0, 5.0]) == [1, 3, 2, 0]
+
+
+def _draw_all(queue, comm, queue_index=0):
+    # rank 0 hands out the jobs, the other ranks draw until the queue
+    # is empty
+
+    if comm.Get_size() > 1 and comm.Get_rank() == 0:
+        queue.serve(comm.Get_size() - 1)
+
+        return []
+
+    drawn = []
+
+    while True:
+        job = queue.next(queue_index)
+
+        if job is None:
+            return drawn
+
+        drawn.append(job)
+
+
+def test_work_queue():
+    comm = MPI.COMM_WORLD
+
+    jobs = [5, 3, 0, 1, 4, 2]
+
+    queue = WorkQueue(comm, [jobs])
+
+    drawn = _draw_all(queue, comm)
+
+    # every job is handed out once over all ranks, in order on one
+
+    all_drawn = [j for d in comm.allgather(drawn) for j in d]
+
+    assert sorted(all_drawn) == sorted(jobs)
+
+    if comm.Get_size() == 1:
+        assert drawn == jobs
+
+
+def test_work_queue_without_mpi_progress(tmp_path):
+    comm = MPI.COMM_WORLD
+
+    if comm.Get_size() < 3:
+        pytest.skip("needs a dispatcher and two group leaders")
+
+    flag = Path(comm.bcast(str(tmp_path), root=0)) / "drawn"
+
+    queue = WorkQueue(comm, [list(range(10))])
+
+    rank = comm.Get_rank()
+
+    drawn = []
+
+    if rank == 0:
+        queue.serve(comm.Get_size() - 1)
+
+    elif rank == 1:
+        drawn.append(queue.next())
+
+        # a job which does not enter MPI until the other leader has
+        # drawn all the others
+
+        t0 = time.monotonic()
+
+        while not flag.exists():
+            assert time.monotonic() - t0 < 60, "the other leader is stuck"
+
+            time.sleep(0.01)
+
+        assert queue.next() is None
+
+    elif rank == 2:
+        drawn = _draw_all(queue, comm)
+
+        flag.touch()
+
+    else:
+        drawn = _draw_all(queue, comm)
+
+    all_drawn = [j for d in comm.allgather(drawn) for j in d]
+
+    assert sorted(all_drawn) == list(range(10))
+
+
+def test_split_pools():
+    comm = MPI.COMM_WORLD
+
+    n_workers = max(comm.Get_size() - 1, 1)
+
+    sizes = job_sizes([2, None], [1.0, 1.0], n_workers, ranks_per_job=1)
+
+    pools, _ = plan_pools(sizes, [1.0, 1.0], n_workers)
+
+    group, pool = split_pools(comm, pools)
+
+    if comm.Get_size() > 1 and comm.Get_rank() == 0:
+        # the dispatcher
+
+        assert group == MPI.COMM_NULL and pool is None
+
+        leader = None
+
+    else:
+        assert group.Get_size() >= pools[pool][0]
+
+        leader = comm.Get_rank() if group.Get_rank() == 0 else None
+
+    leaders = [r for r in comm.allgather(leader) if r is not None]
+
+    assert len(leaders) == sum(n for _, n in pools)
+
+
+
+def test_cost_journals(tmp_path):
+    costs_file = tmp_path / "costs.json"
+
+    config = _config("logparabola", "xrt")
+
+    CostModel().save(costs_file)
+
+    # two ranks record their jobs as they finish, one is stopped while
+    # writing a line
+
+    append_cost(journal_file(costs_file, 0), "a", config, 10.0)
+    append_cost(journal_file(costs_file, 3), "b", config, 20.0)
+
+    with journal_file(costs_file, 3).open("a") as f:
+        f.write('{"name": "c", "mod')
+
+    cost_model = CostModel.load(costs_file)
+
+    assert cost_model.estimate("a", config) == 10.0
+    assert cost_model.estimate("b", config) == 20.0
+    assert cost_model.estimate("c", config) == pytest.approx(15.0)
+
+    # the journals are merged into the measurements
+
+    cost_model.save(costs_file)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["costs.json"]
+
+    assert CostModel.load(costs_file).estimate("b", config) == 20.0
+
+
+def test_job_sizes():
+    # the ranks entries, else ranks_per_job, at most all ranks
+
+    assert job_sizes([64, None, 2], [1.0] * 3, 32, 4) == [32, 4, 2]
+
+    # else by the estimated time, the LAT fit gets more ranks than the
+    # X-ray fits also with more jobs than ranks
+
+    assert job_sizes([None] * 10, [30.0] + [1.0] * 9, 8) == [4] + [1] * 9
+
+    with pytest.raises(RuntimeError):
+        job_sizes([0], [1.0], 8)
+
+
+def test_plan_pools_mixed_ranks_entries():
+    estimates = [100.0, 10.0, 10.0, 10.0]
+
+    sizes = job_sizes([64, None, None, None], estimates, 80)
+
+    assert sizes == [64, 4, 4, 4]
+
+    # the X-ray fits do not take 64 ranks each
+
+    pools, job_pools = plan_pools(sizes, estimates, 80)
+
+    assert pools == [(64, 1), (4, 3)]
+
+    assert job_pools == [0, 1, 1, 1]
+
+    # the ranks left go to the pool with the most time per group
+
+    pools, job_pools = plan_pools([8, 2, 2, 2, 2], [50.0] + [40.0] * 4, 14)
+
+    assert pools == [(8, 1), (2, 3)]
+
+    # too few ranks for a group of every size
+
+    pools, job_pools = plan_pools([64, 4], [1.0, 1.0], 64)
+
+    assert pools == [(4, 2)]
+
+    assert job_pools == [0, 0]
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("mpi4py")
+
+from mpi4py import MPI
+
+from blaze_runner.shared_memory import share_arrays
+
+
+def test_share_arrays():
+    rng = np.random.default_rng(1)
+
+    arrays = [
+        rng.normal(size=(64, 128)),
+        np.arange(7, dtype=np.int32),
+        np.empty(0),
+    ]
+
+    shared = share_arrays(arrays, comm=MPI.COMM_SELF)
+
+    for a, b in zip(arrays, shared):
+        np.testing.assert_array_equal(a, b)
+
+        assert b.dtype == a.dtype
+        assert not b.flags.writeable
+
+    # the views are aligned in one window, not copies of the inputs
+
+    assert not np.shares_memory(arrays[0], shared[0])
+    assert shared[0].ctypes.data % 64 == 0
+    assert shared[1].ctypes.data % 64 == 0
+
+
+def test_share_response(ogip_data):
+    pytest.importorskip("threeML")
+
+    from astromodels import Model, PointSource, Powerlaw
+
+    from blaze_runner.observation import DataSet
+
+    data_set = DataSet.from_dict({"xrt": ogip_data("xrt")})
+
+    plugin = data_set.observations[0].plugin
+
+    plugin.set_model(
+        Model(PointSource("src", 0.0, 0.0, spectral_shape=Powerlaw()))
+    )
+
+    log_like = plugin.get_log_like()
+
+    data_set.share()
+
+    assert not plugin.observed_spectrum.response.matrix.flags.writeable
+
+    assert plugin.get_log_like() == pytest.approx(log_like)
+
+
+def test_share_different_arrays():
+    comm = MPI.COMM_WORLD
+
+    if comm.Get_size() < 2:
+        pytest.skip("needs more than one rank")
+
+    # every rank raises, none waits for the others
+
+    with pytest.raises(RuntimeError):
+        share_arrays([np.zeros(comm.Get_rank() + 1)], comm=comm)
+
+
+def test_share_different_data_sets(ogip_data):
+    pytest.importorskip("threeML")
+
+    from blaze_runner.observation import DataSet
+
+    comm = MPI.COMM_WORLD
+
+    if comm.Get_size() < 2:
+        pytest.skip("needs more than one rank")
+
+    name = f"xrt_{comm.Get_rank()}"
+
+    data_set = DataSet.from_dict({name: ogip_data(name)})
+
+    with pytest.raises(RuntimeError):
+        data_set.share(comm)
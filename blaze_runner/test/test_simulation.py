@@ -0,0 +1,185 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("threeML")
+pytest.importorskip("mpi4py")
+
+from astromodels import Log_parabola, Model, PointSource, Powerlaw
+
+
+def _likelihood_model(data_set):
+    model = Model(
+        PointSource(
+            "src",
+            150.0,
+            5.0,
+            spectral_shape=Log_parabola(
+                K=1e-2, piv=1.0, alpha=-2.0, beta=0.1
+            ),
+        )
+    )
+
+    for observation in data_set.observations:
+        for parameter in observation.plugin.nuisance_parameters.values():
+            model.add_external_parameter(parameter)
+
+    return model
+
+
+def test_simulated_data_set(tmp_path):
+    from blaze_runner.observation import (
+        DataSet,
+        SimulatedGRONDObservation,
+        SimulatedLATObservation,
+        SimulatedUVOTObservation,
+        XRTObservation,
+    )
+    from blaze_runner.simulation import simulate_data_set
+
+    entries = simulate_data_set(
+        tmp_path, 150.0, 5.0, n_grond=1, n_lat=1, seed=1234
+    )
+
+    data_set = DataSet.from_dict(entries)
+
+    assert [type(o) for o in data_set.observations] == [
+        XRTObservation,
+        SimulatedUVOTObservation,
+        SimulatedGRONDObservation,
+        SimulatedLATObservation,
+    ]
+
+    # the response is of production size
+
+    response = data_set.observations[0].plugin.response
+
+    assert response.matrix.shape == (1024, 2400)
+
+    model = _likelihood_model(data_set)
+
+    data_set.setup(model)
+
+    for observation in data_set.observations:
+        observation.plugin.set_model(model)
+
+    log_likes = {
+        o.plugin.name: o.plugin.get_log_like() for o in data_set.observations
+    }
+
+    assert np.all(np.isfinite(list(log_likes.values())))
+
+    # the magnitudes are simulated from the model, which fits them
+
+    assert log_likes["uvot_0"] > -20
+    assert log_likes["grond_0"] > -20
+
+
+def test_simulated_lat(tmp_path):
+    from blaze_runner.observation import (
+        SimulatedLATDataContainer,
+        SimulatedLATObservation,
+    )
+    from blaze_runner.simulation import simulate_lat
+
+    entry = simulate_lat(tmp_path, "lat", 150.0, 5.0, n_pixels=20, seed=1)
+
+    entry.pop("type")
+
+    plugin = SimulatedLATObservation(
+        SimulatedLATDataContainer(name="lat", **entry)
+    ).plugin
+
+    assert list(plugin.nuisance_parameters) == [
+        "lat_galdiff_Prefactor",
+        "lat_isodiff_Normalization",
+    ]
+
+    model = Model(
+        PointSource(
+            "src",
+            150.0,
+            5.0,
+            spectral_shape=Powerlaw(K=1e-13, piv=1e6, index=-2.2),
+        ),
+        # outside the ROI
+        PointSource(
+            "far",
+            170.0,
+            5.0,
+            spectral_shape=Powerlaw(K=1e-13, piv=1e6, index=-2.2),
+        ),
+    )
+
+    plugin.set_model(model)
+
+    assert plugin.get_number_of_data_points() == 30 * 20 * 20
+
+    log_like = plugin.get_log_like()
+
+    # the simulated normalization is preferred
+
+    model.src.spectrum.main.shape.K = 5e-14
+
+    assert plugin.get_log_like() < log_like
+
+    model.src.spectrum.main.shape.K = 1e-13
+
+    plugin.nuisance_parameters["lat_galdiff_Prefactor"].value = 1.3
+
+    assert plugin.get_log_like() < log_like
+
+
+def test_simulation_is_reproducible(tmp_path):
+    import h5py
+    from astropy.io import fits
+    from threeML.utils.photometry.photometric_observation import (
+        PhotometericObservation,
+    )
+
+    from blaze_runner.simulation import simulate_data_set
+
+    def simulate(name, seed):
+        entries = simulate_data_set(
+            tmp_path / name, 150.0, 5.0, n_lat=1, seed=seed
+        )
+
+        with fits.open(entries["xrt_0"]["observation"].split("{")[0]) as f:
+            xrt = f[1].data["RATE"].copy()
+
+        uvot = PhotometericObservation.from_hdf5(
+            entries["uvot_0"]["observation"]
+        )
+
+        with h5py.File(entries["lat_0"]["cube"], "r") as f:
+            lat = f["counts"][()]
+
+        return [xrt, np.array([v[0] for _, v in uvot.items()]), lat]
+
+    first = simulate("first", 1)
+
+    for a, b in zip(first, simulate("second", 1)):
+        np.testing.assert_array_equal(a, b)
+
+    for a, b in zip(first, simulate("other", 2)):
+        assert not np.array_equal(a, b)
+
+
+def test_simpson_over_log_bins():
+    from blaze_runner.simulation import _simpson, _simpson_nodes
+
+    # ten bins per decade of an E^-2 spectrum
+
+    edges = np.geomspace(1e5, 1e8, 31)
+
+    integrals = _simpson(edges, _simpson_nodes(edges) ** -2.0)
+
+    exact = 1 / edges[:-1] - 1 / edges[1:]
+
+    np.testing.assert_allclose(integrals, exact, rtol=2e-4)
+
+
+def test_unknown_instrument(tmp_path):
+    from blaze_runner.simulation import simulate_xray
+
+    with pytest.raises(RuntimeError):
+        simulate_xray(tmp_path, "x", instrument="chandra")
@@ -23,9 +23,28 @@ class Logging:
     level: str = "WARNING"
 
 
+@dataclass
+class Performance:
+    tabulate_absorption: bool = True
+    tabulate_extinction: bool = True
+    fused_evaluation: bool = True
+    cache_lat_models: bool = True
+    cache_lat_products: bool = True
+    load_workers: int = 1
+    share_memory: bool = True
+    sparse_responses: bool = True
+    integrate_method: str = "riemann"
+    quadrature_nodes: int = 2
+    union_energy_grid: bool = True
+    profile_likelihood: bool = False
+    stream_posterior: bool = False
+    load_streamed_posterior: bool = True
+
+
 @dataclass
 class blaze_runnerConfig:
     logging: Logging = field(default_factory=Logging)
+    performance: Performance = field(default_factory=Performance)
 
 
 # Read the default config
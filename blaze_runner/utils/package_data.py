@@ -2,8 +2,6 @@ import os
 from pathlib import Path
 from shutil import copyfile
 
-import pkg_resources
-
 
 def get_path_of_data_dir() -> Path:
     """
@@ -12,9 +10,10 @@ def get_path_of_data_dir() -> Path:
     :returns:
 
     """
-    file_path: str = pkg_resources.resource_filename("blaze_runner", "data")
+    # resolved relative to the package rather than through pkg_resources,
+    # whose import alone costs ~0.1 s
 
-    return Path(file_path)
+    return Path(__file__).parent.parent / "data"
 
 
 def get_path_of_data_file(data_file: str) -> Path:
@@ -72,6 +71,22 @@ def get_path_of_log_file(log_file: str) -> Path:
     return get_path_of_log_dir() / log_file
 
 
+def get_path_of_cache_dir() -> Path:
+    """
+    return the path of the directory holding
+    cached products (indices, models, etc.)
+
+    :returns:
+
+    """
+    p: Path = Path("~/.cache/blaze_runner").expanduser()
+
+    if not p.exists():
+        p.mkdir(parents=True, exist_ok=True)
+
+    return p
+
+
 def get_path_of_user_config() -> Path:
     """
     get the path to the user configuration
@@ -90,5 +105,6 @@ def get_path_of_user_config() -> Path:
 __all__ = [
     "get_path_of_data_file",
     "get_path_of_data_dir",
+    "get_path_of_cache_dir",
     "get_path_of_user_config",
 ]
@@ -0,0 +1,225 @@
+import math
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from rich.table import Table
+
+from .logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+# the latencies are counted in logarithmic bins from 100 ns to 1000 s,
+# which is constant in memory, cheap to record and exact to merge
+# between ranks. Percentiles are good to the width of a bin (~12%)
+
+_min_latency = 1e-7
+
+_bins_per_decade = 20
+
+_n_bins = 10 * _bins_per_decade
+
+_percentiles = (50, 90, 99)
+
+
+class CallStatistics:
+    def __init__(self) -> None:
+        """
+        the number of calls, total time and latency histogram of a
+        function
+
+        """
+        self.calls: int = 0
+
+        self.total: float = 0.0
+
+        self.histogram: List[int] = [0] * _n_bins
+
+    def record(self, latency: float) -> None:
+        self.calls += 1
+
+        self.total += latency
+
+        if latency <= _min_latency:
+            i = 0
+
+        else:
+            i = min(
+                int(math.log10(latency / _min_latency) * _bins_per_decade),
+                _n_bins - 1,
+            )
+
+        self.histogram[i] += 1
+
+    def merge(self, other: "CallStatistics") -> None:
+        self.calls += other.calls
+
+        self.total += other.total
+
+        self.histogram = [
+            a + b for a, b in zip(self.histogram, other.histogram)
+        ]
+
+    def percentile(self, q: float) -> float:
+        """
+        the latency below which q percent of the calls were, at the
+        upper edge of its bin
+
+        :param q: the percentile
+        :type q: float
+        :returns:
+
+        """
+        if self.calls == 0:
+            return np.nan
+
+        i = np.searchsorted(np.cumsum(self.histogram), q / 100 * self.calls)
+
+        return _min_latency * 10 ** ((i + 1) / _bins_per_decade)
+
+    def summary(self) -> Dict[str, float]:
+        out = dict(
+            calls=self.calls,
+            total=self.total,
+            mean=self.total / self.calls if self.calls else np.nan,
+        )
+
+        for q in _percentiles:
+            out[f"p{q}"] = self.percentile(q)
+
+        return out
+
+
+class _Timed:
+    def __init__(
+        self, function: Callable, statistics: CallStatistics
+    ) -> None:
+        # a class rather than a closure so that the plugins and models
+        # stay picklable
+
+        self._function: Callable = function
+
+        self._statistics: CallStatistics = statistics
+
+    def __call__(self, *args, **kwargs) -> Any:
+        t0 = time.perf_counter()
+
+        out = self._function(*args, **kwargs)
+
+        self._statistics.record(time.perf_counter() - t0)
+
+        return out
+
+
+class Profiler:
+    def __init__(self) -> None:
+        """
+        call counts and latencies of the functions it wraps
+
+        """
+        self._statistics: Dict[str, CallStatistics] = {}
+
+    def wrap(self, obj: Any, attribute: str, name: str) -> None:
+        """
+        time every call to a method of an object. The method is
+        replaced on the instance only
+
+        :param obj: the object
+        :type obj: Any
+        :param attribute: the name of the method
+        :type attribute: str
+        :param name: the name the calls are recorded under
+        :type name: str
+        :returns:
+
+        """
+        statistics = self._statistics.setdefault(name, CallStatistics())
+
+        setattr(obj, attribute, _Timed(getattr(obj, attribute), statistics))
+
+    @property
+    def statistics(self) -> Dict[str, Dict[str, float]]:
+        """
+        the summary of the calls of this rank so far: number of calls,
+        total and mean time and percentiles in seconds
+
+        """
+        return {k: v.summary() for k, v in self._statistics.items()}
+
+    def reset(self) -> None:
+        for k in self._statistics:
+            self._statistics[k] = CallStatistics()
+
+    def gather(self, comm, root: int = 0) -> Optional[Dict[str, Any]]:
+        """
+        merge the calls of all ranks. Collective over comm
+
+        :param comm: the communicator
+        :param root: the rank receiving the result
+        :type root: int
+        :returns: the summaries over all ranks and of the slowest rank
+        by name on the root, None on the others
+
+        """
+        all_statistics = comm.gather(self._statistics, root=root)
+
+        if comm.Get_rank() != root:
+            return None
+
+        merged: Dict[str, CallStatistics] = {}
+
+        slowest: Dict[str, float] = {}
+
+        for statistics in all_statistics:
+            for k, v in statistics.items():
+                merged.setdefault(k, CallStatistics()).merge(v)
+
+                slowest[k] = max(slowest.get(k, 0.0), v.total)
+
+        return {
+            k: dict(v.summary(), slowest_rank=slowest[k])
+            for k, v in merged.items()
+        }
+
+    @staticmethod
+    def table(summaries: Dict[str, Dict[str, float]], title: str) -> Table:
+        """
+        a table of the summaries from statistics or gather
+
+        :param summaries: the summaries by name
+        :type summaries: Dict[str, Dict[str, float]]
+        :param title: the title of the table
+        :type title: str
+        :returns:
+
+        """
+        table = Table(title=title)
+
+        table.add_column("function")
+        table.add_column("calls", justify="right")
+        table.add_column("total [s]", justify="right")
+
+        if any("slowest_rank" in v for v in summaries.values()):
+            table.add_column("slowest rank [s]", justify="right")
+
+        table.add_column("mean [ms]", justify="right")
+
+        for q in _percentiles:
+            table.add_column(f"p{q} [ms]", justify="right")
+
+        ordered = sorted(summaries.items(), key=lambda kv: -kv[1]["total"])
+
+        for name, v in ordered:
+            row = [name, f"{v['calls']:d}", f"{v['total']:.2f}"]
+
+            if "slowest_rank" in v:
+                row.append(f"{v['slowest_rank']:.2f}")
+
+            row.append(f"{v['mean'] * 1e3:.3f}")
+
+            row.extend(f"{v[f'p{q}'] * 1e3:.3f}" for q in _percentiles)
+
+            table.add_row(*row)
+
+        return table